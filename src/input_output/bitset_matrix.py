@@ -0,0 +1,247 @@
+'''
+%        Copyright 2022 Jesús Calvillo <jescalvillot@gmail.com>
+%
+%      Licensed under the Apache License, Version 2.0 (the "License");
+%      you may not use this file except in compliance with the License.
+%      You may obtain a copy of the License at
+%
+%           http://www.apache.org/licenses/LICENSE-2.0
+%
+%     Unless required by applicable law or agreed to in writing, software
+%     distributed under the License is distributed on an "AS IS" BASIS,
+%     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+%     See the License for the specific language governing permissions and
+%     limitations under the License.
+
+Bitset backend for the situation space matrix.
+
+Each basic proposition (column of the matrix) is stored as a packed bitset of uint64 words, where bit i of the bitset
+is the value of the proposition at observation i (word i//64, bit i%64). Compared to the int64 matrix this uses 64 times less
+memory, and the probability functions of dataset.py become word-wise bit operations plus a popcount:
+    conjunction -> &, disjunction -> |, negation -> ~, number of observations where a vector is true -> popcount
+Moving in time (slide_time) becomes a bit shift of the whole bitset.
+'''
+
+import os
+import json
+import numpy as np
+
+WORD_BITS=64
+
+
+def popcount(words):
+    '''
+    Number of bits that are on in an array of uint64 words (summed over the last axis)
+    '''
+    if hasattr(np,"bitwise_count"):
+        return np.bitwise_count(words).sum(axis=-1,dtype=np.int64)
+    #numpy<2.0 has no popcount, we count the bits of each byte with a lookup table
+    table=np.array([bin(i).count("1") for i in range(256)],dtype=np.uint8)
+    as_bytes=np.ascontiguousarray(words).view(np.uint8)
+    return table[as_bytes].sum(axis=-1,dtype=np.int64)
+
+
+def pack_bits(vector):
+    '''
+    Packs a binary vector (or a matrix, one vector per row) into uint64 words
+    '''
+    vector=np.asarray(vector)!=0
+    n_words=(vector.shape[-1]+WORD_BITS-1)//WORD_BITS
+    packed=np.packbits(vector,axis=-1,bitorder="little")
+    padded=np.zeros(vector.shape[:-1]+(n_words*8,),dtype=np.uint8)
+    padded[...,:packed.shape[-1]]=packed
+    return padded.view("<u8")
+
+
+def unpack_bits(words,n_bits):
+    '''
+    Inverse of pack_bits
+    '''
+    as_bytes=np.ascontiguousarray(words).astype("<u8",copy=False).view(np.uint8)
+    return np.unpackbits(as_bytes,axis=-1,count=n_bits,bitorder="little")
+
+
+def shift_bits(words,timesteps,n_bits):
+    '''
+    Bitset version of slide_time:
+    timesteps<0 moves back in time, bit i takes the value of bit i-timesteps (zeros are added at the end)
+    timesteps>0 moves forward in time, bit i takes the value of bit i-timesteps (zeros are added at the beginning)
+    '''
+    words=np.asarray(words,dtype=np.uint64)
+    if timesteps==0:return words.copy()
+    shift=abs(timesteps)
+    word_shift=shift//WORD_BITS
+    bit_shift=np.uint64(shift%WORD_BITS)
+    n_words=words.shape[-1]
+    result=np.zeros_like(words)
+    if word_shift>=n_words:return result
+
+    if timesteps<0:
+        moved=words[...,word_shift:]
+        result[...,:n_words-word_shift]=moved>>bit_shift
+        if bit_shift:
+            result[...,:n_words-word_shift-1]|=moved[...,1:]<<(np.uint64(WORD_BITS)-bit_shift)
+    else:
+        moved=words[...,:n_words-word_shift]
+        result[...,word_shift:]=moved<<bit_shift
+        if bit_shift:
+            result[...,word_shift+1:]|=moved[...,:-1]>>(np.uint64(WORD_BITS)-bit_shift)
+        result=mask_tail(result,n_bits)
+    return result
+
+
+def mask_tail(words,n_bits):
+    '''
+    Turns off the bits beyond n_bits in the last word (they can be turned on by negations and shifts)
+    '''
+    remainder=n_bits%WORD_BITS
+    if remainder:
+        words=np.array(words,dtype=np.uint64)
+        words[...,-1]&=np.uint64((1<<remainder)-1)
+    return words
+
+
+class Bitset_Situation_Matrix:
+    '''
+    Situation space matrix stored as one bitset per basic proposition.
+    Vectors handled by the methods below are bitsets (uint64 arrays), obtained with column(), pack() or the logical operations.
+    '''
+    def __init__(self,matrix,basic_props):
+        '''
+        matrix: observations x basic propositions, as returned by load_prolog_situation_space_matrix
+        '''
+        matrix=np.asarray(matrix)
+        self.basic_props=list(basic_props)
+        self.prop_index={prop:i for i,prop in enumerate(self.basic_props)}
+        self.n_observations=matrix.shape[0]
+        self.columns=pack_bits(matrix.T)
+
+    @classmethod
+    def from_words(cls,columns,basic_props,n_observations):
+        bitset_matrix=cls.__new__(cls)
+        bitset_matrix.basic_props=list(basic_props)
+        bitset_matrix.prop_index={prop:i for i,prop in enumerate(bitset_matrix.basic_props)}
+        bitset_matrix.n_observations=n_observations
+        bitset_matrix.columns=columns
+        return bitset_matrix
+
+    @classmethod
+    def from_observations_file(cls,filename,chunk_size=WORD_BITS*1024):
+        '''
+        Reads an .observations file in chunks of rows, so that the full int matrix is never held in memory
+        '''
+        chunk_size=max(WORD_BITS,chunk_size-chunk_size%WORD_BITS) #chunks have to fill whole words
+        chunks=[]
+        n_observations=0
+        with open(filename,'r') as file:
+            basic_props=file.readline().split()
+            rows=[]
+            for line in file:
+                rows.append(line.split())
+                if len(rows)==chunk_size:
+                    chunks.append(pack_bits(np.asarray(rows,dtype=float).T))
+                    n_observations+=len(rows)
+                    rows=[]
+            if rows:
+                chunks.append(pack_bits(np.asarray(rows,dtype=float).T))
+                n_observations+=len(rows)
+        if chunks:columns=np.concatenate(chunks,axis=1)
+        else:columns=np.zeros((len(basic_props),0),dtype=np.uint64)
+        return cls.from_words(columns,basic_props,n_observations)
+
+    def save(self,path):
+        '''
+        Saves the bitsets into the directory path (columns.npy and meta.json), they can be memory mapped by load()
+        '''
+        os.makedirs(path,exist_ok=True)
+        np.save(os.path.join(path,"columns.npy"),np.ascontiguousarray(self.columns))
+        with open(os.path.join(path,"meta.json"),'w') as meta_file:
+            json.dump({"basic_props":self.basic_props,"n_observations":self.n_observations},meta_file)
+
+    @classmethod
+    def load(cls,path,mmap=True):
+        with open(os.path.join(path,"meta.json"),'r') as meta_file:
+            meta=json.load(meta_file)
+        columns=np.load(os.path.join(path,"columns.npy"),mmap_mode='r' if mmap else None)
+        return cls.from_words(columns,meta["basic_props"],meta["n_observations"])
+
+    def column(self,prop):
+        '''
+        Bitset of a basic proposition, given by name or by index
+        '''
+        if isinstance(prop,str):prop=self.prop_index[prop]
+        return self.columns[prop]
+
+    def pack(self,vector):
+        return pack_bits(vector)
+
+    def unpack(self,words):
+        return unpack_bits(words,self.n_observations)
+
+    def conjunction(self,*vectors):
+        result=vectors[0]
+        for vector in vectors[1:]:result=result & vector
+        return result
+
+    def disjunction(self,*vectors):
+        result=vectors[0]
+        for vector in vectors[1:]:result=result | vector
+        return result
+
+    def negation(self,vector):
+        return mask_tail(~vector,self.n_observations)
+
+    def slide_time(self,vector,timesteps):
+        return shift_bits(vector,timesteps,self.n_observations)
+
+    def count(self,vector):
+        return int(popcount(vector))
+
+    def prior(self,vector):
+        return self.count(vector)/self.n_observations
+
+    def jointp(self,vector_A,vector_B):
+        return self.count(vector_A & vector_B)/self.n_observations
+
+    def condp(self,vector_A,given_vector_B):
+        prior_B=self.count(given_vector_B)
+        if prior_B==0:return 0
+        return self.count(vector_A & given_vector_B)/prior_B
+
+    def get_prior_probs(self):
+        return popcount(self.columns)/self.n_observations
+
+    def print_prior_probs(self):
+        for i,prior in enumerate(self.get_prior_probs()):
+            print(i,self.basic_props[i],prior)
+
+    def get_conditional_joint_probs(self):
+        '''
+        Same output as get_conditional_joint_probs in dataset.py: jointps[i,j]=P(i,j) and condps[i,j]=P(j|i)
+        '''
+        n_props=len(self.basic_props)
+        intersections=np.zeros((n_props,n_props),dtype=np.int64)
+        for i in range(n_props):
+            intersections[i]=popcount(self.columns & self.columns[i])
+        priors=np.diagonal(intersections).astype(float)
+        jointps=intersections/self.n_observations
+        condps=np.zeros((n_props,n_props),dtype=float)
+        nonzero=priors>0
+        condps[nonzero]=intersections[nonzero]/priors[nonzero,None]
+        return jointps,condps
+
+    def get_condps_through_time(self,target_vector,side_size=7,interest_indices=[]):
+        '''
+        Same output as get_condps_through_time in dataset.py, target_vector is a bitset
+        '''
+        steps=list(range(-side_size,side_size+1,1))
+        if not len(interest_indices):interest_indices=range(len(self.basic_props))
+        interest_columns=self.columns[list(interest_indices)]
+
+        condps=np.zeros((len(interest_columns),len(steps)), dtype=float)
+        for time in steps:
+            vector=self.slide_time(target_vector,time)
+            prior=self.count(vector)
+            if prior==0:continue
+            condps[:,time+side_size]=popcount(interest_columns & vector)/prior
+        return condps
@@ -0,0 +1,73 @@
+'''
+%        Copyright 2022 Jesús Calvillo <jescalvillot@gmail.com>
+%
+%      Licensed under the Apache License, Version 2.0 (the "License");
+%      you may not use this file except in compliance with the License.
+%      You may obtain a copy of the License at
+%
+%           http://www.apache.org/licenses/LICENSE-2.0
+%
+%     Unless required by applicable law or agreed to in writing, software
+%     distributed under the License is distributed on an "AS IS" BASIS,
+%     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+%     See the License for the specific language governing permissions and
+%     limitations under the License.
+
+Checks that the core modules of input_output can be imported quickly, i.e. without pulling in the heavy
+visualization/training libraries. pipeline.py runs it before the stages (unless --skip-import-check is given),
+and it can be run alone from the src directory:
+
+    python -m input_output.check_import_time [budget_in_seconds]
+
+assert_import_time raises an AssertionError, and the script exits with status 1, if the import takes longer than the budget
+or if any of the heavy modules got imported.
+'''
+
+import os
+import sys
+import subprocess
+
+CORE_MODULES=["input_output.dataset","input_output.corpus_store"]
+HEAVY_MODULES=["matplotlib","plotly","torch"]
+DEFAULT_BUDGET=1.0 #seconds
+SOURCE_DIR=os.path.dirname(os.path.dirname(os.path.abspath(__file__))) #where input_output can be imported from
+
+
+def measure_import(module_name):
+    '''
+    Imports module_name in a fresh interpreter (numpy included in the measurement), 
+    returns the time it took and the heavy modules that ended up in sys.modules
+    '''
+    code=("import sys,time\n"
+          "t0=time.perf_counter()\n"
+          "import "+module_name+"\n"
+          "t1=time.perf_counter()\n"
+          "heavy=[m for m in "+repr(HEAVY_MODULES)+" if m in sys.modules]\n"
+          "print(t1-t0)\n"
+          "print(' '.join(heavy))\n")
+    output=subprocess.run([sys.executable,"-c",code],capture_output=True,text=True,check=True,cwd=SOURCE_DIR).stdout.split("\n")
+    return float(output[0]),output[1].split()
+
+
+def check_import_time(budget=DEFAULT_BUDGET,modules=CORE_MODULES,verbose=True):
+    '''
+    Returns the list of failures (empty if all modules are imported within the budget and without heavy dependencies)
+    '''
+    failures=[]
+    for module_name in modules:
+        elapsed,heavy=measure_import(module_name)
+        good= elapsed<=budget and not heavy
+        if not good:failures.append(module_name+" took %.3fs (budget %.3fs)"%(elapsed,budget)+(", imported "+", ".join(heavy) if heavy else ""))
+        if verbose:print(module_name,"%.3fs"%elapsed,"OK" if good else "FAIL", ("heavy imports: "+", ".join(heavy)) if heavy else "")
+    return failures
+
+
+def assert_import_time(budget=DEFAULT_BUDGET,modules=CORE_MODULES,verbose=True):
+    failures=check_import_time(budget,modules,verbose)
+    assert not failures,"; ".join(failures)
+
+
+if __name__ == '__main__':
+    budget=float(sys.argv[1]) if len(sys.argv)>1 else DEFAULT_BUDGET
+    try:assert_import_time(budget)
+    except AssertionError as error:sys.exit("Import time check failed: "+str(error))
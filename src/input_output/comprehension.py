@@ -0,0 +1,134 @@
+'''
+%        Copyright 2022 Jesús Calvillo <jescalvillot@gmail.com>
+%
+%      Licensed under the Apache License, Version 2.0 (the "License");
+%      you may not use this file except in compliance with the License.
+%      You may obtain a copy of the License at
+%
+%           http://www.apache.org/licenses/LICENSE-2.0
+%
+%     Unless required by applicable law or agreed to in writing, software
+%     distributed under the License is distributed on an "AS IS" BASIS,
+%     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+%     See the License for the specific language governing permissions and
+%     limitations under the License.
+
+Prior, conjunction, conditional probabilities and comprehension scores for all pairs of sentences of a corpus.
+The definitions follow prior_prob, conj_prob, cond_prob and comprh_score in src/dss/probs/compare_probs.r:
+
+    prior(a)   = sum(a)/len(a)
+    conj(a,b)  = sum(a*b)/len(a)
+    cond(a|b)  = conj(a,b)/prior(b)
+    cs(a,b)    = (cond(a|b)-prior(a))/(1-prior(a))   if cond(a|b)>prior(a)
+                 (cond(a|b)-prior(a))/prior(a)       otherwise
+
+Entry [i,j] of each output matrix concerns the pair (a=vector i, b=vector j), as in comprh_vector of the R scripts.
+Instead of looping over pairs, the intersections of a block of rows with all the vectors are obtained with one matrix product,
+the blocks are distributed over a process pool. With top_k, only the k pairs with the largest |cs| are kept for each row,
+and the matrices are returned as scipy.sparse CSR matrices, which makes corpora of tens of thousands of sentences tractable.
+'''
+
+import os
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+SCORE_NAMES=["conj","cond","comprehension"]
+
+_worker_vectors=None #Set in each worker process by _init_worker, so that the vectors are sent only once per worker
+
+
+def _init_worker(vectors):
+    global _worker_vectors
+    _worker_vectors=vectors
+
+
+def get_comprehension_scores(conds,priors_a):
+    '''
+    cs(a,b) from a matrix of cond(a|b) and the priors of a (one per row)
+    '''
+    priors_a=priors_a[:,None]
+    diff=conds-priors_a
+    with np.errstate(divide="ignore",invalid="ignore"):
+        scores=np.where(diff>0,diff/(1.0-priors_a),diff/priors_a)
+    return np.nan_to_num(scores,nan=0.0,posinf=0.0,neginf=0.0)
+
+
+def _compute_block(start,end,top_k=None,vectors=None):
+    '''
+    Scores of the rows start..end-1 against all vectors
+    '''
+    if vectors is None:vectors=_worker_vectors
+    n_observations=vectors.shape[1]
+    counts=vectors.sum(axis=1)
+    priors=counts/n_observations
+
+    intersections=vectors[start:end]@vectors.T
+    conj=intersections/n_observations
+    with np.errstate(divide="ignore",invalid="ignore"):
+        cond=np.where(counts[None,:]>0,intersections/counts[None,:],0.0)
+    comprehension=get_comprehension_scores(cond,priors[start:end])
+    block={"conj":conj.astype(np.float32),"cond":cond.astype(np.float32),"comprehension":comprehension.astype(np.float32)}
+
+    if top_k is None:return block
+
+    #We only keep the k pairs with the strongest comprehension score (positive or negative) in each row
+    k=min(top_k,vectors.shape[0])
+    columns=np.argpartition(-np.abs(comprehension),k-1,axis=1)[:,:k]
+    rows=np.repeat(np.arange(start,end),k)
+    columns=columns.ravel()
+    local_rows=rows-start
+    return {"rows":rows,"columns":columns,
+            "values":{name:block[name][local_rows,columns] for name in SCORE_NAMES}}
+
+
+def get_pairwise_scores(vectors,block_size=1024,n_workers=None,top_k=None,output_dir=None):
+    '''
+    vectors: matrix with one DSS vector per row (e.g. np.asarray([te.vector for te in corpus]) or Corpus_Store.semantic_vectors())
+    block_size: number of rows computed together
+    n_workers: size of the process pool (None uses all cpus, 1 computes everything in this process)
+    top_k: if given, only the top_k strongest pairs per row are kept and sparse matrices are returned
+    output_dir: if given (and top_k is None), the dense matrices are written as .npy memmaps in this directory instead of kept in memory
+
+    Returns a dictionary with "prior" (one value per vector) and the "conj", "cond" and "comprehension" matrices
+    '''
+    vectors=np.asarray(vectors)
+    #float32 products are exact while the counts stay below 2**24
+    vectors=vectors.astype(np.float32 if vectors.shape[1]<2**24 else np.float64)
+    n_vectors=vectors.shape[0]
+    blocks=[(start,min(start+block_size,n_vectors)) for start in range(0,n_vectors,block_size)]
+
+    results={"prior":vectors.sum(axis=1)/vectors.shape[1]}
+    if top_k is None:
+        for name in SCORE_NAMES:
+            if output_dir:
+                os.makedirs(output_dir,exist_ok=True)
+                results[name]=np.lib.format.open_memmap(os.path.join(output_dir,name+".npy"),mode="w+",dtype=np.float32,shape=(n_vectors,n_vectors))
+            else:results[name]=np.zeros((n_vectors,n_vectors),dtype=np.float32)
+    else:sparse_parts=[]
+
+    def collect(start,end,block):
+        if top_k is None:
+            for name in SCORE_NAMES:results[name][start:end]=block[name]
+        else:sparse_parts.append(block)
+
+    if n_workers==1 or len(blocks)==1:
+        for (start,end) in blocks:collect(start,end,_compute_block(start,end,top_k,vectors))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers,initializer=_init_worker,initargs=(vectors,)) as executor:
+            futures=[(start,end,executor.submit(_compute_block,start,end,top_k)) for (start,end) in blocks]
+            for (start,end,future) in futures:collect(start,end,future.result())
+
+    if top_k is not None:
+        from scipy.sparse import csr_matrix
+        if not sparse_parts: #no vectors
+            for name in SCORE_NAMES:results[name]=csr_matrix((n_vectors,n_vectors),dtype=np.float32)
+            return results
+        rows=np.concatenate([part["rows"] for part in sparse_parts])
+        columns=np.concatenate([part["columns"] for part in sparse_parts])
+        for name in SCORE_NAMES:
+            values=np.concatenate([part["values"][name] for part in sparse_parts])
+            results[name]=csr_matrix((values,(rows,columns)),shape=(n_vectors,n_vectors))
+    elif output_dir:
+        for name in SCORE_NAMES:results[name].flush()
+    return results
@@ -0,0 +1,182 @@
+'''
+%        Copyright 2022 Jesús Calvillo <jescalvillot@gmail.com>
+%
+%      Licensed under the Apache License, Version 2.0 (the "License");
+%      you may not use this file except in compliance with the License.
+%      You may obtain a copy of the License at
+%
+%           http://www.apache.org/licenses/LICENSE-2.0
+%
+%     Unless required by applicable law or agreed to in writing, software
+%     distributed under the License is distributed on an "AS IS" BASIS,
+%     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+%     See the License for the specific language governing permissions and
+%     limitations under the License.
+
+Columnar on-disk store for the corpora obtained with load_prolog_corpus_belief.
+
+Instead of pickling the Training_Element objects, each attribute of the corpus is saved as its own column
+inside a directory:
+
+    meta.json               sizes, dtypes, vocabulary and basic propositions
+    semantic_bits.npy       DSS vectors, one row per sentence, packed into bits (np.packbits)
+    belief.npy              belief vectors (float32 or float16)
+    tokens_indptr.npy       CSR representation of the sentences converted to vocabulary indices
+    tokens_indices.npy
+    sentences_offsets.npy   string tables: utf-8 bytes of all strings concatenated, plus their offsets
+    sentences_bytes.npy
+    semantics_offsets.npy
+    semantics_bytes.npy
+
+The rows of the possible corpus come first, followed by the rows of the impossible corpus.
+All arrays are opened lazily with memory mapping, so opening a store is immediate and a task only reads the columns it uses.
+'''
+
+import os
+import json
+import numpy as np
+
+from input_output.dataset import Training_Element
+
+STORE_VERSION=1
+
+
+def _write_string_table(store_path,name,strings):
+    '''
+    Saves a list of strings as the concatenation of their utf-8 bytes plus an array of offsets
+    '''
+    encoded=[s.encode("utf-8") for s in strings]
+    offsets=np.zeros(len(encoded)+1,dtype=np.int64)
+    offsets[1:]=np.cumsum([len(e) for e in encoded])
+    np.save(os.path.join(store_path,name+"_offsets.npy"),offsets)
+    np.save(os.path.join(store_path,name+"_bytes.npy"),np.frombuffer(b"".join(encoded),dtype=np.uint8))
+
+
+def write_corpus_store(store_path,corpus,impossible_corpus,vocab,basic_props,belief_dtype="float32"):
+    '''
+    Saves the output of load_prolog_corpus_belief into a columnar store in the directory store_path.
+    belief_dtype can be "float32" or "float16"
+    '''
+    os.makedirs(store_path,exist_ok=True)
+    elements=list(corpus)+list(impossible_corpus)
+    n_observations=len(elements[0].vector) if elements else 0
+    n_props=len(basic_props)
+
+    semantic_bits=np.zeros((len(elements),(n_observations+7)//8),dtype=np.uint8)
+    belief=np.zeros((len(elements),n_props),dtype=belief_dtype)
+    for row,element in enumerate(elements):
+        semantic_bits[row]=np.packbits(np.asarray(element.vector)!=0)
+        belief[row]=element.belief_vector
+    np.save(os.path.join(store_path,"semantic_bits.npy"),semantic_bits)
+    np.save(os.path.join(store_path,"belief.npy"),belief)
+
+    #Tokens are stored in CSR format: the indices of sentence i are tokens_indices[indptr[i]:indptr[i+1]]
+    token_dtype=np.uint16 if len(vocab)<2**16 else np.int32
+    lengths=[len(element.w_indices) for element in elements]
+    indptr=np.zeros(len(elements)+1,dtype=np.int64)
+    indptr[1:]=np.cumsum(lengths)
+    indices=np.fromiter((ind for element in elements for ind in element.w_indices),dtype=token_dtype,count=int(indptr[-1]))
+    np.save(os.path.join(store_path,"tokens_indptr.npy"),indptr)
+    np.save(os.path.join(store_path,"tokens_indices.npy"),indices)
+
+    _write_string_table(store_path,"sentences",[element.sentence for element in elements])
+    _write_string_table(store_path,"semantics",[element.semantics for element in elements])
+
+    meta={"version":STORE_VERSION,
+          "n_corpus":len(corpus),
+          "n_impossible":len(impossible_corpus),
+          "n_observations":n_observations,
+          "belief_dtype":str(np.dtype(belief_dtype)),
+          "vocab":list(vocab),
+          "basic_props":list(basic_props)}
+    with open(os.path.join(store_path,"meta.json"),'w') as meta_file:
+        json.dump(meta,meta_file)
+
+
+class Corpus_Store:
+    '''
+    Read access to a corpus saved with write_corpus_store.
+    Rows 0..n_corpus-1 correspond to the (possible) corpus, the rest to the impossible corpus.
+    Each column is memory mapped the first time it is requested.
+    '''
+    def __init__(self,store_path):
+        self.store_path=store_path
+        with open(os.path.join(store_path,"meta.json"),'r') as meta_file:
+            meta=json.load(meta_file)
+        if meta["version"]!=STORE_VERSION:
+            raise ValueError("Unsupported corpus store version: "+str(meta["version"]))
+
+        self.n_corpus=meta["n_corpus"]
+        self.n_impossible=meta["n_impossible"]
+        self.n_observations=meta["n_observations"]
+        self.vocab=meta["vocab"]
+        self.basic_props=meta["basic_props"]
+        self._columns={}
+        self._sentence_index=None
+
+    def __len__(self):
+        return self.n_corpus+self.n_impossible
+
+    def column(self,name):
+        '''
+        Returns the memory mapped array saved as name.npy
+        '''
+        if name not in self._columns:
+            self._columns[name]=np.load(os.path.join(self.store_path,name+".npy"),mmap_mode='r')
+        return self._columns[name]
+
+    def _get_string(self,table,row):
+        offsets=self.column(table+"_offsets")
+        return bytes(self.column(table+"_bytes")[offsets[row]:offsets[row+1]]).decode("utf-8")
+
+    def sentence(self,row):
+        return self._get_string("sentences",row)
+
+    def semantics(self,row):
+        return self._get_string("semantics",row)
+
+    def tokens(self,row):
+        '''
+        Returns the sentence in row converted to vocabulary indices
+        '''
+        indptr=self.column("tokens_indptr")
+        return np.asarray(self.column("tokens_indices")[indptr[row]:indptr[row+1]],dtype=np.int64)
+
+    def semantic_vectors(self,rows=None):
+        '''
+        Returns the binary DSS vectors of the given rows (all rows if None) unpacked into a uint8 matrix
+        '''
+        bits=self.column("semantic_bits")
+        if rows is not None: bits=bits[rows]
+        return np.unpackbits(bits,axis=-1,count=self.n_observations)
+
+    def belief_vectors(self,rows=None):
+        belief=self.column("belief")
+        if rows is None: return belief
+        return belief[rows]
+
+    def index_of(self,sentence):
+        '''
+        Returns the row of a given sentence, this replaces map_sentence_training_elem
+        '''
+        if self._sentence_index is None:
+            self._sentence_index={self.sentence(row):row for row in range(len(self))}
+        return self._sentence_index[sentence]
+
+    def get_training_element(self,row):
+        '''
+        Builds the Training_Element of a given row as it would have been returned by load_prolog_corpus_belief
+        '''
+        training_item=Training_Element(self.sentence(row),self.semantics(row),self.semantic_vectors(row).astype(int))
+        training_item.belief_vector=np.asarray(self.belief_vectors(row),dtype=float)
+        training_item.w_indices=self.tokens(row).tolist()
+        return training_item
+
+    def get_corpus(self):
+        '''
+        Materializes the whole store into the objects returned by load_prolog_corpus_belief
+        '''
+        corpus=[self.get_training_element(row) for row in range(self.n_corpus)]
+        impossible_corpus=[self.get_training_element(row) for row in range(self.n_corpus,len(self))]
+        map_sentence_training_elem={te.sentence:te for te in corpus+impossible_corpus}
+        return corpus,impossible_corpus,map_sentence_training_elem,self.vocab,self.basic_props
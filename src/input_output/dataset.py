@@ -14,17 +14,24 @@
 %     limitations under the License.
 '''
 
+import sys
 import numpy as np
-import matplotlib.pyplot as plt
-import plotly
-import plotly.graph_objects as go
 import itertools
-import pickle
-import torch
 
 from dataclasses import dataclass
 from typing import List, Optional, Generator
 
+#The plotting functions live in visualization.py so that importing this module does not pull in plotly.
+#They are still reachable from here, the first access imports visualization.py.
+_VISUALIZATION_FUNCTIONS=["get_web_heatmap","get_all_basic_props_heatmaps_through_time",
+                          "get_heatmap_through_time","get_vector_visualizations_through_time"]
+
+def __getattr__(name):
+    if name in _VISUALIZATION_FUNCTIONS:
+        from input_output import visualization
+        return getattr(visualization, name)
+    raise AttributeError("module "+repr(__name__)+" has no attribute "+repr(name))
+
 @dataclass
 class Training_Element: 
     '''
@@ -72,11 +79,69 @@ def index_2_one_hot(ind: int,
     
     
 
-def load_prolog_situation_space_matrix(filename):
+#############################################################################################################
+#### DENSE/SPARSE BACKEND
+#############################################################################################################
+#Situation matrices are mostly zeros (one place per participant, a few activities at a time). Below this fraction of
+#ones, a scipy.sparse matrix (CSC, one column per basic proposition) is used when the backend is "auto".
+SPARSE_DENSITY_THRESHOLD=0.1
+
+def is_sparse(matrix):
+    #If scipy.sparse was never imported, nothing can be a sparse matrix, this way scipy is not imported for dense matrices
+    sparse_module=sys.modules.get("scipy.sparse")
+    return sparse_module is not None and sparse_module.issparse(matrix)
+
+def get_density(matrix):
+    n_values=matrix.shape[0]*matrix.shape[1]
+    if not n_values:return 0.0
+    if is_sparse(matrix):return matrix.count_nonzero()/n_values
+    return np.count_nonzero(matrix)/n_values
+
+def to_backend(matrix,sparse="auto",threshold=SPARSE_DENSITY_THRESHOLD):
+    '''
+    Returns the matrix as a dense numpy array (sparse=False), as a scipy.sparse CSC matrix (sparse=True),
+    or as the one that suits its density (sparse="auto")
+    '''
+    if sparse=="auto":sparse=get_density(matrix)<threshold
+    if sparse:
+        from scipy.sparse import csc_matrix
+        return csc_matrix(matrix)
+    if is_sparse(matrix):return matrix.toarray()
+    return np.asarray(matrix)
+
+def _as_flat(vector):
+    '''
+    1-D numpy version of a vector, which can be a sparse column or row
+    '''
+    if is_sparse(vector):return vector.toarray().ravel()
+    return vector
+
+def slide_matrix_time(matrix,timesteps):
+    '''
+    slide_time applied to every column of a matrix (dense or sparse), rows are observations
+    '''
+    n_obs=matrix.shape[0]
+    if not is_sparse(matrix):
+        shifted=np.zeros_like(matrix)
+        if timesteps<0:shifted[:max(0,n_obs+timesteps)]=matrix[-timesteps:]
+        elif timesteps>0:shifted[timesteps:]=matrix[:max(0,n_obs-timesteps)]
+        else:shifted=matrix
+        return shifted
+    
+    from scipy.sparse import coo_matrix
+    coo=matrix.tocoo()
+    rows=coo.row+timesteps
+    kept=(rows>=0)&(rows<n_obs)
+    return coo_matrix((coo.data[kept],(rows[kept],coo.col[kept])),shape=matrix.shape).asformat(matrix.format)
+
+
+def load_prolog_situation_space_matrix(filename,sparse=False):
     '''
     Loads the file containing the situation space matrix concatenating the vectors of the basic propositions
     Returns also a list containing all basic propositions
+    sparse: False (numpy array), True (scipy.sparse CSC matrix) or "auto" (sparse if the density is below SPARSE_DENSITY_THRESHOLD)
     '''
+    if sparse is not False:return _load_sparse_situation_space_matrix(filename,sparse)
     situation_matrix=[]
     
     with open(filename,'r') as file:
@@ -89,44 +154,45 @@ def load_prolog_situation_space_matrix(filename):
     
     return situation_matrix,basic_props
 
+def _load_sparse_situation_space_matrix(filename,sparse):
+    '''
+    Reads the rows keeping only the positions of the ones, so that the dense matrix is never built
+    (unless sparse=="auto" and the matrix turns out to be dense)
+    '''
+    from scipy.sparse import csr_matrix
+    indices=[]
+    indptr=[0]
+    with open(filename,'r') as file:
+        basic_props = file.readline().split()
+        for line in file:
+            on=np.flatnonzero(np.array(line.split(),dtype=np.int8))
+            indices.append(on)
+            indptr.append(indptr[-1]+len(on))
+    indices=np.concatenate(indices) if indices else np.zeros(0,dtype=np.int64)
+    situation_matrix=csr_matrix((np.ones(len(indices),dtype=np.int64),indices,indptr),shape=(len(indptr)-1,len(basic_props))).tocsc()
+    if sparse=="auto":situation_matrix=to_backend(situation_matrix,"auto")
+    return situation_matrix,basic_props
+
 def print_prior_probs(matrix,basic_props):
     #Each row in the matrix (matrix.shape[0])is one observation, each column is one basic proposition (matrix.shape[1])
+    priors=np.asarray(matrix.sum(axis=0)).ravel()/matrix.shape[0]
     for i in range(matrix.shape[1]):
-        prior=np.sum(matrix[:,i])/matrix.shape[0]
-        print(i,basic_props[i],prior)
+        print(i,basic_props[i],priors[i])
         
         
-def get_web_heatmap(data,x_labels,y_labels,graph_title,x_title="X",y_title="Y",filename=""):
-
-    fig = go.Figure(data=go.Heatmap(
-                       z=data,
-                       x=x_labels,
-                       y=y_labels,
-                       colorscale="hot",
-                       hoverongaps = False))
-    
-    fig.update_layout(
-        title=graph_title,
-        xaxis_title=x_title,
-        yaxis_title=y_title)
-    
-    if filename: fig.write_html(filename)
-    else:fig.show()
-    
-
 def get_conditional_joint_probs(matrix):
+    '''
+    jointps[i,j]=P(i,j) and condps[i,j]=P(j|i). All the intersections are obtained at once with matrix.T*matrix (dense or sparse)
+    '''
+    intersections=matrix.T@matrix
+    if is_sparse(intersections):intersections=intersections.toarray()
+    intersections=np.asarray(intersections)
+    priors=np.diagonal(intersections)
+    
+    jointps=intersections/matrix.shape[0]
     condps=np.zeros((matrix.shape[1],matrix.shape[1]), dtype=float)
-    jointps=np.zeros((matrix.shape[1],matrix.shape[1]), dtype=float)
-
-    for i in range(matrix.shape[1]):
-        for j in range(matrix.shape[1]):
-            intersection=np.dot(matrix[:,i],matrix[:,j])
-            jointp=intersection/matrix.shape[0]
-            if np.sum(matrix[:,i])>0:condp=intersection/np.sum(matrix[:,i])
-            else: condp=0
-            #print(basic_props[i],basic_props[j],jointp,condp)
-            jointps[i,j]=jointp
-            condps[i,j]=condp
+    nonzero=priors>0
+    condps[nonzero]=intersections[nonzero]/priors[nonzero,None]
     
     return jointps,condps
 
@@ -136,6 +202,7 @@ def slide_time(vector,timesteps):
     Given a binary vector with ordered values, moving in time can be performed by sliding the vector to the left (back in time) or to the right (future)
     timesteps: # of steps we go backward (if <0) or forward (if >0)
     '''
+    if is_sparse(vector):return slide_matrix_time(vector.reshape(-1,1),timesteps)
     #Going backwards we slide the vector to the left (removing the values at the beginning) and pad with zeros at the end
     if timesteps<0:
         vector=vector[timesteps*-1:]
@@ -148,27 +215,117 @@ def slide_time(vector,timesteps):
     return vector
 
 def dss_jointp(vector_A,vector_B):
+    vector_A,vector_B=_as_flat(vector_A),_as_flat(vector_B)
     intersection=np.dot(vector_A,vector_B)
     return intersection/len(vector_A)
 
 def dss_condp(vector_A,given_vector_B):
+    vector_A,given_vector_B=_as_flat(vector_A),_as_flat(given_vector_B)
     prior_B=np.sum(given_vector_B)
     if prior_B==0:return 0
     
     intersection=np.dot(vector_A,given_vector_B)
     return intersection/prior_B
+
+
+#############################################################################################################
+#### WEIGHTED OBSERVATIONS (IMPORTANCE SAMPLING)
+#############################################################################################################
+#When the microworld runs with proposal distributions (Microworld.set_proposal_distros), each Formal_Model has the log
+#likelihood ratio log(p/q) of the values drawn in its time step. They can be written one per line next to the observations:
+#    for model in models: output_file.write(repr(model.log_likelihood_ratio)+"\n")
+#The weight of an observation is the likelihood ratio of the draws that led to it. Along a single long run this product
+#degenerates (a handful of observations get all the weight), so the observations should come from many short runs, which
+#Microworld.run_importance_sampled generates one after the other; run_length then says where each run begins, and the
+#likelihood ratios are only accumulated within each run.
+#The weighted functions below are self-normalized: they divide by the sum of the weights.
+def get_observation_weights(log_likelihood_ratios,run_length=None):
+    '''
+    Weights (with mean 1) from the per-step log likelihood ratios, of a single run or of consecutive runs of run_length steps
+    '''
+    log_likelihood_ratios=np.asarray(log_likelihood_ratios,dtype=float)
+    if not len(log_likelihood_ratios):return log_likelihood_ratios
+    cumulative=np.cumsum(log_likelihood_ratios)
+    if run_length is not None:
+        run_starts=np.arange(0,len(cumulative),run_length)
+        previous=np.concatenate(([0.0],cumulative))[run_starts] #accumulated before each run
+        cumulative=cumulative-np.repeat(previous,np.diff(np.append(run_starts,len(cumulative))))
+    weights=np.exp(cumulative-cumulative.max())
+    return weights/weights.mean()
+
+def load_observation_weights(filename,run_length=None):
+    with open(filename,'r') as file:
+        log_likelihood_ratios=[float(line) for line in file if line.strip()]
+    return get_observation_weights(log_likelihood_ratios,run_length)
+
+def get_effective_sample_size(weights):
+    '''
+    Kish effective sample size of a set of weights, (sum w)^2/sum w^2
+    '''
+    weights=np.asarray(weights,dtype=float)
+    return np.sum(weights)**2/np.sum(weights**2)
+
+def weighted_prior(vector,weights):
+    vector=_as_flat(vector)
+    return np.dot(weights,vector)/np.sum(weights)
+
+def weighted_jointp(vector_A,vector_B,weights):
+    vector_A,vector_B=_as_flat(vector_A),_as_flat(vector_B)
+    return np.dot(weights,vector_A*vector_B)/np.sum(weights)
+
+def weighted_condp(vector_A,given_vector_B,weights):
+    vector_A,given_vector_B=_as_flat(vector_A),_as_flat(given_vector_B)
+    prior_B=np.dot(weights,given_vector_B)
+    if prior_B==0:return 0
+    return np.dot(weights,vector_A*given_vector_B)/prior_B
+
+def get_weighted_prior_probs(matrix,weights):
+    return np.asarray(matrix.T@weights).ravel()/np.sum(weights)
+
+def get_weighted_conditional_joint_probs(matrix,weights):
+    '''
+    Same as get_conditional_joint_probs, with each observation counting as much as its weight
+    '''
+    weights=np.asarray(weights,dtype=float)
+    if is_sparse(matrix):weighted_matrix=matrix.multiply(weights[:,None]).tocsc()
+    else:weighted_matrix=matrix*weights[:,None]
+    intersections=weighted_matrix.T@matrix
+    if is_sparse(intersections):intersections=intersections.toarray()
+    intersections=np.asarray(intersections)
+    priors=np.diagonal(intersections)
+    
+    jointps=intersections/np.sum(weights)
+    condps=np.zeros((matrix.shape[1],matrix.shape[1]), dtype=float)
+    nonzero=priors>0
+    condps[nonzero]=intersections[nonzero]/priors[nonzero,None]
+    
+    return jointps,condps
             
             
 #############################################################################################################
 #### LOAD AND OBTAIN CORPUS FROM RAW PROLOG-OUTPUT FILES
 #############################################################################################################
-def load_prolog_corpus_belief(input_path, matrix_path,output_filename):
+def load_prolog_corpus_belief(input_path, matrix_path,output_filename,store_path=None,sparse=False,weights=None):
     '''
     Takes a file containing the output of the prolog file with dss-sentences and the full 30K situation vectors
     Returns a list of TrainingElement instances, where each of the latter is a sentence with its information
     It computes the belief vector directly and puts it into each TrainingElement
+    If store_path is given, the corpus is also saved as a columnar store (see corpus_store.py), which is much faster to load than the pickle
+    sparse: backend of the situation matrix (see load_prolog_situation_space_matrix). By default the matrix is dense and the
+        belief vectors are computed over its distinct observations (Weighted_Situation_Matrix); True or "auto" are meant for
+        wide and sparse worlds
+    weights: importance weights of the observations (see get_observation_weights), the belief vectors are then weighted averages
     '''
-    dss_matrix,basic_props=load_prolog_situation_space_matrix(matrix_path)
+    dss_matrix,basic_props=load_prolog_situation_space_matrix(matrix_path,sparse)
+    if is_sparse(dss_matrix):
+        #Wide and sparse worlds: the belief vector is a sparse matrix-vector product
+        dss_matrix_T=dss_matrix.T.tocsr()
+        get_belief_counts=lambda vector:dss_matrix_T@vector
+    else:
+        #The belief vectors are computed over the distinct observations, weighted by their number of occurrences
+        from input_output.weighted_matrix import Weighted_Situation_Matrix
+        weighted_matrix=Weighted_Situation_Matrix(dss_matrix,basic_props)
+        get_belief_counts=lambda vector:weighted_matrix.get_belief_vector(vector,normalize=False)
     
     map_sentence_training_elem={}
     corpus=[]  
@@ -193,8 +350,9 @@ def load_prolog_corpus_belief(input_path, matrix_path,output_filename):
             training_item=Training_Element(sentence_line,semantics_line,vector_line)
             map_sentence_training_elem[sentence_line]=training_item
                  
-            training_item.belief_vector=np.dot(vector_line,dss_matrix)
-            prior_v=np.sum(vector_line)
+            weighted_vector=vector_line if weights is None else vector_line*weights
+            training_item.belief_vector=get_belief_counts(weighted_vector)
+            prior_v=np.sum(weighted_vector)
             if prior_v:
                 training_item.belief_vector=training_item.belief_vector/prior_v
                 corpus.append(training_item)
@@ -213,6 +371,7 @@ def load_prolog_corpus_belief(input_path, matrix_path,output_filename):
     for te in impossible_corpus: te.w_indices=[vocab.index(word) for word in te.sentence.split()] 
     #We assume the vocabulary in impossible corpus is fully contained in corpus
     
+    import pickle
     with open(output_filename, 'wb') as f:
         pickle.dump(corpus, f)
         pickle.dump(impossible_corpus,f)
@@ -220,6 +379,10 @@ def load_prolog_corpus_belief(input_path, matrix_path,output_filename):
         pickle.dump(vocab,f)
         pickle.dump(basic_props,f)
     
+    if store_path:
+        from input_output.corpus_store import write_corpus_store
+        write_corpus_store(store_path, corpus, impossible_corpus, vocab, basic_props)
+    
     return corpus,impossible_corpus,map_sentence_training_elem,vocab,basic_props
 
 def get_collapsed_corpus(normal_corpus):
@@ -273,122 +436,48 @@ def get_corpus_sentence_observations(corpus_belief, obs_matrix,max_obs=300):
 
 def get_condps_through_time(target_vector,matrix,side_size=7,interest_indices=[]):
     steps=list(range(-side_size,side_size+1,1))
-    if not interest_indices:interest_indices=range(matrix.shape[1])
+    if not len(interest_indices):interest_indices=range(matrix.shape[1])
     
     condps=np.zeros((len(interest_indices),len(steps)), dtype=float)
     
+    if is_sparse(matrix):
+        #One sparse product per time step instead of one dot product per proposition
+        interest_matrix=matrix[:,list(interest_indices)].tocsc()
+        for time in steps:
+            vector=_as_flat(slide_time(target_vector, time))
+            prior=np.sum(vector)
+            if prior:condps[:,time+side_size]=(interest_matrix.T@vector)/prior
+        return condps
+    
     for time in steps:
         vector=slide_time(target_vector, time)    
         for y,j in enumerate(interest_indices):
             prop_vector=matrix[:,j]
             condps[y,time+side_size]=dss_condp(prop_vector,vector)
     return condps
-    
-def get_all_basic_props_heatmaps_through_time(matrix,basic_props,side_size=7):
-    for i in range(matrix.shape[1]):
-        ref_prop=matrix[:,i]
-        prop_flatname=basic_props[i].replace("(","_").replace(")","").replace(",","_")
-        graph_filename="../outputs/websites/"+prop_flatname+".html"
-        
-        get_heatmap_through_time(ref_prop, matrix, basic_props[i], basic_props, graph_filename, side_size)
-                
-def get_heatmap_through_time(target_vector,matrix,graph_label,y_labels,filename,side_size=7,interest_indices=[]):
-    steps=list(range(-side_size,side_size+1,1))
-    step_labels=["t="+str(i) for i in steps]
-    
-    condps=get_condps_through_time(target_vector, matrix, side_size,interest_indices)
+
+def get_lagged_condps(matrix,side_size=7):
+    '''
+    get_condps_through_time for all basic propositions at once:
+    lagged[i,j,time+side_size]=P( j at t+time | i at t ), i.e. lagged[i] == get_condps_through_time(matrix[:,i],matrix,side_size)
+    Each time step is a single matrix product instead of one dot product per pair of propositions.
+    '''
+    n_obs,n_props=matrix.shape
+    if is_sparse(matrix):matrix=matrix.astype(float)
+    else:matrix=np.asarray(matrix,dtype=float)
+    lagged=np.zeros((n_props,n_props,2*side_size+1), dtype=float)
+    
+    for time in range(-side_size,side_size+1):
+        #same as applying slide_time to every column
+        shifted=slide_matrix_time(matrix,time)
         
-    graph_title="Conditional Probs P( Y | "+graph_label+" )"
-    get_web_heatmap(condps,  step_labels, y_labels, graph_title, "Time Steps","Basic Proposition Y",filename)
+        intersections=shifted.T@matrix
+        if is_sparse(intersections):intersections=intersections.toarray()
+        priors=np.asarray(shifted.sum(axis=0)).ravel()
+        nonzero=priors>0
+        lagged[nonzero,:,time+side_size]=intersections[nonzero]/priors[nonzero,None]
+    return lagged
     
-    line="* ["+graph_label+"](https://iesus.github.io/dynamic-dss-websites/across_time/"+filename+")"
-    print(line) #This prints out code that we can put in a github readme file
-
-def get_vector_visualizations_through_time(target_vector,matrix,label,y_labels,filename,side_size=7,interest_indices=[]):
-    steps=list(range(-side_size,side_size+1,1))
-    step_labels=["t="+str(i) for i in steps]
-    label=label.split("---")
-    
-    condps=get_condps_through_time(target_vector, matrix, side_size, interest_indices)
-    graph_title="P( Y | "+label[0]+" )  "+label[1]
-    
-    colors=[tuple(np.random.choice(range(256), size=3)) for i in range(len(y_labels))]
-    colors=['rgb'+str(col) for col in colors]
-
-    x_data = np.vstack((np.asarray(steps),)*condps.shape[0])
-    y_data = condps
-    
-    fig = go.Figure()
-    
-    for i in range(condps.shape[0]):
-        fig.add_trace(go.Scatter(x=x_data[i], y=y_data[i], mode='lines',
-            name=y_labels[i],
-            line=dict(color=colors[i]),# width=line_size[i]),
-            connectgaps=True,
-        ))
-    
-    fig.update_layout(
-        xaxis=dict(
-            showline=False,
-            showgrid=True,
-            showticklabels=True,
-            linecolor='rgb(204, 204, 204)',
-            linewidth=2,
-            ticks='outside',
-            tickfont=dict(
-                family='Arial',
-                size=12,
-                color='rgb(82, 82, 82)',
-            ),
-        ),
-        yaxis=dict(
-            showgrid=True,
-            zeroline=True,
-            showline=True,
-            showticklabels=False,
-        ),
-        autosize=True,
-        margin=dict(
-            autoexpand=True,
-            l=100,
-            r=20,
-            t=110,
-        ),
-        showlegend=True,
-        plot_bgcolor='white'
-    )
-    
-    annotations = []
-    # Adding labels
-    for y_trace, y_label in zip(y_data, y_labels):
-        annotations.append(dict(xref='paper', x=0.05, y=y_trace[0],
-                                      xanchor='right', yanchor='middle',
-                                      text=y_label + ' {:.2f}'.format(y_trace[0]),
-                                      font=dict(family='Arial',
-                                                size=16),
-                                      showarrow=False))
-    # Title
-    annotations.append(dict(xref='paper', yref='paper', x=0.0, y=1.05,
-                                  xanchor='left', yanchor='bottom',
-                                  text=graph_title,
-                                  font=dict(family='Arial',
-                                            size=30,
-                                            color='rgb(37,37,37)'),
-                                  showarrow=False))
-    
-    fig.update_layout(annotations=annotations)
-    fig.update_xaxes(title_text='Time Steps',
-                     ticktext=step_labels,
-                     tickvals=steps
-                    )
-    
-    
-    line="* [Line plots, only selected basic propositions](https://iesus.github.io/dynamic-dss-websites/across_time/"+filename+")"
-    print(line) #This prints out code that we can put in a github readme file
-
-    if filename: fig.write_html(filename)
-    else:fig.show()
-
 
 
 
@@ -404,6 +493,8 @@ if __name__ == '__main__':
     prolog_corpus_path="../outputs/street_life_model/street_life_model.simple.set"
     
     
+    from input_output.visualization import get_heatmap_through_time, get_vector_visualizations_through_time
+    
     matrix,basic_props=load_prolog_situation_space_matrix(matrix_path)
     
     seq_size=15
@@ -418,13 +509,15 @@ if __name__ == '__main__':
     event_dataset=EventComprehensionDataset(seqs,basic_props)
     
     
-    john_bus_indices=list(range(15))+list(range(27,49))+list(range(147,161))+list(range(163,169))
-    john_indices=list(range(15))+list(range(27,49))+[160]
-    john_crossing=list(range(7))+list(range(10,13))#+list(range(27,39)
-    john_falling=list(range(7))+list(range(10,15))+list(range(31,35))
-    #print(john_indices)
-    #[0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 27, 28, 29, 30, 31, 32, 33, 34, 35, 36, 37, 38, 39, 40, 41, 42, 43, 44, 45, 46, 47, 48, 147, 148, 149, 150, 151, 152, 153, 154, 155, 156, 157, 158, 159, 160, 163, 164, 165, 166, 167, 168]
-    #print(len(john_indices))#57
+    from input_output.proposition_index import Proposition_Index
+    prop_index=Proposition_Index.from_labels(basic_props)
+    #john's propositions (also as patient of hit) without eating and drinking
+    john_indices=np.setdiff1d(prop_index.select(involves="john"),prop_index.select(event=["eat","drink"]))
+    john_bus_indices=np.union1d(john_indices,np.setdiff1d(prop_index.select(agent="bus"),prop_index.select(event="hit")))
+    john_crossing=prop_index.select(agent="john",event=["place","walk","stand","cross_street"])
+    john_falling=np.union1d(prop_index.select(agent="john",event=["place","walk","stand","cross_street","fall"]),
+                            prop_index.select(agent="john",predicate="middle_walk_to"))
+    #print(len(john_indices))#38
        
     #for i in john_indices:print(i,basic_props[i])
     
@@ -436,14 +529,13 @@ if __name__ == '__main__':
     #get_all_basic_props_heatmaps_through_time(matrix,basic_props,side_size=7)
     
 
-    #corpus,impossible,map_sent_trainelem,vocab,bprops=load_prolog_corpus_belief(prolog_corpus_path, matrix_path,'prolog_corpus.pickle')
+    #corpus,impossible,map_sent_trainelem,vocab,bprops=load_prolog_corpus_belief(prolog_corpus_path, matrix_path,'prolog_corpus.pickle',store_path='prolog_corpus_store')
     
     
-    with open('prolog_corpus.pickle','rb') as f:
-        corpus = pickle.load(f)
-        impossible=pickle.load(f)
-        map_sent_trainelem=pickle.load(f)
-        vocab=pickle.load(f)    
+    from input_output.corpus_store import Corpus_Store
+    corpus_store=Corpus_Store('prolog_corpus_store')
+    vocab=corpus_store.vocab #only the columns that are used are read (memory mapped), e.g. semantic_bits for the vectors below
+    #corpus,impossible,map_sent_trainelem,vocab,bprops=corpus_store.get_corpus() #the old tuple, only for code that needs the Training_Elements
 
     
     #get_corpus_sentence_observations(corpus, matrix)
@@ -457,7 +549,7 @@ if __name__ == '__main__':
     #['pad', 'it', 'everyone', 'sad', 'hit', 'intersection', 'cola', 'arrived', 'raining', 'a', 'falling', 'smiling', 'at', 's', 'arriving', 'women', 'side', 'drinking', 'to', 'sandwich', 'walked', 'ate', 'eating', 'man', '.', 'woman', 'the', 'smiled', 'henrietta', 'and', 'south', 'was', 'mary', 'street', 'someone', 'fries', 'tea', 'crossed', 'drove', 'crossing', 'standing', 'john', 'some', 'rained', 'glad', 'house', 'bus', 'food', 'fell', 'were', 'driving', 'north', 'drank', 'stood', 'front', 'walking']
 
     
-    comp_dataset=SentenceComprehensionDataset(corpus,vocab)
+    #comp_dataset=SentenceComprehensionDataset(corpus,vocab) #needs the corpus from get_corpus()
     
     
     #sentences=["john was crossing the street .","john crossed the street ."]
@@ -467,21 +559,23 @@ if __name__ == '__main__':
     
     for sent in sentences:
         filename_prefix="../outputs/websites/"+sent.replace(" .","").replace(" ","_")
-        telem=map_sent_trainelem[sent]
-        graph_title=telem.sentence+"---"+telem.semantics
-        print(telem.semantics)
-        print(telem.vector)        
+        row=corpus_store.index_of(sent)
+        semantics=corpus_store.semantics(row)
+        vector=corpus_store.semantic_vectors(row).astype(int)
+        graph_title=sent+"---"+semantics
+        print(semantics)
+        print(vector)        
         
         #Heatmap with ALL basic props
-        get_heatmap_through_time(telem.vector, matrix, graph_title,basic_props, filename_prefix+"_HM_all.html")
+        get_heatmap_through_time(vector, matrix, graph_title,basic_props, filename_prefix+"_HM_all.html")
         
         #Heatmap only john-related props
         y_labels=[basic_props[j] for j in john_indices]
-        get_heatmap_through_time(telem.vector, matrix, graph_title,y_labels, filename_prefix+"_HM_john.html",interest_indices=john_indices)
+        get_heatmap_through_time(vector, matrix, graph_title,y_labels, filename_prefix+"_HM_john.html",interest_indices=john_indices)
         
         #Heatmap with only crossing the street
         y_labels=[basic_props[j] for j in interest_indices]
-        get_vector_visualizations_through_time(telem.vector, matrix, graph_title,y_labels, filename_prefix+"_lines_cross.html",interest_indices=interest_indices)
+        get_vector_visualizations_through_time(vector, matrix, graph_title,y_labels, filename_prefix+"_lines_cross.html",interest_indices=interest_indices)
         
         
         #get_vector_visualizations_through_time(telem.vector, matrix, basic_props,sent, filename)
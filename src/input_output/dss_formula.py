@@ -0,0 +1,242 @@
+'''
+%        Copyright 2022 Jesús Calvillo <jescalvillot@gmail.com>
+%
+%      Licensed under the Apache License, Version 2.0 (the "License");
+%      you may not use this file except in compliance with the License.
+%      You may obtain a copy of the License at
+%
+%           http://www.apache.org/licenses/LICENSE-2.0
+%
+%     Unless required by applicable law or agreed to in writing, software
+%     distributed under the License is distributed on an "AS IS" BASIS,
+%     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+%     See the License for the specific language governing permissions and
+%     limitations under the License.
+
+Python version of dss_semantics_vector (src/dss/src/dss/dss_semantics.pl).
+It parses the propositional formulas stored in Training_Element.semantics and computes their DSS vectors
+directly from the situation space matrix returned by load_prolog_situation_space_matrix, without running swipl.
+
+Two notations are accepted:
+    - the one written by dss_format_formula, which is what the corpus files contain:
+        !(A)   (A & B)   (A | B)   (A || B)   (A -> B)
+    - the prolog terms used in the grammar:
+        not(A) and(A,B) or(A,B) xor(A,B) imp(A,B)
+Basic propositions are written as in the header of the .observations file, e.g. place(john,jm_house) or rain.
+
+Formulas are parsed into nested tuples: ("event","walk(john)"), ("not",A), ("and",A,B), ("or",A,B), ("xor",A,B), ("imp",A,B)
+Since the situation space matrix is binary, the fuzzy logic operations of dss_fuzzy_logic.pl reduce to boolean operations,
+so the result is exactly the vector that prolog would write.
+'''
+
+import numpy as np
+
+OPERATORS={"not":1,"and":2,"or":2,"xor":2,"imp":2}
+INFIX_OPERATORS=[("||","xor"),("|","or"),("&","and"),("->","imp")] # "||" has to be checked before "|"
+
+
+class Unknown_Proposition(KeyError):
+    '''
+    Raised when a formula mentions a basic proposition that is not a column of the situation space matrix.
+    In prolog dss_semantics_vector fails in that case.
+    '''
+
+
+class _Formula_Parser:
+    def __init__(self,text):
+        self.text=text
+        self.pos=0
+
+    def error(self,message):
+        raise ValueError(message+" at position "+str(self.pos)+" in formula: "+self.text)
+
+    def skip_spaces(self):
+        while self.pos<len(self.text) and self.text[self.pos].isspace():self.pos+=1
+
+    def expect(self,char):
+        self.skip_spaces()
+        if not self.text.startswith(char,self.pos):self.error("expected '"+char+"'")
+        self.pos+=len(char)
+
+    def read_name(self):
+        start=self.pos
+        while self.pos<len(self.text) and (self.text[self.pos].isalnum() or self.text[self.pos]=="_"):self.pos+=1
+        if start==self.pos:self.error("expected a proposition")
+        return self.text[start:self.pos]
+
+    def parse(self):
+        formula=self.parse_formula()
+        self.skip_spaces()
+        if self.pos!=len(self.text):self.error("unexpected text")
+        return formula
+
+    def parse_formula(self):
+        self.skip_spaces()
+        if self.text.startswith("!",self.pos):
+            self.pos+=1
+            self.expect("(")
+            formula=self.parse_formula()
+            self.expect(")")
+            return ("not",formula)
+
+        if self.text.startswith("(",self.pos):
+            self.pos+=1
+            left=self.parse_formula()
+            self.skip_spaces()
+            for symbol,operator in INFIX_OPERATORS:
+                if self.text.startswith(symbol,self.pos):
+                    self.pos+=len(symbol)
+                    right=self.parse_formula()
+                    self.expect(")")
+                    return (operator,left,right)
+            #A formula that is just wrapped in parentheses
+            self.expect(")")
+            return left
+
+        name=self.read_name()
+        self.skip_spaces()
+        if name in OPERATORS and self.text.startswith("(",self.pos):#prolog term, e.g. and(walk(john),rain)
+            self.pos+=1
+            arguments=[self.parse_formula()]
+            for _ in range(OPERATORS[name]-1):
+                self.expect(",")
+                arguments.append(self.parse_formula())
+            self.expect(")")
+            return tuple([name]+arguments)
+
+        #Basic proposition, possibly with arguments
+        if self.text.startswith("(",self.pos):
+            self.pos+=1
+            arguments=[]
+            while True:
+                self.skip_spaces()
+                arguments.append(self.read_name())
+                self.skip_spaces()
+                if self.text.startswith(",",self.pos):self.pos+=1
+                else:break
+            self.expect(")")
+            name=name+"("+",".join(arguments)+")"
+        return ("event",name)
+
+
+def parse_dss_formula(text):
+    '''
+    Parses a formula such as "(walk(john) & !(rain))" into nested tuples
+    '''
+    return _Formula_Parser(text.strip()).parse()
+
+
+def format_dss_formula(formula):
+    '''
+    Inverse of parse_dss_formula, it writes the formula as dss_format_formula does
+    '''
+    operator=formula[0]
+    if operator=="event":return formula[1]
+    if operator=="not":return "!("+format_dss_formula(formula[1])+")"
+    symbol={"and":"&","or":"|","xor":"||","imp":"->"}[operator]
+    return "("+format_dss_formula(formula[1])+" "+symbol+" "+format_dss_formula(formula[2])+")"
+
+
+def get_formula_propositions(formula):
+    '''
+    Returns the set of basic propositions that appear in the formula
+    '''
+    if formula[0]=="event":return {formula[1]}
+    propositions=set()
+    for argument in formula[1:]:propositions|=get_formula_propositions(argument)
+    return propositions
+
+
+class DSS_Formula_Evaluator:
+    '''
+    Computes DSS vectors of formulas over a situation space matrix (observations x basic propositions).
+    The columns of the matrix are converted once into boolean vectors, after which each operator is a single numpy operation.
+    If a Formula_Vector_Cache is given, the vectors of all subformulas are looked up in/added to the cache.
+    '''
+    def __init__(self,matrix,basic_props,cache=None):
+        self.basic_props=list(basic_props)
+        self.prop_index={prop:i for i,prop in enumerate(self.basic_props)}
+        self.columns=np.ascontiguousarray(np.asarray(matrix).T!=0) # one row per basic proposition
+        self.n_observations=self.columns.shape[1]
+        
+        self.cache=cache
+        if cache is not None:
+            from input_output.formula_cache import matrix_fingerprint
+            self.fingerprint=matrix_fingerprint(matrix,self.basic_props)
+
+    def evaluate(self,formula):
+        '''
+        Returns the boolean vector of a parsed formula
+        '''
+        if self.cache is not None:
+            from input_output.formula_cache import canonicalize_formula
+            return self._evaluate_cached(canonicalize_formula(formula))
+        
+        operator=formula[0]
+        if operator=="event":
+            if formula[1] not in self.prop_index:raise Unknown_Proposition(formula[1])
+            return self.columns[self.prop_index[formula[1]]]
+        if operator=="not":return ~self.evaluate(formula[1])
+
+        left=self.evaluate(formula[1])
+        right=self.evaluate(formula[2])
+        if operator=="and":return left & right
+        if operator=="or": return left | right
+        if operator=="xor":return left ^ right
+        if operator=="imp":return ~left | right
+        raise ValueError("Unknown operator: "+str(operator))
+
+    def _evaluate_cached(self,formula):
+        '''
+        Same as evaluate, but over a canonical formula (n-ary and/or/xor) and going through the cache
+        '''
+        operator=formula[0]
+        if operator=="event":
+            if formula[1] not in self.prop_index:raise Unknown_Proposition(formula[1])
+            return self.columns[self.prop_index[formula[1]]]
+
+        bits=self.cache.get(self.fingerprint,formula)
+        if bits is not None:return np.unpackbits(bits,count=self.n_observations).astype(bool)
+
+        arguments=[self._evaluate_cached(argument) for argument in formula[1:]]
+        if operator=="not":result=~arguments[0]
+        elif operator=="imp":result=~arguments[0] | arguments[1]
+        elif operator=="and":result=np.logical_and.reduce(arguments)
+        elif operator=="or": result=np.logical_or.reduce(arguments)
+        elif operator=="xor":result=np.logical_xor.reduce(arguments)
+        else:raise ValueError("Unknown operator: "+str(operator))
+
+        self.cache.put(self.fingerprint,formula,np.packbits(result))
+        return result
+
+    def vector(self,formula):
+        '''
+        Returns the DSS vector (0/1 integers) of a formula, given as a string or already parsed.
+        As in gen_set_short, formulas that mention propositions that are not in the matrix get a zero vector.
+        '''
+        if isinstance(formula,str):formula=parse_dss_formula(formula)
+        try:
+            return self.evaluate(formula).astype(int)
+        except Unknown_Proposition:
+            return np.zeros(self.n_observations,dtype=int)
+
+
+def regenerate_corpus_vectors(training_elements,matrix,basic_props,cache=None):
+    '''
+    Recomputes the DSS vectors and belief vectors of existing Training_Elements using a (new) situation space matrix,
+    this replaces running gen_set_short in prolog followed by load_prolog_corpus_belief.
+    Returns the corpus and the impossible corpus, split as in load_prolog_corpus_belief.
+    cache is an optional Formula_Vector_Cache shared among the sentences (and among runs if it has a cache_dir)
+    '''
+    evaluator=DSS_Formula_Evaluator(matrix,basic_props,cache)
+    corpus=[]
+    impossible_corpus=[]
+    for training_item in training_elements:
+        training_item.vector=evaluator.vector(training_item.semantics)
+        training_item.belief_vector=np.dot(training_item.vector,matrix)
+        prior_v=np.sum(training_item.vector)
+        if prior_v:
+            training_item.belief_vector=training_item.belief_vector/prior_v
+            corpus.append(training_item)
+        else:impossible_corpus.append(training_item)
+    return corpus,impossible_corpus
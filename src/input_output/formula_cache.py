@@ -0,0 +1,155 @@
+'''
+%        Copyright 2022 Jesús Calvillo <jescalvillot@gmail.com>
+%
+%      Licensed under the Apache License, Version 2.0 (the "License");
+%      you may not use this file except in compliance with the License.
+%      You may obtain a copy of the License at
+%
+%           http://www.apache.org/licenses/LICENSE-2.0
+%
+%     Unless required by applicable law or agreed to in writing, software
+%     distributed under the License is distributed on an "AS IS" BASIS,
+%     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+%     See the License for the specific language governing permissions and
+%     limitations under the License.
+
+Cache of DSS vectors of (sub)formulas, used by DSS_Formula_Evaluator.
+
+Corpora repeat the same subformulas many times (e.g. the disjunction of all places, or walk(john) in every coordinated
+sentence about john), so the vector of each subformula is stored once it has been computed.
+The key of each entry is the canonical form of the formula plus a fingerprint of the situation space matrix:
+    - and/or/xor are commutative and associative, their arguments are flattened and sorted, so (a & b) and (b & a) share an entry
+    - and/or are idempotent, repeated arguments are removed
+Vectors are kept as packed bits in an in-memory LRU bounded in bytes. Optionally, entries are also written to a directory
+(one subdirectory per matrix fingerprint), so that later runs against the same .observations file reuse them.
+'''
+
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+from collections import OrderedDict
+
+COMMUTATIVE_OPERATORS=["and","or","xor"]
+IDEMPOTENT_OPERATORS=["and","or"]
+
+
+def canonicalize_formula(formula):
+    '''
+    Returns the canonical form of a formula parsed by parse_dss_formula.
+    Commutative operators become n-ary tuples with sorted arguments, e.g. ("and",A,("and",C,B)) -> ("and",A,B,C)
+    '''
+    operator=formula[0]
+    if operator=="event":return formula
+    arguments=[canonicalize_formula(argument) for argument in formula[1:]]
+    if operator not in COMMUTATIVE_OPERATORS:return tuple([operator]+arguments)
+
+    flat=[]
+    for argument in arguments:
+        if argument[0]==operator:flat.extend(argument[1:])
+        else:flat.append(argument)
+    if operator in IDEMPOTENT_OPERATORS:flat=list(set(flat))
+    flat.sort(key=repr)
+    if len(flat)==1:return flat[0]
+    return tuple([operator]+flat)
+
+
+def matrix_fingerprint(matrix,basic_props):
+    '''
+    Hash that identifies a situation space matrix together with its basic propositions
+    '''
+    matrix=np.asarray(matrix)
+    digest=hashlib.blake2b(digest_size=16)
+    digest.update(" ".join(basic_props).encode("utf-8"))
+    digest.update(str(matrix.shape).encode("utf-8"))
+    digest.update(np.packbits(matrix!=0).tobytes())
+    return digest.hexdigest()
+
+
+class Formula_Vector_Cache:
+    '''
+    LRU cache from (matrix fingerprint, canonical formula) to the packed bits of its DSS vector.
+    max_bytes bounds the memory used by the vectors kept in memory, cache_dir (optional) enables the on-disk tier.
+    '''
+    def __init__(self,max_bytes=256*1024*1024,cache_dir=None):
+        self.max_bytes=max_bytes
+        self.cache_dir=cache_dir
+        self.entries=OrderedDict()
+        self.current_bytes=0
+        self.hits=0
+        self.disk_hits=0
+        self.misses=0
+        self.evictions=0
+
+    def _disk_path(self,fingerprint,formula):
+        key=hashlib.blake2b(repr(formula).encode("utf-8"),digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir,fingerprint,key+".npy")
+
+    def _add_to_memory(self,key,bits):
+        if bits.nbytes>self.max_bytes:return
+        self.entries[key]=bits
+        self.current_bytes+=bits.nbytes
+        while self.current_bytes>self.max_bytes:
+            (_,old_bits)=self.entries.popitem(last=False)
+            self.current_bytes-=old_bits.nbytes
+            self.evictions+=1
+
+    def get(self,fingerprint,formula):
+        '''
+        Returns the packed bits stored for a canonical formula or None
+        '''
+        key=(fingerprint,formula)
+        bits=self.entries.get(key)
+        if bits is not None:
+            self.entries.move_to_end(key)
+            self.hits+=1
+            return bits
+
+        if self.cache_dir:
+            path=self._disk_path(fingerprint,formula)
+            if os.path.exists(path):
+                bits=np.load(path)
+                self._add_to_memory(key,bits)
+                self.disk_hits+=1
+                return bits
+
+        self.misses+=1
+        return None
+
+    def put(self,fingerprint,formula,bits):
+        key=(fingerprint,formula)
+        if key in self.entries:return
+        self._add_to_memory(key,bits)
+        if self.cache_dir:
+            path=self._disk_path(fingerprint,formula)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path),exist_ok=True)
+                #written to a temporary file that is renamed, so an interrupted or concurrent run never leaves a truncated .npy
+                temp_file=tempfile.NamedTemporaryFile(dir=os.path.dirname(path),suffix=".tmp",delete=False)
+                try:
+                    with temp_file:np.save(temp_file,bits)
+                    os.replace(temp_file.name,path)
+                except BaseException:
+                    os.remove(temp_file.name)
+                    raise
+
+    def clear(self):
+        '''
+        Empties the in-memory tier, the files on disk are kept
+        '''
+        self.entries.clear()
+        self.current_bytes=0
+
+    def get_stats(self):
+        lookups=self.hits+self.disk_hits+self.misses
+        return {"hits":self.hits,
+                "disk_hits":self.disk_hits,
+                "misses":self.misses,
+                "evictions":self.evictions,
+                "hit_rate":(self.hits+self.disk_hits)/lookups if lookups else 0.0,
+                "entries":len(self.entries),
+                "bytes":self.current_bytes}
+
+    def print_stats(self):
+        for name,value in self.get_stats().items():print(name,value)
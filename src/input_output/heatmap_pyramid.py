@@ -0,0 +1,230 @@
+'''
+%        Copyright 2022 Jesús Calvillo <jescalvillot@gmail.com>
+%
+%      Licensed under the Apache License, Version 2.0 (the "License");
+%      you may not use this file except in compliance with the License.
+%      You may obtain a copy of the License at
+%
+%           http://www.apache.org/licenses/LICENSE-2.0
+%
+%     Unless required by applicable law or agreed to in writing, software
+%     distributed under the License is distributed on an "AS IS" BASIS,
+%     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+%     See the License for the specific language governing permissions and
+%     limitations under the License.
+
+Multi-resolution heatmap of a whole situation space matrix (time x basic propositions), for runs that are too long to be
+given to plotly at once.
+
+The matrix is aggregated into time bins (mean activation of each basic proposition in each bin) at several zoom levels:
+level 0 has bins of finest_bin observations, and each next level has bins factor times larger, until the whole run fits
+in max_columns bins. Each level is stored in tiles of tile_bins bins, quantized to one byte per value (0..255), as small
+javascript files next to the page:
+    output_dir/index.html               the heatmap
+    output_dir/meta.json                sizes of the levels and tiles, basic propositions
+    output_dir/level_<l>/tile_<i>.js    tile i of level l
+    output_dir/plotly.min.js            shared plotly library
+The page first shows the coarsest level (the whole run); when zooming, it loads the tiles of the finest level that still
+fits in max_columns columns, only for the visible range. Tiles are loaded with script tags, so the page also works when
+opened directly from the disk (no web server needed).
+
+    write_heatmap_pyramid(matrix,basic_props,"../outputs/websites/street_life1M_heatmap/")
+'''
+
+import os
+import json
+import base64
+import numpy as np
+
+from input_output.heatmap_site import PLOTLY_BUNDLE_NAME
+
+
+def get_bin_counts(matrix,bin_size,chunk_size=65536):
+    '''
+    counts[b,i]: number of observations of bin b in which basic proposition i is true; sizes[b]: observations in bin b.
+    The matrix is read in chunks (it can be a memory map).
+    '''
+    n_observations,n_props=matrix.shape
+    n_bins=-(-n_observations//bin_size)
+    counts=np.zeros((n_bins,n_props),dtype=np.uint32)
+    chunk_size=max(bin_size,chunk_size-chunk_size%bin_size) #chunks made of whole bins
+    for start in range(0,n_observations,chunk_size):
+        chunk=np.asarray(matrix[start:start+chunk_size],dtype=np.uint32)
+        counts[start//bin_size:start//bin_size+(-(-len(chunk)//bin_size))]=np.add.reduceat(chunk,np.arange(0,len(chunk),bin_size),axis=0)
+    sizes=np.full(n_bins,bin_size,dtype=np.int64)
+    if n_bins:sizes[-1]=n_observations-(n_bins-1)*bin_size
+    return counts,sizes
+
+
+def build_time_pyramid(matrix,factor=4,finest_bin=1,max_columns=2000,chunk_size=65536):
+    '''
+    Returns the levels, from the finest to the coarsest, as (bin_size, counts, sizes) (see get_bin_counts).
+    Each level is obtained from the previous one, so the matrix is only read once.
+    '''
+    counts,sizes=get_bin_counts(matrix,finest_bin,chunk_size)
+    levels=[(finest_bin,counts,sizes)]
+    while len(levels[-1][1])>max_columns:
+        bin_size,counts,sizes=levels[-1]
+        starts=np.arange(0,len(counts),factor)
+        levels.append((bin_size*factor,np.add.reduceat(counts,starts,axis=0),np.add.reduceat(sizes,starts)))
+    return levels
+
+
+def quantize_means(counts,sizes):
+    '''
+    Mean activations as bytes, 0 -> 0 and 1 -> 255
+    '''
+    return np.rint(counts*(255.0/sizes[:,None])).astype(np.uint8)
+
+
+def write_tile(path,level,index,values):
+    '''
+    values: bins x basic propositions, written transposed (one row of bins per basic proposition) in base64
+    '''
+    data=base64.b64encode(np.ascontiguousarray(values.T).tobytes()).decode("ascii")
+    with open(path,'w') as tile_file:
+        tile_file.write("registerTile(%d,%d,\"%s\");\n"%(level,index,data))
+
+
+def read_tile(path,n_props):
+    '''
+    Inverse of write_tile: returns the tile as bins x basic propositions (uint8)
+    '''
+    with open(path,'r') as tile_file:text=tile_file.read()
+    data=base64.b64decode(text[text.index("\"")+1:text.rindex("\"")])
+    return np.frombuffer(data,dtype=np.uint8).reshape(n_props,-1).T
+
+
+def read_pyramid_level(output_dir,level):
+    '''
+    Mean activations (bins x basic propositions, in 0..1) of one level of a pyramid written with write_heatmap_pyramid
+    '''
+    with open(os.path.join(output_dir,"meta.json"),'r') as meta_file:meta=json.load(meta_file)
+    n_props=len(meta["basic_props"])
+    tiles=[read_tile(os.path.join(output_dir,"level_%d"%level,"tile_%d.js"%index),n_props) for index in range(meta["levels"][level]["n_tiles"])]
+    if not tiles:return np.zeros((0,n_props))
+    return np.concatenate(tiles)/255.0
+
+
+def write_heatmap_pyramid(matrix,basic_props,output_dir,title="Situation space matrix",factor=4,finest_bin=1,max_columns=2000,tile_bins=1024,chunk_size=65536):
+    '''
+    Writes the multi-resolution heatmap of the matrix into output_dir, returns the path of the page
+    '''
+    os.makedirs(output_dir,exist_ok=True)
+    bundle_path=os.path.join(output_dir,PLOTLY_BUNDLE_NAME)
+    if not os.path.exists(bundle_path):
+        from plotly.offline import get_plotlyjs
+        with open(bundle_path,'w') as bundle_file:bundle_file.write(get_plotlyjs())
+
+    levels=build_time_pyramid(matrix,factor,finest_bin,max_columns,chunk_size)
+    meta={"title":title,"n_observations":int(matrix.shape[0]),"basic_props":list(basic_props),"factor":factor,
+          "max_columns":max_columns,"tile_bins":tile_bins,"levels":[]}
+    for level,(bin_size,counts,sizes) in enumerate(levels):
+        level_dir=os.path.join(output_dir,"level_%d"%level)
+        os.makedirs(level_dir,exist_ok=True)
+        n_tiles=-(-len(counts)//tile_bins)
+        for index in range(n_tiles):
+            tile=slice(index*tile_bins,(index+1)*tile_bins)
+            write_tile(os.path.join(level_dir,"tile_%d.js"%index),level,index,quantize_means(counts[tile],sizes[tile]))
+        meta["levels"].append({"bin_size":bin_size,"n_bins":len(counts),"n_tiles":n_tiles})
+
+    with open(os.path.join(output_dir,"meta.json"),'w') as meta_file:json.dump(meta,meta_file,indent=1)
+    page_path=os.path.join(output_dir,"index.html")
+    with open(page_path,'w') as page_file:
+        page_file.write(PAGE_TEMPLATE.replace("%PLOTLY%",PLOTLY_BUNDLE_NAME).replace("%META%",json.dumps(meta)))
+    return page_path
+
+
+PAGE_TEMPLATE='''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<script src="%PLOTLY%"></script>
+</head>
+<body>
+<div id="info" style="font-family:sans-serif;font-size:13px"></div>
+<div id="heatmap"></div>
+<script>
+const META=%META%;
+const tiles={};
+const waiting={};
+let lastRequest=0;
+
+function registerTile(level,index,data){
+    const key=level+"_"+index;
+    const text=atob(data);
+    const values=new Uint8Array(text.length);
+    for(let i=0;i<text.length;i++)values[i]=text.charCodeAt(i);
+    tiles[key]=values;
+    (waiting[key]||[]).forEach(resolve=>resolve());
+    delete waiting[key];
+}
+
+function loadTile(level,index){
+    const key=level+"_"+index;
+    return new Promise(resolve=>{
+        if(tiles[key]){resolve();return;}
+        if(waiting[key]){waiting[key].push(resolve);return;}
+        waiting[key]=[resolve];
+        const script=document.createElement("script");
+        script.src="level_"+level+"/tile_"+index+".js";
+        document.head.appendChild(script);
+    });
+}
+
+function chooseLevel(start,end){
+    //the finest level that shows the range in at most max_columns columns
+    for(let level=0;level<META.levels.length;level++){
+        if((end-start)/META.levels[level].bin_size<=META.max_columns)return level;
+    }
+    return META.levels.length-1;
+}
+
+async function render(start,end){
+    const request=++lastRequest;
+    start=Math.max(0,start);
+    end=Math.min(META.n_observations,end);
+    const level=chooseLevel(start,end);
+    const info=META.levels[level];
+    const firstBin=Math.max(0,Math.floor(start/info.bin_size));
+    const lastBin=Math.max(firstBin+1,Math.min(info.n_bins,Math.ceil(end/info.bin_size)));
+    const firstTile=Math.floor(firstBin/META.tile_bins),lastTile=Math.floor((lastBin-1)/META.tile_bins);
+    const loads=[];
+    for(let index=firstTile;index<=lastTile;index++)loads.push(loadTile(level,index));
+    await Promise.all(loads);
+    if(request!==lastRequest)return; //the user zoomed again in the meantime
+
+    const nProps=META.basic_props.length;
+    const x=[];
+    const z=META.basic_props.map(()=>[]);
+    for(let bin=firstBin;bin<lastBin;bin++){
+        const index=Math.floor(bin/META.tile_bins);
+        const tileSize=Math.min(META.tile_bins,info.n_bins-index*META.tile_bins);
+        const offset=bin-index*META.tile_bins;
+        const values=tiles[level+"_"+index];
+        x.push(bin*info.bin_size+(info.bin_size-1)/2);
+        for(let prop=0;prop<nProps;prop++)z[prop].push(values[prop*tileSize+offset]/255);
+    }
+    document.getElementById("info").textContent=META.title+": "+META.n_observations+" observations, showing "+
+        Math.round(start)+"-"+Math.round(end)+" with bins of "+info.bin_size+" (level "+level+")";
+    Plotly.react("heatmap",[{type:"heatmap",x:x,y:META.basic_props,z:z,zmin:0,zmax:1,colorscale:"Hot",hoverongaps:false}],
+        {title:META.title,height:Math.max(600,14*nProps),uirevision:"keep",
+         xaxis:{title:"Time Step",range:[start,end]},yaxis:{title:"Basic Proposition",automargin:true}});
+}
+
+let timer=null;
+function onRelayout(event){
+    let start,end;
+    if(event["xaxis.autorange"]){start=0;end=META.n_observations;}
+    else if(event["xaxis.range[0]"]!==undefined){start=event["xaxis.range[0]"];end=event["xaxis.range[1]"];}
+    else if(event["xaxis.range"]){[start,end]=event["xaxis.range"];}
+    else return;
+    clearTimeout(timer);
+    timer=setTimeout(()=>render(start,end),150);
+}
+
+render(0,META.n_observations).then(()=>document.getElementById("heatmap").on("plotly_relayout",onRelayout));
+</script>
+</body>
+</html>
+'''
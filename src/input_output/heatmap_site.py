@@ -0,0 +1,104 @@
+'''
+%        Copyright 2022 Jesús Calvillo <jescalvillot@gmail.com>
+%
+%      Licensed under the Apache License, Version 2.0 (the "License");
+%      you may not use this file except in compliance with the License.
+%      You may obtain a copy of the License at
+%
+%           http://www.apache.org/licenses/LICENSE-2.0
+%
+%     Unless required by applicable law or agreed to in writing, software
+%     distributed under the License is distributed on an "AS IS" BASIS,
+%     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+%     See the License for the specific language governing permissions and
+%     limitations under the License.
+
+Batch version of get_all_basic_props_heatmaps_through_time, used to build the "across_time" website.
+
+- The conditional probabilities through time of all basic propositions are computed at once (get_lagged_condps).
+- The pages are rendered in a process pool.
+- All pages reference a single plotly.min.js file in the output directory instead of embedding the library in each page.
+- A manifest with a hash of the inputs of each page is kept in the output directory, pages whose inputs did not change are skipped.
+'''
+
+import os
+import json
+import hashlib
+
+from concurrent.futures import ProcessPoolExecutor
+
+from input_output.dataset import get_lagged_condps
+
+MANIFEST_NAME="manifest.json"
+PLOTLY_BUNDLE_NAME="plotly.min.js"
+SITE_URL="https://iesus.github.io/dynamic-dss-websites/across_time/"
+PAGE_VERSION=1 #increase to force all pages to be rendered again when the page layout changes
+
+
+def get_page_filename(basic_prop):
+    prop_flatname=basic_prop.replace("(","_").replace(")","").replace(",","_")
+    return prop_flatname+".html"
+
+
+def get_page_hash(condps,graph_label,y_labels,side_size):
+    digest=hashlib.sha1()
+    digest.update(str((PAGE_VERSION,graph_label,list(y_labels),side_size)).encode("utf-8"))
+    digest.update(condps.tobytes())
+    return digest.hexdigest()
+
+
+def _render_page(condps,graph_label,y_labels,side_size,path):
+    '''
+    Writes one page, with the same figure as get_heatmap_through_time
+    '''
+    from input_output.visualization import get_web_heatmap_figure
+
+    steps=list(range(-side_size,side_size+1,1))
+    step_labels=["t="+str(i) for i in steps]
+    graph_title="Conditional Probs P( Y | "+graph_label+" )"
+    fig=get_web_heatmap_figure(condps, step_labels, y_labels, graph_title, "Time Steps","Basic Proposition Y")
+    with open(path,'w') as page_file:
+        page_file.write(fig.to_html(include_plotlyjs="directory",full_html=True))
+    return path
+
+
+def build_across_time_site(matrix,basic_props,output_dir="../outputs/websites/",side_size=7,n_workers=None,force=False):
+    '''
+    Writes one heatmap page per basic proposition into output_dir, plus the shared plotly.min.js and the manifest.
+    Returns the list of pages that were (re)written.
+    '''
+    os.makedirs(output_dir,exist_ok=True)
+    bundle_path=os.path.join(output_dir,PLOTLY_BUNDLE_NAME)
+    if not os.path.exists(bundle_path):
+        from plotly.offline import get_plotlyjs
+        with open(bundle_path,'w') as bundle_file:bundle_file.write(get_plotlyjs())
+
+    manifest_path=os.path.join(output_dir,MANIFEST_NAME)
+    manifest={}
+    if os.path.exists(manifest_path) and not force:
+        with open(manifest_path,'r') as manifest_file:manifest=json.load(manifest_file)
+
+    lagged=get_lagged_condps(matrix,side_size)
+
+    pending=[]
+    new_manifest={}
+    for i,basic_prop in enumerate(basic_props):
+        filename=get_page_filename(basic_prop)
+        page_hash=get_page_hash(lagged[i],basic_prop,basic_props,side_size)
+        new_manifest[filename]=page_hash
+        if manifest.get(filename)!=page_hash or not os.path.exists(os.path.join(output_dir,filename)):
+            pending.append((lagged[i],basic_prop,basic_props,side_size,os.path.join(output_dir,filename)))
+
+        line="* ["+basic_prop+"]("+SITE_URL+filename+")"
+        print(line) #This prints out code that we can put in a github readme file
+
+    written=[]
+    if n_workers==1 or len(pending)<=1:
+        for args in pending:written.append(_render_page(*args))
+    elif pending:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures=[executor.submit(_render_page,*args) for args in pending]
+            written=[future.result() for future in futures]
+
+    with open(manifest_path,'w') as manifest_file:json.dump(new_manifest,manifest_file,indent=1)
+    return written
@@ -0,0 +1,155 @@
+'''
+%        Copyright 2022 Jesús Calvillo <jescalvillot@gmail.com>
+%
+%      Licensed under the Apache License, Version 2.0 (the "License");
+%      you may not use this file except in compliance with the License.
+%      You may obtain a copy of the License at
+%
+%           http://www.apache.org/licenses/LICENSE-2.0
+%
+%     Unless required by applicable law or agreed to in writing, software
+%     distributed under the License is distributed on an "AS IS" BASIS,
+%     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+%     See the License for the specific language governing permissions and
+%     limitations under the License.
+
+Index of the basic propositions of a situation space matrix, to select columns by their meaning instead of by position.
+
+Each basic proposition label is parsed once into its fields:
+    "middle_walk_to(john,h_house)"  predicate=middle_walk_to  event=walk_to  phase=middle  agent=john  argument=h_house
+    "place(bus,intersection)"       predicate=place           event=place    phase=""      agent=bus   argument=intersection
+    "rain"                          predicate=rain            event=rain     phase=""      agent=""    argument=""
+and, for each field and value, the array of columns that have it is precomputed. Selections are then intersections of
+those arrays, and they return sorted column indices that can be used directly to slice the matrix:
+
+    index=Proposition_Index.from_observations_file("../outputs/street_life30K.observations")
+    john_columns=index.select(involves="john")                          #john as agent or as argument (e.g. hit(bus,john))
+    begin_columns=index.select(phase="begin")
+    bus_place=index.select(event="place",agent="bus")
+    matrix[:,index.select(agent="john",event=["walk_to","fall"])]
+
+Each field accepts a value or a list of values (any of them).
+'''
+
+import numpy as np
+
+PHASES=["begin","middle","result"]
+FIELDS=["predicate","event","phase","agent","argument","involves"]
+
+
+def parse_proposition_label(label):
+    '''
+    "place(john,jm_house)" -> ("place","john","jm_house") , "rain" or "rain()" -> ("rain",)
+    '''
+    label=label.strip()
+    if "(" not in label:return (label,)
+    predicate,arguments=label[:-1].split("(",1)
+    return tuple([predicate]+[argument.strip() for argument in arguments.split(",") if argument.strip()])
+
+
+def get_proposition_label(proposition):
+    '''
+    ("place","john","jm_house") -> "place(john,jm_house)" , ("rain",) -> "rain" (as in the .observations header)
+    '''
+    if len(proposition)==1:return proposition[0]
+    return proposition[0]+"("+",".join(proposition[1:])+")"
+
+
+def split_phase(predicate):
+    '''
+    "begin_cross_street" -> ("begin","cross_street") , "walk" -> ("","walk")
+    '''
+    for phase in PHASES:
+        if predicate.startswith(phase+"_"):return phase,predicate[len(phase)+1:]
+    return "",predicate
+
+
+class Proposition_Index:
+    def __init__(self,propositions):
+        '''
+        propositions: tuples as in world.propositions, e.g. ("place","john","jm_house")
+        '''
+        self.propositions=[tuple(prop) for prop in propositions]
+        self.labels=[get_proposition_label(prop) for prop in self.propositions]
+        self.label_index={label:i for i,label in enumerate(self.labels)}
+
+        n_props=len(self.propositions)
+        self.predicate=np.array([prop[0] for prop in self.propositions],dtype=object)
+        phases_events=[split_phase(prop[0]) for prop in self.propositions]
+        self.phase=np.array([phase for (phase,_) in phases_events],dtype=object)
+        self.event=np.array([event for (_,event) in phases_events],dtype=object)
+        self.agent=np.array([prop[1] if len(prop)>1 else "" for prop in self.propositions],dtype=object)
+        self.argument=np.array([prop[2] if len(prop)>2 else "" for prop in self.propositions],dtype=object)
+
+        #For each field, value -> sorted array of columns
+        self.columns={field:{} for field in FIELDS}
+        for column in range(n_props):
+            for field in ["predicate","event","phase","agent","argument"]:
+                self.columns[field].setdefault(getattr(self,field)[column],[]).append(column)
+            for entity in set(self.propositions[column][1:]):
+                self.columns["involves"].setdefault(entity,[]).append(column)
+        for field in FIELDS:
+            self.columns[field]={value:np.array(columns,dtype=np.int64) for value,columns in self.columns[field].items()}
+        self.all_columns=np.arange(n_props,dtype=np.int64)
+        self.selections={}
+
+    @classmethod
+    def from_labels(cls,basic_props):
+        '''
+        basic_props: labels as in the header of the .observations file (the ones returned by load_prolog_situation_space_matrix)
+        '''
+        return cls([parse_proposition_label(label) for label in basic_props])
+
+    @classmethod
+    def from_observations_file(cls,filename):
+        '''
+        Only the header of the file is read
+        '''
+        with open(filename,'r') as file:
+            basic_props=file.readline().split()
+        return cls.from_labels(basic_props)
+
+    def __len__(self):
+        return len(self.propositions)
+
+    def column(self,label):
+        '''
+        Column of a basic proposition, given as a label or as a tuple
+        '''
+        if isinstance(label,tuple):label=get_proposition_label(label)
+        return self.label_index[label]
+
+    def get_field_columns(self,field,values):
+        '''
+        Columns in which field has the value, or any of the values if a list is given
+        '''
+        if field not in self.columns:raise ValueError("Unknown field: "+str(field)+", the fields are "+", ".join(FIELDS))
+        if isinstance(values,str):return self.columns[field].get(values,self.all_columns[:0])
+        arrays=[self.columns[field][value] for value in values if value in self.columns[field]]
+        if not arrays:return self.all_columns[:0]
+        return np.unique(np.concatenate(arrays))
+
+    def select(self,predicate=None,event=None,phase=None,agent=None,argument=None,involves=None):
+        '''
+        Sorted columns of the basic propositions that match all the given fields (fields that are None are not restricted).
+        Results are cached, so repeated selections only cost a dictionary lookup.
+        '''
+        query=(("predicate",predicate),("event",event),("phase",phase),("agent",agent),("argument",argument),("involves",involves))
+        key=tuple((field,value if value is None or isinstance(value,str) else tuple(value)) for field,value in query)
+        if key in self.selections:return self.selections[key]
+        selected=self.all_columns
+        for field,value in query:
+            if value is None:continue
+            selected=np.intersect1d(selected,self.get_field_columns(field,value),assume_unique=True)
+        selected.flags.writeable=False #it is shared through the cache
+        self.selections[key]=selected
+        return selected
+
+    def get_labels(self,columns):
+        return [self.labels[column] for column in columns]
+
+    def get_values(self,field):
+        '''
+        Distinct values of a field, e.g. get_values("agent") -> the participants
+        '''
+        return sorted(value for value in self.columns[field] if value)
@@ -0,0 +1,309 @@
+'''
+%        Copyright 2022 Jesús Calvillo <jescalvillot@gmail.com>
+%
+%      Licensed under the Apache License, Version 2.0 (the "License");
+%      you may not use this file except in compliance with the License.
+%      You may obtain a copy of the License at
+%
+%           http://www.apache.org/licenses/LICENSE-2.0
+%
+%     Unless required by applicable law or agreed to in writing, software
+%     distributed under the License is distributed on an "AS IS" BASIS,
+%     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+%     See the License for the specific language governing permissions and
+%     limitations under the License.
+
+Local query service over a situation space matrix.
+
+The matrix is first converted once into bitsets (see bitset_matrix.py):
+    Bitset_Situation_Matrix.from_observations_file("street_life30K.observations").save("street_life30K.bits")
+Then the service is started with the bitsets memory mapped:
+    python -m input_output.query_service street_life30K.bits --port 8765        (or --socket /tmp/dss.sock)
+
+Queries are conjunctions of literals. A literal is a basic proposition, optionally negated with "!" and optionally
+moved in time with "@lag", relative to a reference time t:
+    rain            rain is true at t
+    !walk(john)     walk(john) is false at t
+    fall(john)@2    fall(john) is true at t+2
+Only reference times t for which all the mentioned times exist are taken into account.
+
+Query types (POST /query with a json body, or GET /query?type=...&a=...&given=... with repeated a/given parameters):
+    {"type":"prior","a":[...]}                                  P(a)
+    {"type":"joint","a":[...],"b":[...]}                        P(a,b)
+    {"type":"cond","a":[...],"given":[...]}                     P(a|given)
+    {"type":"cond_through_time","a":[...],"given":[...],"side_size":7}
+                                                                [P(a@time|given) for time in -side_size..side_size]
+Other endpoints: GET /props (basic propositions), GET /stats (cache statistics).
+
+Conjunctions are evaluated starting from the most selective literal; after the first one, only the words of the bitsets
+that still have bits on are processed. Literal bitsets and query results are kept in LRU caches.
+'''
+
+import json
+import asyncio
+import numpy as np
+
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+
+from input_output.bitset_matrix import Bitset_Situation_Matrix, popcount, shift_bits, pack_bits
+
+QUERY_TYPES=["prior","joint","cond","cond_through_time"]
+
+
+class LRU_Cache:
+    def __init__(self,max_entries):
+        self.max_entries=max_entries
+        self.entries=OrderedDict()
+        self.hits=0
+        self.misses=0
+
+    def get(self,key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits+=1
+            return self.entries[key]
+        self.misses+=1
+        return None
+
+    def put(self,key,value):
+        self.entries[key]=value
+        self.entries.move_to_end(key)
+        if len(self.entries)>self.max_entries:self.entries.popitem(last=False)
+
+    def get_stats(self):
+        return {"hits":self.hits,"misses":self.misses,"entries":len(self.entries)}
+
+
+def parse_literal(text):
+    '''
+    "!fall(john)@2" -> ("fall(john)",2,True)  (proposition, lag, negated)
+    '''
+    text=text.strip()
+    negated=text.startswith("!")
+    if negated:text=text[1:].strip()
+    lag=0
+    if "@" in text:
+        text,lag_text=text.rsplit("@",1)
+        lag=int(lag_text)
+    return (text.strip(),lag,negated)
+
+
+class Query_Engine:
+    '''
+    Answers probability queries over a Bitset_Situation_Matrix. It can be used directly, without the server.
+    '''
+    def __init__(self,bitset_matrix,cache_size=10000,literal_cache_size=1024):
+        self.matrix=bitset_matrix
+        self.n_observations=bitset_matrix.n_observations
+        self.priors=popcount(np.asarray(bitset_matrix.columns))
+        self.results=LRU_Cache(cache_size)
+        self.literals=LRU_Cache(literal_cache_size)
+
+    def get_literal_words(self,literal):
+        '''
+        Bitset of a parsed literal, together with its number of bits on (used to plan the evaluation)
+        '''
+        (prop,lag,negated)=literal
+        if lag==0 and not negated:
+            index=self.matrix.prop_index[prop]
+            return self.matrix.columns[index],int(self.priors[index])
+
+        cached=self.literals.get(literal)
+        if cached is not None:return cached
+        words=self.matrix.column(prop)
+        if negated:words=self.matrix.negation(words)
+        #p@lag is true at t if p is true at t+lag, that is slide_time(p,-lag)
+        words=shift_bits(words,-lag,self.n_observations)
+        cached=(words,int(popcount(words)))
+        self.literals.put(literal,cached)
+        return cached
+
+    def get_window_words(self,first,last):
+        '''
+        Bitset with the reference times first..last on
+        '''
+        key=("window",first,last)
+        cached=self.literals.get(key)
+        if cached is not None:return cached
+        vector=np.zeros(self.n_observations,dtype=bool)
+        vector[first:last+1]=True
+        cached=(pack_bits(vector),max(0,last-first+1))
+        self.literals.put(key,cached)
+        return cached
+
+    def get_window(self,literals):
+        lags=[lag for (_,lag,_) in literals]+[0]
+        return max(0,-min(lags)),self.n_observations-1-max(0,max(lags))
+
+    def count(self,literals,window):
+        '''
+        Number of reference times in window where all literals are true.
+        Literals are intersected from the most to the least selective one, keeping only the nonzero words.
+        '''
+        planned=sorted([self.get_literal_words(literal) for literal in literals]+[self.get_window_words(*window)],key=lambda item:item[1])
+        (words,n_on)=planned[0]
+        if n_on==0:return 0
+        indices=np.flatnonzero(words)
+        values=np.asarray(words[indices])
+        for (words,_) in planned[1:]:
+            values=values & words[indices]
+            nonzero=values!=0
+            if not nonzero.all():
+                indices=indices[nonzero]
+                values=values[nonzero]
+            if len(values)==0:return 0
+        return int(popcount(values))
+
+    def _cached_count(self,literals,window):
+        key=(tuple(sorted(set(literals))),window)
+        result=self.results.get(key)
+        if result is None:
+            result=self.count(key[0],window)
+            self.results.put(key,result)
+        return result
+
+    def prior(self,a):
+        window=self.get_window(a)
+        total=window[1]-window[0]+1
+        if total<=0:return 0.0
+        return self._cached_count(a,window)/total
+
+    def joint(self,a,b):
+        return self.prior(a+b)
+
+    def cond(self,a,given):
+        window=self.get_window(a+given)
+        given_count=self._cached_count(given,window)
+        if given_count==0:return 0.0
+        return self._cached_count(a+given,window)/given_count
+
+    def cond_through_time(self,a,given,side_size=7):
+        condps=[]
+        for time in range(-side_size,side_size+1):
+            moved=[(prop,lag+time,negated) for (prop,lag,negated) in a]
+            condps.append(self.cond(moved,given))
+        return condps
+
+    def answer(self,query):
+        '''
+        Answers a query given as a dictionary (see the module docstring), returns a json-serializable dictionary
+        '''
+        if not isinstance(query,dict):raise ValueError("A query must be a json object, not "+type(query).__name__)
+        query_type=query.get("type")
+        if not isinstance(query_type,str) or query_type not in QUERY_TYPES:raise ValueError("Unknown query type: "+str(query_type))
+        literals={}
+        for name in ["a","b","given"]:
+            values=query.get(name,[])
+            if isinstance(values,str):values=[values]
+            if not isinstance(values,list) or not all(isinstance(value,str) for value in values):
+                raise ValueError("\""+name+"\" must be a literal or a list of literals (strings)")
+            literals[name]=[parse_literal(value) for value in values]
+            for (prop,_,_) in literals[name]:
+                if prop not in self.matrix.prop_index:raise ValueError("Unknown basic proposition: "+prop)
+
+        if query_type=="prior":result=self.prior(literals["a"])
+        elif query_type=="joint":result=self.joint(literals["a"],literals["b"])
+        elif query_type=="cond":result=self.cond(literals["a"],literals["given"])
+        else:
+            side_size=query.get("side_size",7)
+            if isinstance(side_size,bool) or not isinstance(side_size,(int,str)):raise ValueError("\"side_size\" must be an integer")
+            result=self.cond_through_time(literals["a"],literals["given"],int(side_size))
+        return {"query":query,"result":result}
+
+    def get_stats(self):
+        return {"results":self.results.get_stats(),"literals":self.literals.get_stats()}
+
+
+#############################################################################################################
+#### HTTP SERVER
+#############################################################################################################
+STATUS_TEXT={200:"OK",400:"Bad Request",404:"Not Found"}
+
+
+def handle_request(engine,method,target,body):
+    '''
+    Returns (status, response dictionary)
+    '''
+    url=urlsplit(target)
+    try:
+        if url.path=="/props":return 200,{"basic_props":engine.matrix.basic_props}
+        if url.path=="/stats":return 200,engine.get_stats()
+        if url.path!="/query":return 404,{"error":"unknown path "+url.path}
+
+        if method=="POST":query=json.loads(body.decode("utf-8"))
+        else:
+            parameters=parse_qs(url.query)
+            query={name:values for name,values in parameters.items()}
+            for name in ["type","side_size"]:
+                if name in query:query[name]=query[name][0]
+        return 200,engine.answer(query)
+    except (ValueError,KeyError,TypeError) as error: #malformed queries
+        return 400,{"error":str(error)}
+
+
+async def serve_connection(engine,reader,writer):
+    '''
+    Minimal HTTP/1.1 handling with keep-alive
+    '''
+    try:
+        while True:
+            request_line=await reader.readline()
+            if not request_line:break
+            method,target,_=request_line.decode("latin-1").split(" ",2)
+            headers={}
+            while True:
+                line=await reader.readline()
+                if line in (b"\r\n",b"\n",b""):break
+                name,value=line.decode("latin-1").split(":",1)
+                headers[name.strip().lower()]=value.strip()
+            body=await reader.readexactly(int(headers.get("content-length",0)))
+
+            status,response=handle_request(engine,method,target,body)
+            payload=json.dumps(response).encode("utf-8")
+            keep_alive=headers.get("connection","").lower()!="close"
+            writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n"
+                          %(status,STATUS_TEXT[status],len(payload),"keep-alive" if keep_alive else "close")).encode("latin-1")+payload)
+            await writer.drain()
+            if not keep_alive:break
+    except (asyncio.IncompleteReadError,ConnectionResetError,ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def run_server(engine,host="127.0.0.1",port=8765,socket_path=None):
+    handler=lambda reader,writer:serve_connection(engine,reader,writer)
+    if socket_path:server=await asyncio.start_unix_server(handler,path=socket_path)
+    else:server=await asyncio.start_server(handler,host,port)
+    async with server:
+        await server.serve_forever()
+
+
+def query(query_dict,host="127.0.0.1",port=8765):
+    '''
+    Client helper for notebooks: sends a query to a running service and returns the result
+    '''
+    from urllib.request import Request, urlopen
+    request=Request("http://%s:%d/query"%(host,port),data=json.dumps(query_dict).encode("utf-8"),
+                    headers={"Content-Type":"application/json"},method="POST")
+    with urlopen(request) as response:
+        return json.loads(response.read().decode("utf-8"))["result"]
+
+
+if __name__ == '__main__':
+    import argparse
+    parser=argparse.ArgumentParser(description="Local query service over a situation space matrix")
+    parser.add_argument("matrix",help="directory saved with Bitset_Situation_Matrix.save, or an .observations file")
+    parser.add_argument("--host",default="127.0.0.1")
+    parser.add_argument("--port",type=int,default=8765)
+    parser.add_argument("--socket",default=None,help="serve on a unix socket instead of tcp")
+    parser.add_argument("--cache-size",type=int,default=10000)
+    args=parser.parse_args()
+
+    if args.matrix.endswith(".observations"):bitset_matrix=Bitset_Situation_Matrix.from_observations_file(args.matrix)
+    else:bitset_matrix=Bitset_Situation_Matrix.load(args.matrix,mmap=True)
+
+    engine=Query_Engine(bitset_matrix,cache_size=args.cache_size)
+    print("Serving",len(bitset_matrix.basic_props),"basic propositions,",bitset_matrix.n_observations,"observations")
+    asyncio.run(run_server(engine,args.host,args.port,args.socket))
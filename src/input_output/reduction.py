@@ -0,0 +1,196 @@
+'''
+%        Copyright 2022 Jesús Calvillo <jescalvillot@gmail.com>
+%
+%      Licensed under the Apache License, Version 2.0 (the "License");
+%      you may not use this file except in compliance with the License.
+%      You may obtain a copy of the License at
+%
+%           http://www.apache.org/licenses/LICENSE-2.0
+%
+%     Unless required by applicable law or agreed to in writing, software
+%     distributed under the License is distributed on an "AS IS" BASIS,
+%     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+%     See the License for the specific language governing permissions and
+%     limitations under the License.
+
+Dimensionality reduction of the situation space by choosing a subset of observations, as reduce_subset.r does,
+but deterministic and scalable to large matrices.
+
+The input is a binary matrix with one row per observation and one column per item, where items are basic propositions
+(the situation space matrix itself) or sentences (their DSS vectors put side by side). All the probabilities of the
+items only depend on how many times each distinct row occurs, so the work is done over the deduplicated rows:
+
+1) Rows are deduplicated by their packed bits, each distinct row gets a count.
+2) Hard inferences (cs(a,b)=1 or -1, see equal_positive_inferences/equal_negative_inferences in reduce_subset.r) can be
+   created by removing observations, never destroyed. To keep them equal, for every pair with 0<P(a|b)<1 we need one chosen
+   row where a and b are true and one where b is true and a is false; and every item has to stay informative.
+   A greedy set cover picks the distinct rows that fulfil all of these requirements.
+3) The requested number of dimensions is distributed among the distinct rows proportionally to their counts (rows of
+   the cover get at least one), so that priors and conditional probabilities stay as close as possible.
+4) The result is checked against the full matrix and reported. If no size is given, candidate sizes are evaluated in a
+   process pool and the smallest one whose priors and conditional probabilities are within the tolerance is chosen.
+'''
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+from input_output.comprehension import get_comprehension_scores
+from input_output.weighted_matrix import get_unique_rows
+
+
+def get_weighted_probs(unique_rows,weights):
+    '''
+    Priors (per item) and conditional probabilities cond[a,b]=P(a|b) of the matrix made of unique_rows repeated weights times
+    '''
+    rows=unique_rows.astype(np.float64)
+    total=weights.sum()
+    counts=weights@rows
+    intersections=(rows*weights[:,None]).T@rows
+    priors=counts/total
+    with np.errstate(divide="ignore",invalid="ignore"):
+        conds=np.where(counts[None,:]>0,intersections/counts[None,:],0.0)
+    return priors,conds
+
+
+def count_pairs(columns_a,columns_b,pairs,chunk_size=4096):
+    '''
+    For each row, number of the pairs (a,b) (array of shape (2,n)) for which columns_a[row,a] and columns_b[row,b] are true
+    '''
+    counts=np.zeros(len(columns_a),dtype=np.int64)
+    for start in range(0,pairs.shape[1],chunk_size):
+        (a,b)=pairs[:,start:start+chunk_size]
+        counts+=(columns_a[:,a]&columns_b[:,b]).sum(axis=1)
+    return counts
+
+
+def get_inference_cover(unique_rows,conds):
+    '''
+    Greedy set cover: returns the distinct rows needed so that every item is true at least once and,
+    for every pair with 0<P(a|b)<1, b co-occurs once with a and once without a.
+    The gain of each row (how many requirements it fulfils) is computed once, and when a row is chosen the gains only
+    lose the requirements it fulfilled, so every requirement is counted twice in total.
+    '''
+    rows=unique_rows.astype(bool)
+    negated=~rows
+    need_with=(conds>0)&(conds<1)        #[a,b]: need a row with a and b
+    need_without=need_with.copy()        #[a,b]: need a row with b but not a
+    need_item=rows.any(axis=0)
+
+    gains=count_pairs(rows,rows,np.array(np.nonzero(need_with)))+count_pairs(negated,rows,np.array(np.nonzero(need_without)))
+    gains+=rows[:,need_item].sum(axis=1)
+    chosen=[]
+    while len(gains):
+        best=int(np.argmax(gains))
+        if gains[best]<=0:break
+        chosen.append(best)
+        row=rows[best]
+        fulfilled_with=need_with&np.outer(row,row)
+        fulfilled_without=need_without&np.outer(~row,row)
+        fulfilled_item=need_item&row
+        gains-=count_pairs(rows,rows,np.array(np.nonzero(fulfilled_with)))+count_pairs(negated,rows,np.array(np.nonzero(fulfilled_without)))
+        gains-=rows[:,fulfilled_item].sum(axis=1)
+        need_with&=~fulfilled_with
+        need_without&=~fulfilled_without
+        need_item&=~row
+    return chosen
+
+
+def allocate_dimensions(counts,dims,required):
+    '''
+    Distributes dims observations among the distinct rows proportionally to their counts (largest remainder),
+    with at least one observation for each required row and never more than the count of a row.
+    dims larger than the number of observations is taken as all of them.
+    '''
+    dims=min(dims,int(counts.sum()))
+    target=dims*counts/counts.sum()
+    allocation=np.floor(target).astype(np.int64)
+    allocation[required]=np.maximum(allocation[required],1)
+
+    missing=dims-allocation.sum()
+    if missing>0:
+        order=[index for index in np.argsort(-(target-allocation),kind="stable") if allocation[index]<counts[index]]
+        allocation[order[:missing]]+=1
+    elif missing<0:
+        #Too many observations because of the required rows, we take them away from the most over-represented rows
+        minimum=np.zeros_like(allocation)
+        minimum[required]=1
+        for index in np.argsort(-(allocation-target),kind="stable"):
+            removable=min(allocation[index]-minimum[index],-missing)
+            allocation[index]-=removable
+            missing+=removable
+            if missing==0:break
+    return allocation
+
+
+def evaluate_reduction(unique_rows,counts,allocation,tolerance):
+    '''
+    Compares the reduced matrix (unique_rows repeated allocation times) with the full one (unique_rows repeated counts times)
+    '''
+    priors,conds=get_weighted_probs(unique_rows,counts.astype(np.float64))
+    reduced_priors,reduced_conds=get_weighted_probs(unique_rows,allocation.astype(np.float64))
+
+    occurring=priors>0
+    cond_mask=occurring[None,:]&occurring[:,None]
+    cond_errors=np.abs(conds-reduced_conds)[cond_mask]
+    cs=get_comprehension_scores(conds,priors)[cond_mask]
+    reduced_cs=get_comprehension_scores(reduced_conds,reduced_priors)[cond_mask]
+
+    report={"dims":int(allocation.sum()),
+            "distinct_rows_used":int((allocation>0).sum()),
+            "informative":bool((reduced_priors[occurring]>0).all()),
+            "equal_positive_inferences":bool(((cs>=1)==(reduced_cs>=1)).all()),
+            "equal_negative_inferences":bool(((cs<=-1)==(reduced_cs<=-1)).all()),
+            "max_prior_error":float(np.abs(priors-reduced_priors).max()) if len(priors) else 0.0,
+            "max_cond_error":float(cond_errors.max()) if len(cond_errors) else 0.0,
+            "conds_within_tolerance":float((cond_errors<=tolerance).mean()) if len(cond_errors) else 1.0,
+            "comprehension_similarity":float(np.corrcoef(cs,reduced_cs)[0,1]) if len(cs)>1 and cs.std()>0 and reduced_cs.std()>0 else 1.0}
+    report["within_tolerance"]=bool(report["informative"] and report["equal_positive_inferences"] and report["equal_negative_inferences"]
+                                    and report["max_prior_error"]<=tolerance and report["max_cond_error"]<=tolerance)
+    return report
+
+
+def _try_dimensions(unique_rows,counts,cover,dims,tolerance):
+    allocation=allocate_dimensions(counts,dims,cover)
+    return allocation,evaluate_reduction(unique_rows,counts,allocation,tolerance)
+
+
+def reduce_observations(matrix,dims=None,tolerance=0.05,n_workers=None,candidate_dims=None):
+    '''
+    matrix: observations x items (basic propositions or sentence DSS vectors as columns)
+    dims: number of observations of the reduced matrix. If None, the smallest of candidate_dims that keeps the
+          probabilities within tolerance is chosen (candidate sizes are evaluated in a process pool)
+    Returns the indices of the chosen observations in the original matrix (reduced vector = vector[observation_indices])
+    and a report of what was preserved.
+    If dims is smaller than the cover of the hard inferences, the cover is kept anyway, and if it is larger than the number of
+    observations all of them are used; report["dims"] says how many observations were returned.
+    '''
+    unique_rows,counts,inverse=get_unique_rows(matrix)
+    _,conds=get_weighted_probs(unique_rows,counts.astype(np.float64))
+    cover=get_inference_cover(unique_rows,conds)
+
+    if dims is not None:
+        allocation,report=_try_dimensions(unique_rows,counts,cover,dims,tolerance)
+    else:
+        n_observations=int(counts.sum())
+        if candidate_dims is None:
+            candidate_dims=sorted({min(n_observations,max(len(cover),int(n_observations*fraction)))
+                                   for fraction in [0.005,0.01,0.02,0.05,0.1,0.2,0.3,0.5,0.75,1.0]})
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures=[executor.submit(_try_dimensions,unique_rows,counts,cover,candidate,tolerance) for candidate in candidate_dims]
+            results=[future.result() for future in futures]
+        good=[result for result in results if result[1]["within_tolerance"]]
+        (allocation,report)=good[0] if good else results[-1]
+
+    #For each distinct row we take its first occurrences in the original matrix
+    order=np.argsort(inverse,kind="stable") #original indices grouped by distinct row, in time order
+    starts=np.concatenate([[0],np.cumsum(counts)[:-1]])
+    observation_indices=[order[starts[row_id]:starts[row_id]+allocation[row_id]] for row_id in np.nonzero(allocation)[0]]
+    observation_indices=np.sort(np.concatenate(observation_indices))
+    report["dims"]=len(observation_indices)
+    report["cover_size"]=len(cover)
+    return observation_indices,report
+
+
+def print_reduction_report(report):
+    for name,value in report.items():print(name,value)
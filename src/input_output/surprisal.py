@@ -0,0 +1,291 @@
+'''
+%        Copyright 2022 Jesús Calvillo <jescalvillot@gmail.com>
+%
+%      Licensed under the Apache License, Version 2.0 (the "License");
+%      you may not use this file except in compliance with the License.
+%      You may obtain a copy of the License at
+%
+%           http://www.apache.org/licenses/LICENSE-2.0
+%
+%     Unless required by applicable law or agreed to in writing, software
+%     distributed under the License is distributed on an "AS IS" BASIS,
+%     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+%     See the License for the specific language governing permissions and
+%     limitations under the License.
+
+Surprisal of each observation of the situation space matrix given its history, and conditional entropy of each basic proposition.
+While probs/event_surprisal.r gives the surprisal of an event given another one, here the matrix is taken as a sequence
+(row t is the state of the microworld at time t) and probabilities are estimated from counts over the whole sequence:
+
+- Full states (order-k Markov): each row is hashed into a 64 bit value and gets a state id; the context of time t is the
+  hash of the k previous states. S(t) = -log2 P(state_t | states_t-k..t-1)
+- Factored per proposition: each basic proposition only looks at its own k previous values, and the surprisal of the
+  observation is the sum over propositions: S_f(t) = -sum_p log2 P(p_t | p_t-k..p_t-1)
+
+Surprisals are in bits; the first k observations have no full context and get NaN.
+The per step surprisals are written to disk chunk by chunk (memory mapped .npy files), the matrix is only held as packed bits:
+
+    results=write_surprisals("street_life30K.observations","../outputs/surprisal_30K",order=2)
+    print_entropy_report(results)
+'''
+
+import os
+import json
+import numpy as np
+
+HASH_SEED=np.uint64(0x9E3779B97F4A7C15)
+
+
+def mix_hash(values):
+    '''
+    splitmix64 finalizer, applied element-wise to an array of uint64
+    '''
+    values=np.asarray(values,dtype=np.uint64)
+    values=(values^(values>>np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+    values=(values^(values>>np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+    return values^(values>>np.uint64(31))
+
+
+def pack_rows(matrix):
+    '''
+    Packs the rows of a binary matrix into bytes (observations x ceil(n_props/8))
+    '''
+    return np.packbits(np.asarray(matrix)!=0,axis=1)
+
+
+def read_packed_rows(filename,chunk_size=65536):
+    '''
+    Reads an .observations file in chunks of rows, returns the basic propositions and the packed rows
+    '''
+    chunks=[]
+    with open(filename,'r') as file:
+        basic_props=file.readline().split()
+        rows=[]
+        for line in file:
+            rows.append(line.split())
+            if len(rows)==chunk_size:
+                chunks.append(pack_rows(np.asarray(rows,dtype=float)))
+                rows=[]
+        if rows:chunks.append(pack_rows(np.asarray(rows,dtype=float)))
+    if chunks:return basic_props,np.concatenate(chunks)
+    return basic_props,np.zeros((0,(len(basic_props)+7)//8),dtype=np.uint8)
+
+
+def hash_rows(packed_rows):
+    '''
+    64 bit hash of each packed row
+    '''
+    n_bytes=packed_rows.shape[1]
+    padded=np.zeros((packed_rows.shape[0],(n_bytes+7)//8*8),dtype=np.uint8)
+    padded[:,:n_bytes]=packed_rows
+    words=padded.view("<u8")
+    hashes=np.full(packed_rows.shape[0],HASH_SEED,dtype=np.uint64)
+    for i in range(words.shape[1]):hashes=mix_hash(hashes^words[:,i])
+    return hashes
+
+
+def get_state_ids(packed_rows):
+    '''
+    Row hashes, state id of each row (ids follow the order of the hashes) and number of distinct states
+    '''
+    hashes=hash_rows(packed_rows)
+    unique_hashes,state_ids=np.unique(hashes,return_inverse=True)
+    return hashes,state_ids.ravel(),len(unique_hashes)
+
+
+def get_context_ids(state_hashes,order):
+    '''
+    Id of the context (the order previous states) of each time step, -1 for the first order time steps.
+    Returns the ids and the number of distinct contexts.
+    '''
+    n_observations=len(state_hashes)
+    context_ids=np.full(n_observations,-1,dtype=np.int64)
+    if n_observations<=order:return context_ids,0
+    if order==0:
+        context_ids[:]=0
+        return context_ids,1
+    context_hashes=np.full(n_observations-order,HASH_SEED,dtype=np.uint64)
+    for lag in range(order,0,-1):
+        context_hashes=mix_hash(context_hashes^state_hashes[order-lag:n_observations-lag])
+    unique_contexts,ids=np.unique(context_hashes,return_inverse=True)
+    context_ids[order:]=ids.ravel()
+    return context_ids,len(unique_contexts)
+
+
+def get_state_surprisal(state_ids,context_ids,n_states,alpha=0.0,out=None,chunk_size=65536):
+    '''
+    -log2 P(state_t | context_t) for each time step, from the counts of the whole sequence.
+    alpha adds alpha pseudo-counts to every (context,state) pair.
+    out: if given (e.g. a memmap), the surprisals are written into it in chunks of chunk_size time steps
+    Also returns the conditional entropy of the states given their context: H(S_t|context)
+    '''
+    if out is None:surprisal=np.full(len(state_ids),np.nan)
+    else:
+        surprisal=out
+        surprisal[:]=np.nan
+    valid=context_ids>=0
+    if not valid.any():return surprisal,float("nan")
+    contexts=context_ids[valid]
+    pairs=contexts*np.int64(n_states)+state_ids[valid]
+    _,pair_ids,pair_counts=np.unique(pairs,return_inverse=True,return_counts=True)
+    pair_ids=pair_ids.ravel()
+    context_counts=np.bincount(contexts)
+    valid_rows=np.flatnonzero(valid)
+    for start in range(0,len(valid_rows),chunk_size):
+        end=start+chunk_size
+        probs=(pair_counts[pair_ids[start:end]]+alpha)/(context_counts[contexts[start:end]]+alpha*n_states)
+        surprisal[valid_rows[start:end]]=-np.log2(probs)
+
+    #H(S|C)=-sum_{c,s} P(c,s) log2 P(s|c), with the empirical (unsmoothed) probabilities
+    n_valid=len(contexts)
+    first_of_pair=np.unique(pair_ids,return_index=True)[1]
+    pair_contexts=contexts[first_of_pair]
+    entropy=-np.sum(pair_counts/n_valid*np.log2(pair_counts/context_counts[pair_contexts]))
+    return surprisal,float(entropy)+0.0 #avoids -0.0
+
+
+def get_own_history_codes(bits,order):
+    '''
+    bits: observations x propositions (0/1), returns for each time step >=order and proposition the integer that encodes
+    the order previous values of the proposition (most recent value in the lowest bit)
+    '''
+    codes=np.zeros((bits.shape[0]-order,bits.shape[1]),dtype=np.int64)
+    for lag in range(1,order+1):
+        codes|=bits[order-lag:bits.shape[0]-lag].astype(np.int64)<<(lag-1)
+    return codes
+
+
+def binary_entropy(probs):
+    probs=np.clip(probs,0.0,1.0)
+    with np.errstate(divide="ignore",invalid="ignore"):
+        entropy=-(probs*np.log2(probs)+(1-probs)*np.log2(1-probs))
+    return np.nan_to_num(entropy,nan=0.0)
+
+
+def _iterate_bit_chunks(packed_rows,n_props,order,chunk_size):
+    '''
+    Yields (start, unpacked rows start-order..end-1) so that every chunk carries the history of its first time step
+    '''
+    for start in range(order,packed_rows.shape[0],chunk_size):
+        end=min(start+chunk_size,packed_rows.shape[0])
+        yield start,np.unpackbits(packed_rows[start-order:end],axis=1,count=n_props)
+
+
+def get_factored_counts(packed_rows,n_props,order,chunk_size=65536):
+    '''
+    counts[p,code,value]: number of times proposition p took value after its own history code
+    '''
+    counts=np.zeros((n_props,2**order,2),dtype=np.int64)
+    offsets=np.arange(n_props,dtype=np.int64)*(2**(order+1))
+    for _,bits in _iterate_bit_chunks(packed_rows,n_props,order,chunk_size):
+        codes=get_own_history_codes(bits,order)
+        keys=offsets+codes*2+bits[order:]
+        counts+=np.bincount(keys.ravel(),minlength=counts.size).reshape(counts.shape)
+    return counts
+
+
+def get_factored_surprisal(bits,counts,order,alpha=0.0):
+    '''
+    Surprisal of each proposition at the time steps order..len(bits)-1 of a chunk of unpacked rows: -log2 P(p_t | own history)
+    '''
+    codes=get_own_history_codes(bits,order)
+    props=np.arange(bits.shape[1])
+    values=bits[order:]
+    history_counts=counts.sum(axis=2)
+    probs=(counts[props,codes,values]+alpha)/(history_counts[props,codes]+2*alpha)
+    return -np.log2(probs)
+
+
+def get_factored_entropies(counts):
+    '''
+    H(p_t | p_t-k..p_t-1) for each proposition
+    '''
+    history_counts=counts.sum(axis=2)
+    total=history_counts.sum(axis=1)
+    with np.errstate(divide="ignore",invalid="ignore"):
+        probs_on=np.where(history_counts>0,counts[:,:,1]/history_counts,0.0)
+    return (history_counts*binary_entropy(probs_on)).sum(axis=1)/np.maximum(total,1)
+
+
+def get_context_entropies(packed_rows,n_props,context_ids,n_contexts,chunk_size=65536):
+    '''
+    H(p_t | full state context) for each proposition: sum_c P(c) H(p|c)
+    '''
+    if n_contexts==0:return np.zeros(n_props)
+    context_counts=np.bincount(context_ids[context_ids>=0],minlength=n_contexts)
+    ones=np.zeros((n_contexts,n_props),dtype=np.int64)
+    first=int(np.argmax(context_ids>=0))
+    for start in range(first,packed_rows.shape[0],chunk_size):
+        end=min(start+chunk_size,packed_rows.shape[0])
+        bits=np.unpackbits(packed_rows[start:end],axis=1,count=n_props)
+        contexts=context_ids[start:end]
+        order=np.argsort(contexts,kind="stable")
+        sorted_contexts=contexts[order]
+        starts=np.flatnonzero(np.r_[True,sorted_contexts[1:]!=sorted_contexts[:-1]])
+        ones[sorted_contexts[starts]]+=np.add.reduceat(bits[order].astype(np.int64),starts,axis=0)
+    probs_on=ones/np.maximum(context_counts,1)[:,None]
+    return (context_counts[:,None]*binary_entropy(probs_on)).sum(axis=0)/max(context_counts.sum(),1)
+
+
+def write_surprisals(observations,output_dir,order=1,alpha=0.0,basic_props=None,chunk_size=65536,per_proposition=False):
+    '''
+    observations: an .observations file or a matrix (observations x basic propositions)
+    Writes into output_dir:
+        state_surprisal.npy     S(t) of the full states
+        factored_surprisal.npy  S_f(t) summed over propositions
+        proposition_surprisal.npy (only with per_proposition) observations x propositions, float32
+        entropies.json          conditional entropies, also returned as a dictionary
+    '''
+    if isinstance(observations,str):basic_props,packed_rows=read_packed_rows(observations,chunk_size)
+    else:
+        observations=np.asarray(observations)
+        if basic_props is None:basic_props=[str(i) for i in range(observations.shape[1])]
+        packed_rows=pack_rows(observations)
+    n_observations=packed_rows.shape[0]
+    n_props=len(basic_props)
+    os.makedirs(output_dir,exist_ok=True)
+
+    state_hashes,state_ids,n_states=get_state_ids(packed_rows)
+    context_ids,n_contexts=get_context_ids(state_hashes,order)
+    state_surprisal=np.lib.format.open_memmap(os.path.join(output_dir,"state_surprisal.npy"),mode="w+",dtype=np.float64,shape=(n_observations,))
+    state_surprisal,state_entropy=get_state_surprisal(state_ids,context_ids,n_states,alpha,out=state_surprisal,chunk_size=chunk_size)
+    state_surprisal.flush()
+
+    counts=get_factored_counts(packed_rows,n_props,order,chunk_size)
+    factored=np.lib.format.open_memmap(os.path.join(output_dir,"factored_surprisal.npy"),mode="w+",dtype=np.float64,shape=(n_observations,))
+    factored[:min(order,n_observations)]=np.nan
+    if per_proposition:
+        per_prop=np.lib.format.open_memmap(os.path.join(output_dir,"proposition_surprisal.npy"),mode="w+",dtype=np.float32,shape=(n_observations,n_props))
+        per_prop[:min(order,n_observations)]=np.nan
+    for start,bits in _iterate_bit_chunks(packed_rows,n_props,order,chunk_size):
+        surprisals=get_factored_surprisal(bits,counts,order,alpha)
+        factored[start:start+len(surprisals)]=surprisals.sum(axis=1)
+        if per_proposition:per_prop[start:start+len(surprisals)]=surprisals
+    factored.flush()
+    if per_proposition:per_prop.flush()
+
+    results={"order":order,
+             "n_observations":int(n_observations),
+             "n_states":int(n_states),
+             "n_contexts":int(n_contexts),
+             "state_entropy":state_entropy,
+             "mean_state_surprisal":float(np.nanmean(state_surprisal)) if n_observations>order else float("nan"),
+             "mean_factored_surprisal":float(np.nanmean(factored)) if n_observations>order else float("nan"),
+             "basic_props":list(basic_props),
+             "own_history_entropies":get_factored_entropies(counts).tolist(),
+             "context_entropies":get_context_entropies(packed_rows,n_props,context_ids,n_contexts,chunk_size).tolist()}
+    with open(os.path.join(output_dir,"entropies.json"),'w') as entropy_file:json.dump(results,entropy_file,indent=1)
+    return results
+
+
+def print_entropy_report(results):
+    for name in ["order","n_observations","n_states","n_contexts","state_entropy","mean_state_surprisal","mean_factored_surprisal"]:
+        print(name,results[name])
+    print("H(p|own history)  H(p|context)  basic proposition")
+    for prop,own,context in zip(results["basic_props"],results["own_history_entropies"],results["context_entropies"]):
+        print("%.4f  %.4f  %s"%(own,context,prop))
+
+
+if __name__ == '__main__':
+    results=write_surprisals("../outputs/street_life1K.observations","../outputs/surprisal_1K",order=1)
+    print_entropy_report(results)
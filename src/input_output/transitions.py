@@ -0,0 +1,233 @@
+'''
+%        Copyright 2022 Jesús Calvillo <jescalvillot@gmail.com>
+%
+%      Licensed under the Apache License, Version 2.0 (the "License");
+%      you may not use this file except in compliance with the License.
+%      You may obtain a copy of the License at
+%
+%           http://www.apache.org/licenses/LICENSE-2.0
+%
+%     Unless required by applicable law or agreed to in writing, software
+%     distributed under the License is distributed on an "AS IS" BASIS,
+%     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+%     See the License for the specific language governing permissions and
+%     limitations under the License.
+
+Empirical state-transition model of a situation space matrix.
+
+The matrices produced by Microworld.run are chains over a limited set of distinct states (rows). Rows are hashed into
+state ids (see surprisal.py), and a sparse matrix counts how many times each context (the order previous states) is
+followed by each state. The model can then:
+- generate new sequences of observations, sampling each next state with the alias method (O(1) per step), which is much
+  faster than running the agent based simulation, e.g. for data augmentation
+- give a compact summary of a world (number of states, of contexts, entropy rate) to compare worlds
+
+    model=Transition_Model.from_observations_file("../outputs/street_life1K.observations",order=1)
+    model.write_observations("../outputs/street_life_surrogate100K.observations",100000,seed=10)
+'''
+
+import numpy as np
+
+from input_output.surprisal import pack_rows, read_packed_rows, get_state_ids, get_context_ids
+
+
+def get_row_cumsum(values,rows,indptr):
+    '''
+    Cumulative sums of values (one per entry of a CSR matrix) that start again at each row, after and before each entry
+    (both from the same sums, so that they compare consistently)
+    '''
+    cumulative=np.concatenate(([0.0],np.cumsum(values)))
+    return cumulative[1:]-cumulative[indptr[rows]],cumulative[:-1]-cumulative[indptr[rows]]
+
+
+def get_row_ranks(query_values,key_values,query_rows,key_rows,row_span,keys_first):
+    '''
+    For each query, how many keys of the same row have a smaller value (or equal, if keys_first). The values of the keys
+    have to be sorted within each row, and rows increasing; row_span is a power of 2 above all the values, so that
+    value+row*row_span is sorted over all the rows (and rounded in the same way for queries and keys)
+    '''
+    keys=key_values+key_rows*row_span
+    row_first_key=np.searchsorted(key_rows,query_rows,side="left")
+    return np.searchsorted(keys,query_values+query_rows*row_span,side="right" if keys_first else "left")-row_first_key
+
+
+def build_alias_tables(indptr,weights):
+    '''
+    Alias tables (Vose) for each row of a CSR matrix. For an entry e of row r, with n entries in the row:
+    the row samples e with probability prob[e]/n, otherwise the entry indptr[r]+alias[e].
+    All the rows are built at once. Within a row, the entries below the mean ("small") are filled in order from the entries
+    above it ("large") in order; a large entry fills until what it gave away makes it small, and then it is filled from the
+    next large one. Which large entry fills each small one is then given by cumulative sums of deficits and excesses.
+    '''
+    lengths=np.diff(indptr)
+    rows=np.repeat(np.arange(len(lengths)),lengths)
+    positions=np.arange(len(weights))-indptr[rows]
+    prob=np.ones(len(weights),dtype=np.float64)
+    alias=positions.copy()
+    if not len(weights):return prob,alias
+    
+    sums=np.bincount(rows,weights,minlength=len(lengths))
+    scaled=weights*lengths[rows]/sums[rows]
+    small=scaled<1.0
+    large=~small
+    deficits,previous_deficits=get_row_cumsum(np.where(small,1.0-scaled,0.0),rows,indptr)  #after/before each small entry
+    excesses,_=get_row_cumsum(np.where(large,scaled-1.0,0.0),rows,indptr)                 #after each large entry
+    
+    large_entries=np.flatnonzero(large)
+    small_entries=np.flatnonzero(small)
+    first_large=np.concatenate(([0],np.cumsum(np.bincount(rows[large],minlength=len(lengths)))))
+    first_small=np.concatenate(([0],np.cumsum(np.bincount(rows[small],minlength=len(lengths)))))
+    n_large=np.diff(first_large)
+    n_small=np.diff(first_small)
+    
+    small_rows=rows[small]
+    large_rows=rows[large]
+    row_span=2.0**np.ceil(np.log2(lengths.max()+2))
+    
+    #A small entry is filled by the first large entry whose excess was not used up before it
+    filler=get_row_ranks(previous_deficits[small],excesses[large],small_rows,large_rows,row_span,keys_first=False)
+    has_large=n_large[small_rows]>0 #without large entries (only by rounding) they are all sampled as they are
+    filler=np.minimum(filler,n_large[small_rows]-1)
+    prob[small_entries[has_large]]=scaled[small][has_large]
+    alias[small_entries[has_large]]=positions[large_entries[first_large[small_rows[has_large]]+filler[has_large]]]
+    
+    #A large entry is used up by the first small entry whose cumulative deficit goes beyond its cumulative excess,
+    #and then it is filled by the next large entry (the last one keeps what is left, which is 1 up to rounding)
+    exhausting=get_row_ranks(excesses[large],deficits[small],large_rows,small_rows,row_span,keys_first=True)
+    ordinal=np.arange(len(large_entries))-first_large[large_rows]
+    used_up=(exhausting<n_small[large_rows])&(ordinal<n_large[large_rows]-1)
+    exhausted_by=small_entries[first_small[large_rows[used_up]]+exhausting[used_up]]
+    prob[large_entries[used_up]]=np.clip(1.0-(deficits[exhausted_by]-excesses[large_entries[used_up]]),0.0,1.0)
+    alias[large_entries[used_up]]=positions[large_entries[np.flatnonzero(used_up)+1]]
+    return prob,alias
+
+
+class Transition_Model:
+    '''
+    counts[c,s]: number of times context c (the order previous states) was followed by state s
+    '''
+    def __init__(self,packed_rows,basic_props,order=1):
+        self.basic_props=list(basic_props)
+        self.order=order
+        state_hashes,state_ids,n_states=get_state_ids(packed_rows)
+        context_ids,n_contexts=get_context_ids(state_hashes,order)
+        self.n_states=n_states
+        self.n_contexts=n_contexts
+        self.n_observations=len(state_ids)
+
+        #One packed row per state id
+        self.state_rows=np.zeros((n_states,packed_rows.shape[1]),dtype=np.uint8)
+        self.state_rows[state_ids]=packed_rows
+
+        from scipy.sparse import csr_matrix
+        
+        valid=context_ids>=0
+        self.counts=csr_matrix((np.ones(int(valid.sum()),dtype=np.int64),(context_ids[valid],state_ids[valid])),shape=(n_contexts,n_states))
+        self.counts.sum_duplicates()
+        self.counts.sort_indices()
+
+        #Each entry (c,s) also knows the context that follows it, so that sampling does not need to hash anything
+        self.next_context=np.full(self.counts.nnz,-1,dtype=np.int64)
+        times=np.flatnonzero(valid[:-1])
+        entries=self._entry_index(context_ids[times],state_ids[times])
+        self.next_context[entries]=context_ids[times+1]
+
+        self.context_counts=np.asarray(self.counts.sum(axis=1)).ravel()
+        self.first_context=context_ids[order] if n_contexts else -1
+        self.alias_prob,self.alias=build_alias_tables(self.counts.indptr,self.counts.data.astype(np.float64))
+
+    @classmethod
+    def from_matrix(cls,matrix,basic_props,order=1):
+        return cls(pack_rows(matrix),basic_props,order)
+
+    @classmethod
+    def from_observations_file(cls,filename,order=1):
+        basic_props,packed_rows=read_packed_rows(filename)
+        return cls(packed_rows,basic_props,order)
+
+    def _entry_index(self,contexts,states):
+        '''
+        Position in counts.data of the entries (contexts[i],states[i]), which have to exist
+        '''
+        #With sorted indices, the keys context*n_states+state of the stored entries are increasing
+        entry_contexts=np.repeat(np.arange(self.n_contexts,dtype=np.int64),np.diff(self.counts.indptr))
+        entry_keys=entry_contexts*self.n_states+self.counts.indices
+        return np.searchsorted(entry_keys,np.asarray(contexts,dtype=np.int64)*self.n_states+states)
+
+    def get_transition_probs(self):
+        '''
+        Sparse matrix of P(state | context)
+        '''
+        probs=self.counts.astype(np.float64)
+        probs.data/=np.repeat(self.context_counts,np.diff(self.counts.indptr))
+        return probs
+
+    def get_summary(self):
+        '''
+        Compact description of the chain, to compare worlds
+        '''
+        probs=self.get_transition_probs()
+        context_weights=np.repeat(self.context_counts/max(self.context_counts.sum(),1),np.diff(self.counts.indptr))
+        entropy_rate=float(-(context_weights*probs.data*np.log2(probs.data)).sum())+0.0
+        branching=np.diff(self.counts.indptr)
+        return {"order":self.order,
+                "n_observations":int(self.n_observations),
+                "n_states":int(self.n_states),
+                "n_contexts":int(self.n_contexts),
+                "n_transitions":int(self.counts.nnz),
+                "entropy_rate":entropy_rate,
+                "deterministic_contexts":float((branching==1).mean()) if len(branching) else 0.0,
+                "mean_branching":float(branching.mean()) if len(branching) else 0.0}
+
+    def print_summary(self):
+        for name,value in self.get_summary().items():print(name,value)
+
+    def sample_states(self,n_steps,seed=None,random_generator=None):
+        '''
+        Generates a sequence of n_steps state ids. It starts from the first context of the original sequence; when a context
+        has no continuation (the end of the original sequence), it restarts from a context drawn proportionally to its counts.
+        '''
+        if random_generator is None:random_generator=np.random.default_rng(seed)
+        if self.n_contexts==0:raise ValueError("The model needs more than order observations")
+        #the loop reads single values, which is much faster from lists than from numpy arrays
+        indptr=self.counts.indptr.tolist()
+        lengths=np.diff(self.counts.indptr).tolist()
+        states=self.counts.indices.tolist()
+        prob,alias,next_context=self.alias_prob.tolist(),self.alias.tolist(),self.next_context.tolist()
+        uniform_entries=random_generator.random(n_steps).tolist()
+        uniform_alias=random_generator.random(n_steps).tolist()
+        restart_cumulative=np.cumsum(self.context_counts)/self.context_counts.sum()
+        restart_cumulative[-1]=1.0 #the rounded sum can be slightly below 1, and random() would then fall past the last context
+
+        sampled=[0]*n_steps
+        context=int(self.first_context)
+        for step in range(n_steps):
+            entry=indptr[context]+int(uniform_entries[step]*lengths[context])
+            if uniform_alias[step]>=prob[entry]:entry=indptr[context]+alias[entry]
+            sampled[step]=states[entry]
+            context=next_context[entry]
+            if context<0:context=int(np.searchsorted(restart_cumulative,random_generator.random(),side="right"))
+        return np.array(sampled,dtype=np.int64)
+
+    def sample_matrix(self,n_steps,seed=None,random_generator=None):
+        '''
+        Generated observations as a binary matrix (n_steps x basic propositions)
+        '''
+        state_ids=self.sample_states(n_steps,seed,random_generator)
+        return np.unpackbits(self.state_rows[state_ids],axis=1,count=len(self.basic_props))
+
+    def write_observations(self,filename,n_steps,seed=None,random_generator=None,chunk_size=65536):
+        '''
+        Writes generated observations in the same format as the microworld (.observations)
+        '''
+        state_ids=self.sample_states(n_steps,seed,random_generator)
+        lines=np.array([" ".join(map(str,row)) for row in np.unpackbits(self.state_rows,axis=1,count=len(self.basic_props))])
+        with open(filename,'w') as output_file:
+            output_file.write(" ".join(self.basic_props)+"\n")
+            for start in range(0,n_steps,chunk_size):
+                output_file.write("\n".join(lines[state_ids[start:start+chunk_size]])+"\n")
+
+
+if __name__ == '__main__':
+    model=Transition_Model.from_observations_file("../outputs/street_life1K.observations",order=1)
+    model.print_summary()
@@ -0,0 +1,153 @@
+'''
+%        Copyright 2022 Jesús Calvillo <jescalvillot@gmail.com>
+%
+%      Licensed under the Apache License, Version 2.0 (the "License");
+%      you may not use this file except in compliance with the License.
+%      You may obtain a copy of the License at
+%
+%           http://www.apache.org/licenses/LICENSE-2.0
+%
+%     Unless required by applicable law or agreed to in writing, software
+%     distributed under the License is distributed on an "AS IS" BASIS,
+%     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+%     See the License for the specific language governing permissions and
+%     limitations under the License.
+
+Plotting functions for the situation space matrix and the corpus (heatmaps and line plots through time).
+plotly is only imported when a figure is actually built, so that importing this module (or input_output.dataset) stays cheap.
+'''
+
+import numpy as np
+
+from input_output.dataset import get_condps_through_time
+
+
+def get_web_heatmap_figure(data,x_labels,y_labels,graph_title,x_title="X",y_title="Y"):
+    import plotly.graph_objects as go
+
+    fig = go.Figure(data=go.Heatmap(
+                       z=data,
+                       x=x_labels,
+                       y=y_labels,
+                       colorscale="hot",
+                       hoverongaps = False))
+    
+    fig.update_layout(
+        title=graph_title,
+        xaxis_title=x_title,
+        yaxis_title=y_title)
+    return fig
+
+
+def get_web_heatmap(data,x_labels,y_labels,graph_title,x_title="X",y_title="Y",filename=""):
+    fig=get_web_heatmap_figure(data, x_labels, y_labels, graph_title, x_title, y_title)
+    
+    if filename: fig.write_html(filename)
+    else:fig.show()
+
+
+def get_all_basic_props_heatmaps_through_time(matrix,basic_props,side_size=7):
+    for i in range(matrix.shape[1]):
+        ref_prop=matrix[:,i]
+        prop_flatname=basic_props[i].replace("(","_").replace(")","").replace(",","_")
+        graph_filename="../outputs/websites/"+prop_flatname+".html"
+        
+        get_heatmap_through_time(ref_prop, matrix, basic_props[i], basic_props, graph_filename, side_size)
+                
+def get_heatmap_through_time(target_vector,matrix,graph_label,y_labels,filename,side_size=7,interest_indices=[]):
+    steps=list(range(-side_size,side_size+1,1))
+    step_labels=["t="+str(i) for i in steps]
+    
+    condps=get_condps_through_time(target_vector, matrix, side_size,interest_indices)
+        
+    graph_title="Conditional Probs P( Y | "+graph_label+" )"
+    get_web_heatmap(condps,  step_labels, y_labels, graph_title, "Time Steps","Basic Proposition Y",filename)
+    
+    line="* ["+graph_label+"](https://iesus.github.io/dynamic-dss-websites/across_time/"+filename+")"
+    print(line) #This prints out code that we can put in a github readme file
+
+def get_vector_visualizations_through_time(target_vector,matrix,label,y_labels,filename,side_size=7,interest_indices=[]):
+    steps=list(range(-side_size,side_size+1,1))
+    step_labels=["t="+str(i) for i in steps]
+    label=label.split("---")
+    
+    condps=get_condps_through_time(target_vector, matrix, side_size, interest_indices)
+    graph_title="P( Y | "+label[0]+" )  "+label[1]
+    
+    colors=[tuple(np.random.choice(range(256), size=3)) for i in range(len(y_labels))]
+    colors=['rgb'+str(col) for col in colors]
+
+    x_data = np.vstack((np.asarray(steps),)*condps.shape[0])
+    y_data = condps
+    
+    import plotly.graph_objects as go
+    fig = go.Figure()
+    
+    for i in range(condps.shape[0]):
+        fig.add_trace(go.Scatter(x=x_data[i], y=y_data[i], mode='lines',
+            name=y_labels[i],
+            line=dict(color=colors[i]),# width=line_size[i]),
+            connectgaps=True,
+        ))
+    
+    fig.update_layout(
+        xaxis=dict(
+            showline=False,
+            showgrid=True,
+            showticklabels=True,
+            linecolor='rgb(204, 204, 204)',
+            linewidth=2,
+            ticks='outside',
+            tickfont=dict(
+                family='Arial',
+                size=12,
+                color='rgb(82, 82, 82)',
+            ),
+        ),
+        yaxis=dict(
+            showgrid=True,
+            zeroline=True,
+            showline=True,
+            showticklabels=False,
+        ),
+        autosize=True,
+        margin=dict(
+            autoexpand=True,
+            l=100,
+            r=20,
+            t=110,
+        ),
+        showlegend=True,
+        plot_bgcolor='white'
+    )
+    
+    annotations = []
+    # Adding labels
+    for y_trace, y_label in zip(y_data, y_labels):
+        annotations.append(dict(xref='paper', x=0.05, y=y_trace[0],
+                                      xanchor='right', yanchor='middle',
+                                      text=y_label + ' {:.2f}'.format(y_trace[0]),
+                                      font=dict(family='Arial',
+                                                size=16),
+                                      showarrow=False))
+    # Title
+    annotations.append(dict(xref='paper', yref='paper', x=0.0, y=1.05,
+                                  xanchor='left', yanchor='bottom',
+                                  text=graph_title,
+                                  font=dict(family='Arial',
+                                            size=30,
+                                            color='rgb(37,37,37)'),
+                                  showarrow=False))
+    
+    fig.update_layout(annotations=annotations)
+    fig.update_xaxes(title_text='Time Steps',
+                     ticktext=step_labels,
+                     tickvals=steps
+                    )
+    
+    
+    line="* [Line plots, only selected basic propositions](https://iesus.github.io/dynamic-dss-websites/across_time/"+filename+")"
+    print(line) #This prints out code that we can put in a github readme file
+
+    if filename: fig.write_html(filename)
+    else:fig.show()
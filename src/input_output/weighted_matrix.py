@@ -0,0 +1,144 @@
+'''
+%        Copyright 2022 Jesús Calvillo <jescalvillot@gmail.com>
+%
+%      Licensed under the Apache License, Version 2.0 (the "License");
+%      you may not use this file except in compliance with the License.
+%      You may obtain a copy of the License at
+%
+%           http://www.apache.org/licenses/LICENSE-2.0
+%
+%     Unless required by applicable law or agreed to in writing, software
+%     distributed under the License is distributed on an "AS IS" BASIS,
+%     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+%     See the License for the specific language governing permissions and
+%     limitations under the License.
+
+Deduplicated situation space matrix.
+
+The same observation (row) appears many times in the matrices sampled from the microworld. Whenever the order of the
+observations does not matter, the matrix is equivalent to its distinct rows, each one weighted by the number of times it occurs:
+    unique_rows[u]   distinct row u
+    counts[u]        number of observations equal to unique_rows[u]
+    inverse[t]       distinct row of observation t, so that matrix==unique_rows[inverse]
+
+Priors, joint and conditional probabilities and belief vectors computed here are exactly the ones of dataset.py over the
+full matrix, with the work proportional to the number of distinct rows. Vectors in "unique space" have one value per
+distinct row (e.g. the column of a basic proposition is unique_rows[:,i]); vectors over the observations, like the
+semantic vectors of sentences, are reduced to one weight per distinct row with reduce_vector().
+Functions that move in time (slide_time, get_condps_through_time) need the full matrix, which can be obtained with expand().
+'''
+
+import numpy as np
+
+
+def get_unique_rows(matrix):
+    '''
+    Returns the distinct rows of a binary matrix, the number of times each occurs and, for each original row, its distinct row id.
+    Rows are compared by their packed bits.
+    '''
+    matrix=np.asarray(matrix)!=0
+    packed=np.ascontiguousarray(np.packbits(matrix,axis=1))
+    as_void=packed.view(np.dtype((np.void,packed.shape[1]))).ravel()
+    _,first_index,inverse,counts=np.unique(as_void,return_index=True,return_inverse=True,return_counts=True)
+    return matrix[first_index].astype(np.uint8),counts,inverse.ravel()
+
+
+class Weighted_Situation_Matrix:
+    def __init__(self,matrix,basic_props):
+        '''
+        matrix: observations x basic propositions, as returned by load_prolog_situation_space_matrix
+        '''
+        self.basic_props=list(basic_props)
+        self.prop_index={prop:i for i,prop in enumerate(self.basic_props)}
+        self.unique_rows,self.counts,self.inverse=get_unique_rows(matrix)
+        self.n_observations=int(self.counts.sum())
+
+    @classmethod
+    def from_observations_file(cls,filename):
+        from input_output.dataset import load_prolog_situation_space_matrix
+        matrix,basic_props=load_prolog_situation_space_matrix(filename)
+        return cls(matrix,basic_props)
+
+    def expand(self,unique_vector=None):
+        '''
+        Back to the observations: the full matrix, or a vector in unique space repeated as in the original order
+        '''
+        if unique_vector is None:return self.unique_rows[self.inverse]
+        return np.asarray(unique_vector)[self.inverse]
+
+    def reduce_vector(self,vector):
+        '''
+        Vector over the observations -> total weight of each distinct row
+        '''
+        return np.bincount(self.inverse,weights=vector,minlength=len(self.counts))
+
+    def column(self,prop):
+        '''
+        Vector of a basic proposition in unique space, given by name or by index
+        '''
+        if isinstance(prop,str):prop=self.prop_index[prop]
+        return self.unique_rows[:,prop]
+
+    def count(self,unique_vector):
+        return np.dot(self.counts,unique_vector)
+
+    def prior(self,unique_vector):
+        return self.count(unique_vector)/self.n_observations
+
+    def jointp(self,unique_vector_A,unique_vector_B):
+        '''
+        Same as dss_jointp over the full vectors
+        '''
+        return self.count(unique_vector_A*unique_vector_B)/self.n_observations
+
+    def condp(self,unique_vector_A,given_unique_vector_B):
+        '''
+        Same as dss_condp over the full vectors
+        '''
+        prior_B=self.count(given_unique_vector_B)
+        if prior_B==0:return 0
+        return self.count(unique_vector_A*given_unique_vector_B)/prior_B
+
+    def get_prior_probs(self):
+        return np.dot(self.counts,self.unique_rows)/self.n_observations
+
+    def print_prior_probs(self):
+        for i,prior in enumerate(self.get_prior_probs()):
+            print(i,self.basic_props[i],prior)
+
+    def get_conditional_joint_probs(self):
+        '''
+        Same output as get_conditional_joint_probs in dataset.py: jointps[i,j]=P(i,j) and condps[i,j]=P(j|i)
+        '''
+        rows=self.unique_rows.astype(np.int64)
+        intersections=np.dot((rows*self.counts[:,None]).T,rows)
+        priors=np.diagonal(intersections)
+        jointps=intersections/self.n_observations
+        condps=np.zeros(intersections.shape,dtype=float)
+        nonzero=priors>0
+        condps[nonzero]=intersections[nonzero]/priors[nonzero,None]
+        return jointps,condps
+
+    def get_belief_vector(self,vector,normalize=True):
+        '''
+        Same as np.dot(vector,matrix)/np.sum(vector) in load_prolog_corpus_belief, where vector is over the observations.
+        If the vector is all zeros (or normalize is False), the vector is not divided.
+        '''
+        weights=self.reduce_vector(vector)
+        belief_vector=np.dot(weights,self.unique_rows)
+        total=weights.sum()
+        if normalize and total:belief_vector=belief_vector/total
+        return belief_vector
+
+    def get_belief_vectors(self,vectors):
+        '''
+        Belief vectors of several vectors at once (one per row), all-zero vectors get all-zero beliefs
+        '''
+        vectors=np.asarray(vectors)
+        weights=np.zeros((vectors.shape[0],len(self.counts)),dtype=float)
+        np.add.at(weights.T,self.inverse,vectors.T)
+        beliefs=np.dot(weights,self.unique_rows)
+        totals=weights.sum(axis=1)
+        nonzero=totals>0
+        beliefs[nonzero]/=totals[nonzero,None]
+        return beliefs
@@ -0,0 +1,306 @@
+'''
+%        Copyright 2022 Jesús Calvillo <jescalvillot@gmail.com>
+%
+%      Licensed under the Apache License, Version 2.0 (the "License");
+%      you may not use this file except in compliance with the License.
+%      You may obtain a copy of the License at
+%
+%           http://www.apache.org/licenses/LICENSE-2.0
+%
+%     Unless required by applicable law or agreed to in writing, software
+%     distributed under the License is distributed on an "AS IS" BASIS,
+%     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+%     See the License for the specific language governing permissions and
+%     limitations under the License.
+
+Runs the whole workflow with one command, from any directory:
+
+    python src/pipeline.py --seed 10 --steps 30000 --jobs 3
+
+Stages (and the stages they need):
+    simulate     runs the Street Life microworld                   -> observations.npy, basic_props.txt
+    export       writes the file read by prolog (simulate)          -> world.observations (+ compressed traces with --traces)
+    corpus       swipl with gen_set_short (export)                  -> corpus.<set>.set
+    belief       load_prolog_corpus_belief (export, corpus)         -> corpus.pickle, corpus_store/
+    statistics   priors, joint and conditional probabilities (simulate) -> statistics.npz
+    surprisal    write_surprisals (export)                          -> state_surprisal.npy, entropies.json, ...
+
+Each artifact is stored in <cache-dir>/<stage>/<key>/, where the key is a hash of everything the stage depends on: its
+parameters (seed, steps, sentence set...), the source files of the code and grammar it uses, and the keys of the stages
+it needs. A stage whose artifact already exists is skipped, so changing e.g. the grammar only reruns corpus and belief.
+Stages whose inputs are ready run concurrently in separate processes (--jobs). The output of each stage goes to its log.txt.
+'''
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import subprocess
+import contextlib
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+SRC_DIR=os.path.dirname(os.path.abspath(__file__))
+SIMULATION_DIR=os.path.join(SRC_DIR,"simulation")
+INPUT_OUTPUT_DIR=os.path.join(SRC_DIR,"input_output")
+DSS_DIR=os.path.join(SRC_DIR,"dss")
+DEFAULT_CACHE_DIR=os.path.join(SRC_DIR,"outputs","pipeline_cache")
+DEFAULT_GRAMMAR=os.path.join(DSS_DIR,"worlds","street_life.pl")
+
+for path in [SRC_DIR,SIMULATION_DIR]:
+    if path not in sys.path:sys.path.insert(0,path)
+
+
+#############################################################################################################
+#### STAGES
+#############################################################################################################
+def simulate_stage(params,inputs,output_dir):
+    import random
+    import numpy as np
+    from street_life_world import build_street_life_world
+    from online_statistics import Accumulator, proposition_label
+
+    class Matrix_Recorder(Accumulator):
+        def __init__(self,propositions,n_observations):
+            super().__init__(propositions)
+            self.matrix=np.zeros((n_observations,len(self.propositions)),dtype=np.uint8)
+
+        def add_vector(self,vector):
+            self.matrix[self.n_observations]=vector
+            self.n_observations+=1
+
+        def get_results(self):
+            return self.matrix[:self.n_observations]
+
+    random.seed(params["seed"])
+    world=build_street_life_world()
+    recorder=Matrix_Recorder(world.propositions,params["steps"])
+    world.run(params["steps"],random,accumulators=[recorder],keep_models=False,verbose=False)
+    np.save(os.path.join(output_dir,"observations.npy"),recorder.get_results())
+    with open(os.path.join(output_dir,"basic_props.txt"),'w') as props_file:
+        props_file.write("\n".join(proposition_label(prop) for prop in world.propositions)+"\n")
+
+
+def load_simulation(simulation_dir):
+    import numpy as np
+    from input_output.proposition_index import parse_proposition_label
+    matrix=np.load(os.path.join(simulation_dir,"observations.npy"),mmap_mode="r")
+    with open(os.path.join(simulation_dir,"basic_props.txt"),'r') as props_file:
+        basic_props=props_file.read().split()
+    return matrix,basic_props,[parse_proposition_label(label) for label in basic_props]
+
+
+def export_stage(params,inputs,output_dir):
+    from exporter import Observation_Exporter
+    matrix,_,propositions=load_simulation(inputs["simulate"])
+    traces=params["traces"]
+    with Observation_Exporter(propositions,os.path.join(output_dir,"world.observations"),
+                              verbose_path=os.path.join(output_dir,"formal_models.txt.gz") if traces else None,
+                              only_true_path=os.path.join(output_dir,"formal_models_onlytrue.txt.gz") if traces else None) as exporter:
+        exporter.add_matrix(matrix)
+
+
+def corpus_stage(params,inputs,output_dir):
+    swipl=shutil.which("swipl")
+    if swipl is None:raise RuntimeError("swipl is needed to build the corpus (https://www.swi-prolog.org)")
+    observations=os.path.join(inputs["export"],"world.observations")
+    file_base=os.path.join(output_dir,"corpus")
+    goal="dss_read_vectors('%s',SM),gen_set_short('%s',SM,'%s')"%(observations,params["sentence_set"],file_base)
+    subprocess.run([swipl,"-l",params["grammar"],"-g",goal,"-g","halt"],cwd=output_dir,check=True,stdout=sys.stdout,stderr=subprocess.STDOUT)
+
+
+def belief_stage(params,inputs,output_dir):
+    from input_output.dataset import load_prolog_corpus_belief
+    load_prolog_corpus_belief(os.path.join(inputs["corpus"],"corpus."+params["sentence_set"]+".set"),
+                              os.path.join(inputs["export"],"world.observations"),
+                              os.path.join(output_dir,"corpus.pickle"),store_path=os.path.join(output_dir,"corpus_store"))
+
+
+def statistics_stage(params,inputs,output_dir):
+    import numpy as np
+    from input_output.dataset import get_conditional_joint_probs
+    matrix,basic_props,_=load_simulation(inputs["simulate"])
+    matrix=np.asarray(matrix,dtype=np.int64)
+    jointps,condps=get_conditional_joint_probs(matrix)
+    np.savez(os.path.join(output_dir,"statistics.npz"),priors=np.diagonal(jointps),jointps=jointps,condps=condps,basic_props=np.array(basic_props))
+
+
+def surprisal_stage(params,inputs,output_dir):
+    from input_output.surprisal import write_surprisals
+    write_surprisals(os.path.join(inputs["export"],"world.observations"),output_dir,order=params["order"])
+
+
+def get_simulation_sources():
+    return [os.path.join(SIMULATION_DIR,name) for name in sorted(os.listdir(SIMULATION_DIR)) if name.endswith(".py")]
+
+#name: (stages it needs, function, parameters in its key, source files in its key)
+STAGES={
+    "simulate":  ([],                  simulate_stage,   ["seed","steps","hash_seed"], get_simulation_sources),
+    "export":    (["simulate"],        export_stage,     ["traces"],                   lambda:[os.path.join(SIMULATION_DIR,"exporter.py")]),
+    "corpus":    (["export"],          corpus_stage,     ["sentence_set","grammar"],   lambda:[DEFAULT_GRAMMAR,os.path.join(DSS_DIR,"src")]),
+    "belief":    (["export","corpus"], belief_stage,     ["sentence_set"],             lambda:[os.path.join(INPUT_OUTPUT_DIR,name) for name in ["dataset.py","weighted_matrix.py","corpus_store.py"]]),
+    "statistics":(["simulate"],        statistics_stage, [],                           lambda:[os.path.join(INPUT_OUTPUT_DIR,"dataset.py")]),
+    "surprisal": (["export"],          surprisal_stage,  ["order"],                    lambda:[os.path.join(INPUT_OUTPUT_DIR,"surprisal.py")]),
+}
+
+
+#############################################################################################################
+#### CACHE AND SCHEDULING
+#############################################################################################################
+def hash_path(path,digest):
+    '''
+    Adds the content of a file, or of all the files in a directory (in a fixed order), to the digest
+    '''
+    if os.path.isdir(path):
+        for root,dirs,files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith((".pyc",".swp")):continue
+                file_path=os.path.join(root,name)
+                digest.update(os.path.relpath(file_path,path).encode("utf-8"))
+                hash_path(file_path,digest)
+    else:
+        with open(path,'rb') as source_file:
+            for chunk in iter(lambda:source_file.read(1<<20),b""):digest.update(chunk)
+
+
+def get_stage_keys(params,stages=STAGES):
+    '''
+    Key of each stage: hash of its parameters, its source files and the keys of the stages it needs
+    '''
+    keys={}
+    def get_key(name):
+        if name in keys:return keys[name]
+        dependencies,_,param_names,get_sources=stages[name]
+        digest=hashlib.sha256()
+        stage_params={param:params[param] for param in param_names}
+        if "grammar" in stage_params:stage_params["grammar"]=None #the content of the grammar is hashed, not its path
+        digest.update(json.dumps({"stage":name,"params":stage_params,"needs":{dep:get_key(dep) for dep in dependencies}},sort_keys=True).encode("utf-8"))
+        sources=get_sources()
+        if "grammar" in param_names:sources=[params["grammar"]]+sources[1:]
+        for source in sources:
+            digest.update(os.path.basename(source).encode("utf-8"))
+            hash_path(source,digest)
+        keys[name]=digest.hexdigest()[:16]
+        return keys[name]
+    for name in stages:get_key(name)
+    return keys
+
+
+def get_required_stages(targets,stages=STAGES):
+    '''
+    The targets and all the stages they need, in dependency order
+    '''
+    ordered=[]
+    def visit(name):
+        if name in ordered:return
+        for dependency in stages[name][0]:visit(dependency)
+        ordered.append(name)
+    for target in targets:visit(target)
+    return ordered
+
+
+@contextlib.contextmanager
+def environment_variable(name,value):
+    '''
+    Sets an environment variable while the block runs (e.g. for the processes started in it), then restores it
+    '''
+    previous=os.environ.get(name)
+    os.environ[name]=value
+    try:yield
+    finally:
+        if previous is None:os.environ.pop(name,None)
+        else:os.environ[name]=previous
+
+
+def run_stage(name,params,inputs,artifact_dir):
+    '''
+    Runs a stage in a temporary directory, which becomes the artifact only when the stage finishes without errors
+    '''
+    temporary_dir=artifact_dir+".tmp"
+    if os.path.exists(temporary_dir):shutil.rmtree(temporary_dir)
+    os.makedirs(temporary_dir)
+    with open(os.path.join(temporary_dir,"log.txt"),'w') as log_file, contextlib.redirect_stdout(log_file):
+        STAGES[name][1](params,inputs,temporary_dir)
+    with open(os.path.join(temporary_dir,"manifest.json"),'w') as manifest_file:
+        json.dump({"stage":name,"params":{param:params[param] for param in STAGES[name][2]},"inputs":inputs},manifest_file,indent=1)
+    if os.path.exists(artifact_dir):shutil.rmtree(artifact_dir)
+    os.rename(temporary_dir,artifact_dir)
+    return artifact_dir
+
+
+def run_pipeline(params,targets,cache_dir=DEFAULT_CACHE_DIR,jobs=2,force=(),dry_run=False):
+    '''
+    Runs the stages needed for the targets, skipping those whose artifact is cached.
+    Returns {stage: artifact directory} of the stages that are available, and {stage: error} of those that failed
+    (the stages that need a failed stage are not run).
+    '''
+    keys=get_stage_keys(params)
+    required=get_required_stages(targets)
+    artifact_dirs={name:os.path.join(cache_dir,name,keys[name]) for name in required}
+    done={name:artifact_dirs[name] for name in required if name not in force and os.path.exists(os.path.join(artifact_dirs[name],"manifest.json"))}
+    for name in required:print(("cached " if name in done else "to run ")+name.ljust(11)+artifact_dirs[name])
+    if dry_run:return done,{}
+
+    failed={}
+    pending=[name for name in required if name not in done]
+    #New processes (instead of forks) so that PYTHONHASHSEED applies: the order of the propositions depends on it.
+    #It is only set while the pool exists (workers can be started at any submit), the caller's environment is not changed
+    with environment_variable("PYTHONHASHSEED",str(params["hash_seed"])), \
+         ProcessPoolExecutor(max_workers=jobs,mp_context=multiprocessing.get_context("spawn")) as executor:
+        running={}
+        while pending or running:
+            for name in list(pending):
+                dependencies=STAGES[name][0]
+                if any(dep in failed for dep in dependencies):
+                    pending.remove(name)
+                    failed[name]="needs a stage that failed"
+                    print("skipped",name.ljust(11)+failed[name])
+                elif all(dep in done for dep in dependencies):
+                    pending.remove(name)
+                    inputs={dep:done[dep] for dep in dependencies}
+                    running[executor.submit(run_stage,name,params,inputs,artifact_dirs[name])]=name
+                    print("started",name)
+            if not running:break
+            finished,_=wait(running,return_when=FIRST_COMPLETED)
+            for future in finished:
+                name=running.pop(future)
+                try:
+                    done[name]=future.result()
+                    print("done   ",name.ljust(11)+done[name])
+                except Exception as error:
+                    failed[name]=error
+                    print("FAILED ",name.ljust(11)+str(error)+" (see "+os.path.join(artifact_dirs[name]+".tmp","log.txt")+")")
+    return done,failed
+
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description="Runs the simulation, export, corpus and analysis stages, reusing cached artifacts")
+    parser.add_argument("targets",nargs="*",default=["belief","statistics","surprisal"],help="stages to obtain: "+", ".join(STAGES))
+    parser.add_argument("--seed",type=int,default=10)
+    parser.add_argument("--steps",type=int,default=30000)
+    parser.add_argument("--hash-seed",type=int,default=0,help="PYTHONHASHSEED of the stages, it fixes the order of the propositions")
+    parser.add_argument("--traces",action="store_true",help="also export the compressed verbose traces")
+    parser.add_argument("--sentence-set",default="simple")
+    parser.add_argument("--grammar",default=DEFAULT_GRAMMAR)
+    parser.add_argument("--order",type=int,default=1,help="order of the contexts for the surprisal")
+    parser.add_argument("--cache-dir",default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--jobs",type=int,default=2)
+    parser.add_argument("--force",nargs="*",default=[],help="stages to run again even if cached")
+    parser.add_argument("--dry-run",action="store_true",help="only show which stages would run")
+    parser.add_argument("--skip-import-check",action="store_true",help="do not check first that the core modules import within their time budget")
+    args=parser.parse_args()
+
+    for stage in args.targets+args.force:
+        if stage not in STAGES:parser.error("unknown stage "+stage)
+    params={"seed":args.seed,"steps":args.steps,"hash_seed":args.hash_seed,"traces":args.traces,"sentence_set":args.sentence_set,
+            "grammar":os.path.abspath(args.grammar),"order":args.order}
+    if not args.skip_import_check:
+        from input_output.check_import_time import assert_import_time
+        try:assert_import_time()
+        except AssertionError as error:sys.exit("Import time check failed: "+str(error))
+    done,failed=run_pipeline(params,args.targets,os.path.abspath(args.cache_dir),args.jobs,args.force,args.dry_run)
+    if failed:sys.exit(1)
@@ -0,0 +1,291 @@
+'''
+%        Copyright 2022 Jesús Calvillo <jescalvillot@gmail.com>
+%
+%      Licensed under the Apache License, Version 2.0 (the "License");
+%      you may not use this file except in compliance with the License.
+%      You may obtain a copy of the License at
+%
+%           http://www.apache.org/licenses/LICENSE-2.0
+%
+%     Unless required by applicable law or agreed to in writing, software
+%     distributed under the License is distributed on an "AS IS" BASIS,
+%     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+%     See the License for the specific language governing permissions and
+%     limitations under the License.
+
+Binary log of what happens in a run: the eventualities (type, roles, start, duration, the eventuality that triggered
+them, when they end or are interrupted) and the observations, stored as the propositions that change from one step
+to the next plus a full keyframe every keyframe_interval steps. Any window of the situation space matrix can be
+reconstructed exactly from it. It is not meant to save space: for 5000 steps of street life it takes 0.97MB against the
+1.7MB of the .observations file (including the eventualities), but gzip compresses the text better (0.08MB against 0.3MB).
+
+    with Event_Log_Writer(world,"../outputs/street_life30K.events") as event_log:
+        world.run(30000,random,keep_models=False,verbose=False,event_log=event_log)
+
+    log=Event_Log_Reader("../outputs/street_life30K.events")
+    log.get_eventualities(agent="john",start=100,end=200)    #eventualities of john that overlap steps 100..199
+    matrix=log.get_matrix(1000,2000)                          #rows 1000..1999 of the situation space matrix
+
+The file is a header (magic string, then the length and the JSON with the propositions, eventuality types and role
+fillers) followed by records of little-endian integers, each beginning with its kind:
+    START      kind time type agent second duration parent         (second and parent are -1 if there is none)
+    END        kind time id
+    INTERRUPT  kind time id
+    DELTA      kind time n column_1 ... column_n                   (columns that changed w.r.t. the previous step)
+    KEYFRAME   kind time n column_1 ... column_n                   (columns that are true)
+The id of an eventuality is the number of START records before its own. The records of the eventualities of a step
+come before the DELTA/KEYFRAME of its observation.
+Files ending in .gz are compressed with gzip.
+'''
+
+import gzip
+import json
+import struct
+import bisect
+import numpy as np
+
+from online_statistics import Accumulator
+
+MAGIC=b"DDSSEVL1"
+START,END,INTERRUPT,DELTA,KEYFRAME=range(5)
+
+START_RECORD=struct.Struct("<BIHHhIi")  #kind time type agent second duration parent
+EVENT_RECORD=struct.Struct("<BII")      #kind time id
+STEP_RECORD=struct.Struct("<BII")       #kind time n, followed by n columns
+
+
+def open_binary(path,mode):
+    if path.endswith(".gz"):return gzip.open(path,mode)
+    return open(path,mode)
+
+
+class Event_Log_Writer(Accumulator):
+    '''
+    Records the eventualities of a world while it runs (the world calls log_start, log_end and log_interrupt when it is
+    given this writer as event_log) and, as an accumulator, its observations. The events are recorded at the time step
+    that is being generated.
+    The START records of the eventualities that begin in a step are only written with the observation of the step, so that
+    those that are cancelled in the same step (e.g. an arrive triggered by a walk_to of someone who falls) and never run
+    as agenda items are not recorded at all.
+    Records are packed into a buffer that is written to the file when it is larger than buffer_size bytes.
+    '''
+    def __init__(self,world,path,keyframe_interval=1024,buffer_size=1<<20):
+        super().__init__(world.propositions)
+        self.world=world
+        self.path=path
+        self.keyframe_interval=keyframe_interval
+        self.buffer_size=buffer_size
+        self.column_format="<%dH" if len(self.propositions)<(1<<16) else "<%dI"
+
+        self.type_names=list(world.eventuality_types.keys())
+        self.type_index={name:i for i,name in enumerate(self.type_names)}
+        #agents and second arguments (patients or destinations) are given by their index in entities
+        self.entities=list(world.participants.keys())+list(world.things.keys())+list(world.location_map.locations.keys())
+        self.entities=list(dict.fromkeys(self.entities))
+        self.entity_index={name:i for i,name in enumerate(self.entities)}
+
+        self.next_id=0
+        self.pending={}  #id(eventuality) -> (eventuality, parent) of the eventualities that began in the current step
+        self.previous_vector=None
+        self.buffer=bytearray()
+        self.file=open_binary(path,'wb')
+        header=json.dumps({"propositions":self.labels,"types":self.type_names,"entities":self.entities,
+                           "column_format":self.column_format,"keyframe_interval":keyframe_interval}).encode("utf-8")
+        self.file.write(MAGIC+struct.pack("<I",len(header))+header)
+
+    def get_time(self):
+        if self.world.current_formal_model is None:return 0
+        return self.world.current_formal_model.time+1
+
+    def log_start(self,eventuality,parent=None):
+        '''
+        Records the beginning of an eventuality when the observation of the step is written (see write_starts);
+        parent is the eventuality that triggered it
+        '''
+        self.pending[id(eventuality)]=(eventuality,parent)
+
+    def write_starts(self):
+        '''
+        Gives the eventualities that began in the step an id (eventuality.log_id) and writes their START records
+        '''
+        for (eventuality,parent) in self.pending.values():
+            eventuality.log_id=self.next_id
+            self.next_id+=1
+            second=eventuality.roles.get("patient",eventuality.roles.get("destination"))
+            self.buffer+=START_RECORD.pack(START,eventuality.initial_time,self.type_index[eventuality.type.name],
+                                           self.entity_index[eventuality.roles["agent"].name],
+                                           self.entity_index[second.name] if second is not None else -1,eventuality.duration,
+                                           getattr(parent,"log_id",-1) if parent is not None else -1)
+        self.pending={}
+
+    def log_end(self,eventuality):
+        if hasattr(eventuality,"log_id"):self.buffer+=EVENT_RECORD.pack(END,self.get_time(),eventuality.log_id)
+
+    def log_interrupt(self,eventuality):
+        '''
+        Records the interruption of an eventuality; if it began in the same step it is cancelled and not recorded at all
+        '''
+        if self.pending.pop(id(eventuality),None) is not None:return
+        if hasattr(eventuality,"log_id"):self.buffer+=EVENT_RECORD.pack(INTERRUPT,self.get_time(),eventuality.log_id)
+
+    def update(self,formal_model):
+        self.add_vector(self.get_vector(formal_model),formal_model.time)
+
+    def add_vector(self,vector,time=None):
+        if time is None:time=self.n_observations
+        self.write_starts()
+        vector=np.asarray(vector).astype(bool)
+        if self.previous_vector is None or self.n_observations%self.keyframe_interval==0:
+            (kind,columns)=(KEYFRAME,np.flatnonzero(vector))
+        else:(kind,columns)=(DELTA,np.flatnonzero(vector!=self.previous_vector))
+        self.buffer+=STEP_RECORD.pack(kind,time,len(columns))
+        self.buffer+=struct.pack(self.column_format%len(columns),*columns.tolist())
+        self.previous_vector=vector
+        self.n_observations+=1
+        if len(self.buffer)>=self.buffer_size:self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer)
+        self.buffer=bytearray()
+
+    def close(self):
+        if self.file is None:return
+        self.flush()
+        self.file.close()
+        self.file=None
+
+    def get_results(self):
+        return self.n_observations
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+        return False
+
+
+#Eventualities as returned by Event_Log_Reader (end and interrupted are -1 if it did not happen within the log)
+EVENTUALITY_DTYPE=np.dtype([("id",np.int64),("type",np.int32),("agent",np.int32),("second",np.int32),("start",np.int64),
+                            ("duration",np.int64),("parent",np.int64),("end",np.int64),("interrupted",np.int64)])
+
+
+def read_exactly(log_file,size):
+    data=log_file.read(size)
+    if len(data)<size:raise ValueError("Truncated event log "+str(log_file.name))
+    return data
+
+
+def read_header(log_file):
+    '''
+    Reads the header of an event log from the beginning of log_file, and returns it as a dictionary
+    '''
+    if log_file.read(len(MAGIC))!=MAGIC:raise ValueError(str(log_file.name)+" is not an event log")
+    header_length=struct.unpack("<I",read_exactly(log_file,4))[0]
+    return json.loads(read_exactly(log_file,header_length).decode("utf-8"))
+
+
+def iterate_records(log_file,column_format):
+    '''
+    Reads the records that follow the header one at a time, without loading the file into memory. Yields (kind, time, fields),
+    where fields are (type, agent, second, duration, parent) for START, the id for END/INTERRUPT and the columns for DELTA/KEYFRAME
+    '''
+    column_dtype=np.dtype(column_format.replace("%d",""))
+    while True:
+        kind_byte=log_file.read(1)
+        if not kind_byte:return
+        kind=kind_byte[0]
+        if kind==START:
+            record=START_RECORD.unpack(kind_byte+read_exactly(log_file,START_RECORD.size-1))
+            yield kind,record[1],record[2:]
+        elif kind in (END,INTERRUPT):
+            (_,time,log_id)=EVENT_RECORD.unpack(kind_byte+read_exactly(log_file,EVENT_RECORD.size-1))
+            yield kind,time,log_id
+        elif kind in (DELTA,KEYFRAME):
+            (_,time,n)=STEP_RECORD.unpack(kind_byte+read_exactly(log_file,STEP_RECORD.size-1))
+            yield kind,time,np.frombuffer(read_exactly(log_file,n*column_dtype.itemsize),dtype=column_dtype)
+        else:raise ValueError("Unknown record kind %d at byte %d of %s"%(kind,log_file.tell()-1,log_file.name))
+
+
+class Event_Log_Reader:
+    '''
+    Reads a whole event log, record by record, and indexes it: the eventualities by agent and start time, and the steps by
+    time with the positions of the keyframes, so that windows of the matrix only replay the deltas since the closest keyframe.
+    Only the decoded records are kept in memory (the columns in the integer type of the file), not the file itself.
+    '''
+    def __init__(self,path):
+        starts,ends,interruptions=[],{},{}
+        self.times=[]      #time of each step
+        self.steps=[]      #(kind, columns) of each step
+        self.keyframes=[]  #indices of the steps that are keyframes
+        with open_binary(path,'rb') as log_file:
+            header=read_header(log_file)
+            self.basic_props=header["propositions"]
+            self.types=header["types"]
+            self.entities=header["entities"]
+            for (kind,time,fields) in iterate_records(log_file,header["column_format"]):
+                if kind==START:starts.append((time,)+fields)
+                elif kind in (END,INTERRUPT):(ends if kind==END else interruptions).setdefault(fields,time)
+                else:
+                    if kind==KEYFRAME:self.keyframes.append(len(self.steps))
+                    self.times.append(time)
+                    self.steps.append((kind,fields))
+
+        self.eventualities=np.zeros(len(starts),dtype=EVENTUALITY_DTYPE)
+        for log_id,(time,type_index,agent,second,duration,parent) in enumerate(starts):
+            self.eventualities[log_id]=(log_id,type_index,agent,second,time,duration,parent,ends.get(log_id,-1),interruptions.get(log_id,-1))
+        self.eventualities.sort(order=["start","id"])
+        self.id_index={log_id:i for i,log_id in enumerate(self.eventualities["id"])}
+        self.agent_index={self.entities[agent]:np.flatnonzero(self.eventualities["agent"]==agent) for agent in np.unique(self.eventualities["agent"])}
+
+    def __len__(self):
+        return len(self.steps)
+
+    def get_eventualities(self,agent=None,event_type=None,start=None,end=None):
+        '''
+        Eventualities (records of EVENTUALITY_DTYPE) of an agent and/or type that overlap the steps start..end-1
+        (an eventuality that has not ended is considered to last until its end or interruption, or the end of the log)
+        '''
+        if agent is None:selected=self.eventualities
+        else:selected=self.eventualities[self.agent_index.get(agent,np.zeros(0,dtype=np.int64))]
+        if event_type is not None:selected=selected[selected["type"]==self.types.index(event_type)]
+        if end is not None:selected=selected[selected["start"]<end]
+        if start is not None:
+            last=np.where(selected["end"]>=0,selected["end"],np.iinfo(np.int64).max)
+            last=np.minimum(last,np.where(selected["interrupted"]>=0,selected["interrupted"],np.iinfo(np.int64).max))
+            selected=selected[last>=start]
+        return selected
+
+    def get_triggered(self,log_id):
+        '''
+        Eventualities triggered by (the effects of) the eventuality with the given id
+        '''
+        return self.eventualities[self.eventualities["parent"]==log_id]
+
+    def describe(self,eventuality):
+        '''
+        Readable description of one eventuality record, e.g. "walk_to(john,h_house) 12..20"
+        '''
+        arguments=[self.entities[eventuality["agent"]]]
+        if eventuality["second"]>=0:arguments.append(self.entities[eventuality["second"]])
+        description=self.types[eventuality["type"]]+"("+",".join(arguments)+") %d..%d"%(eventuality["start"],eventuality["start"]+eventuality["duration"])
+        if eventuality["interrupted"]>=0:description+=" interrupted at %d"%eventuality["interrupted"]
+        return description
+
+    def get_matrix(self,start=0,end=None):
+        '''
+        Rows start..end-1 of the situation space matrix (rows are steps of the log, in the order they were written)
+        '''
+        if end is None or end>len(self.steps):end=len(self.steps)
+        matrix=np.zeros((max(0,end-start),len(self.basic_props)),dtype=np.uint8)
+        if start>=end:return matrix
+        first=self.keyframes[bisect.bisect_right(self.keyframes,start)-1]
+        vector=np.zeros(len(self.basic_props),dtype=np.uint8)
+        for step in range(first,end):
+            (kind,columns)=self.steps[step]
+            if kind==KEYFRAME:
+                vector[:]=0
+                vector[columns]=1
+            else:vector[columns]^=1
+            if step>=start:matrix[step-start]=vector
+        return matrix
@@ -15,6 +15,21 @@
 '''
 
 import copy
+import math
+
+
+def boost_probability_distro(distro,boosted_values,factor):
+    '''
+    Copy of a (possibly conditional) probability distribution in which the probability of the boosted values is multiplied by factor
+    (and then everything is normalized again). Used to build proposal distributions for importance sampling, e.g.
+    boost_probability_distro(prob_distros["hit"],[1],3)
+    '''
+    if isinstance(list(distro.values())[0],dict):
+        return {key:boost_probability_distro(value_distro,boosted_values,factor) for key,value_distro in distro.items()}
+    boosted={value:prob*factor if value in boosted_values else prob for value,prob in distro.items()}
+    total=sum(boosted.values())
+    return {value:prob/total for value,prob in boosted.items()}
+
               
 class Eventuality_Type:
     '''
@@ -28,11 +43,17 @@ class Eventuality_Type:
         self.duration_variation=duration_var
         self.roles=copy.deepcopy(rols)
         self.probability_distro=None
+        self.proposal_distro=None #if given, values are drawn from it instead (importance sampling)
+        self.log_likelihood_ratio=0.0 #sum of log(p/q) of the values drawn from the proposal since the last reset
         self.dependencies=[]
         self.requirements=copy.deepcopy(reqs) #propositions that need to be true/false in the current or previous formal model
         self.consequences=copy.deepcopy(init_conseqs)#propositions that are entailed to be true/false in the current or the next formal model
         self.interrupts_patient=interrupts_patient #this is true if the ev_type interrupts the activities of other participants (e.g. hitting interrupts whomever gets hit)
         self.interrupts_agent=interrupts_agent #this means the predicate interrupts whoever makes it true, e.g. fall
+        self.moves_agent=False #the agent moves along the trajectory to the destination while it lasts, e.g. walk_to
+        self.arrival=None      #for the types that move the agent, the eventuality type triggered at each location reached, e.g. arrive
+        self.crossings=[]      #for the types that move the agent, (side, other side, eventuality type) triggered when the trajectory goes from one side to the other
+        self.templates={} #(agent, patient or destination, origin of movements) -> Eventuality_Template
   
         #Depending on the aspectual type, each eventuality_type has different phases
         if self.aspectual_type in ["accomplishment"]:
@@ -76,6 +97,39 @@ class Eventuality_Type:
                 ind+=2
         #If it's not a dictionary it means that the eventuality does not have probabilistic factors (although it could still have requirements)
         self.probability_distro=distro
+        
+    def add_proposal_distribution(self,distro):
+        '''
+        Distribution from which the values are drawn instead of the probability distribution, with the same structure.
+        For conditional distributions, the factor combinations that are missing keep using the probability distribution.
+        Every value that is possible under the probability distribution must also be possible under the proposal.
+        '''
+        if self.probability_distro is None:raise ValueError("Eventuality type "+self.name+" has no probability distribution")
+        conditional=isinstance(list(self.probability_distro.values())[0],dict)
+        pairs=[(self.probability_distro[key],distro[key]) for key in distro] if conditional else [(self.probability_distro,distro)]
+        for (prob_distro,proposal) in pairs:
+            for value,prob in prob_distro.items():
+                if prob>0 and proposal.get(value,0)<=0:
+                    raise ValueError("The proposal of "+self.name+" gives probability 0 to the possible value "+str(value))
+        self.proposal_distro=distro
+        
+    def pop_log_likelihood_ratio(self):
+        '''
+        Returns the log likelihood ratio accumulated since the last call, and resets it
+        '''
+        log_likelihood_ratio=self.log_likelihood_ratio
+        self.log_likelihood_ratio=0.0
+        return log_likelihood_ratio
+        
+    def draw_value(self,prob_distro,proposal_distro,random_generator):
+        '''
+        Draws a value from prob_distro or, if given, from proposal_distro keeping track of the likelihood ratio
+        '''
+        if proposal_distro is None:
+            return random_generator.choices(list(prob_distro.keys()),prob_distro.values())[0]
+        value=random_generator.choices(list(proposal_distro.keys()),proposal_distro.values())[0]
+        self.log_likelihood_ratio+=math.log(prob_distro[value]/sum(prob_distro.values()))-math.log(proposal_distro[value]/sum(proposal_distro.values()))
+        return value
 
     def get_agent_phase_propositions(self,phase_predicate,agent):
         '''
@@ -104,14 +158,48 @@ class Eventuality_Type:
             
         return propositions 
         
-    def get_probability_value(self,formal_models,agent_name,random_generator):
+    def get_template(self,roles,initial_location=None):
+        '''
+        The template of the eventualities of this type with the given role fillers (and, for movements, beginning at
+        initial_location). Templates are built the first time they are needed, or beforehand with compile_templates
+        '''
+        second=roles.get("patient",roles.get("destination"))
+        key=(roles["agent"].name,second.name if second is not None else None,initial_location if self.moves_agent else None)
+        template=self.templates.get(key)
+        if template is None:
+            template=Eventuality_Template(self,roles,initial_location)
+            self.templates[key]=template
+        return template
+    
+    def compile_templates(self,agents,microworld):
+        '''
+        Builds the templates of all the groundings of this type for the given agents
+        '''
+        for agent in agents:
+            if "patient" in self.roles:
+                patients=[microworld.things[name] if name in microworld.things else microworld.participants[name] for name in self.roles["patient"]]
+                for patient in patients:self.get_template({"agent":agent,"patient":patient})
+            elif "destination" in self.roles:
+                destinations=[location for location in self.roles["destination"] if location in agent.locations]
+                for destination in destinations:
+                    if not self.moves_agent:self.get_template({"agent":agent,"destination":microworld.location_map(destination)})
+                    else:
+                        for origin in agent.locations:
+                            if destination in agent.locations[origin].paths:
+                                self.get_template({"agent":agent,"destination":microworld.location_map(destination)},origin)
+            else:self.get_template({"agent":agent})
+        
+    def get_probability_value(self,formal_models,agent_name,random_generator,use_proposal=True):
         '''
         Compute the probability of occurrence of the current eventuality type. Depending on this value,
         an instance of this eventuality may be created (an object of Eventuality)
+        use_proposal: if False, the value is drawn from the probability distribution even if there is a proposal (e.g. when
+        the value has no effect, so that it does not add variance to the importance weights)
         '''
+        proposal=self.proposal_distro if use_proposal else None
         one_key=list(self.probability_distro.keys())[0]
         if not isinstance(one_key,tuple):
-            return random_generator.choices(list(self.probability_distro.keys()),self.probability_distro.values())[0]
+            return self.draw_value(self.probability_distro,proposal,random_generator)
         else:
             dict_key=[]
             (previous_model,current_model)=formal_models
@@ -126,7 +214,8 @@ class Eventuality_Type:
             
             
             prob_distro=self.probability_distro[tuple(dict_key)]
-            new_object=random_generator.choices(list(prob_distro.keys()),prob_distro.values())[0]
+            proposal_distro=proposal.get(tuple(dict_key)) if proposal is not None else None
+            new_object=self.draw_value(prob_distro,proposal_distro,random_generator)
             
             return new_object
             
@@ -143,11 +232,113 @@ class Eventuality_Effects:
         self.new_eventualities=[]
         self.interruptions=[]
         
+
+
+class Eventuality_Template:
+    '''
+    Everything about an eventuality that only depends on its grounding (type, role fillers and, for movements, the initial
+    location): the propositions of its phases, its consequences, and for movements the trajectory, the duration and the
+    effects of each time step. It is computed once and shared by all the eventualities with the same grounding, which
+    only add their initial time and duration.
+    '''
+    def __init__(self,ev_type,roles,initial_location=None):
+        self.type=ev_type
+        self.roles=dict(roles)
+        agent=self.roles["agent"]
+        
+        proposition=[ev_type.name]
+        if "agent" in self.roles:       proposition.append(self.roles["agent"].name)
+        if "patient" in self.roles:     proposition.append(self.roles["patient"].name)
+        if "destination" in self.roles: proposition.append(self.roles["destination"].name)
+        if ev_type.phases:self.phase_propositions=[tuple([phase+ev_type.name]+proposition[1:]) for phase in ev_type.phases]
+        else:self.phase_propositions=[tuple(proposition)]
+        
+        #INTERRUPTIONS
+        #When falling or hitting happens, the agent/patient needs to cancel their activities: the agent when the eventuality
+        #reaches its second phase (at once if it has no phases), the patient at every time step
+        self.interruptions={}      #time lapsed -> interrupted participants
+        self.all_interruptions=()  #participants interrupted at every time step
+        if ev_type.interrupts_agent:self.interruptions[2 if ev_type.phases else 1]=(agent,)
+        if ev_type.interrupts_patient:self.all_interruptions=(self.roles["patient"],)
+        
+        #OTHER EFFECTS
+        #Consequences at the beginning or at the end of the eventuality, as values or as new eventualities (with duration 0)
+        self.begin_values,self.begin_eventualities,self.end_values,self.end_eventualities=[],[],[],[]
+        for (conseq, value) in ev_type.consequences:
+            prop=[conseq[1]]
+            for i in range(2,len(conseq)):
+                if conseq[i]=="me":         prop.append(agent.name)
+                elif conseq[i]=="patient":  prop.append(self.roles["patient"].name)
+                elif conseq[i]=="location": prop.append(self.roles["destination"].name)
+                else: prop.append(conseq[i])
+            prop=tuple(prop)
+            
+            if conseq[0]=="b":(values,eventualities)=(self.begin_values,self.begin_eventualities) #If the consequence concerns the beginning or end of this eventuality
+            else:(values,eventualities)=(self.end_values,self.end_eventualities)
+            if prop[0]!="place" and value==1:eventualities.append((prop,0)) #The zero here refers to the duration of the eventuality, it is not the false value
+            else:values.append((prop,value))
+        
+        #MOVEMENT
+        self.trajectory=None
+        self.duration=None
+        self.movements={} #time lapsed -> (new eventualities, proposition values, new locations), None if nothing happens
+        if ev_type.moves_agent and initial_location is not None:
+            self.trajectory=agent.locations[initial_location].paths[self.roles["destination"].name]
+            self.duration=(len(self.trajectory)-1)*agent.speed+1# we only take 1 step for the reaching of the final destination
+            for time_lapsed in range(1,self.duration+2):self.movements[time_lapsed]=self.compute_movement(time_lapsed)
+    
+    def compute_movement(self,time_lapsed):
+        '''
+        When someone is walking or the bus is driving, depending on how much time has passed by, the agents need to change location
+        '''
+        agent=self.roles["agent"]
+        new_eventualities,proposition_values,new_locations=[],[],{}
+        
+        if time_lapsed%agent.speed==0: #If the agent is about to arrive somewhere
+            next_step=int(time_lapsed/agent.speed)
+            new_location=self.trajectory[next_step]
+            if self.type.arrival is not None:new_eventualities.append(((self.type.arrival,agent.name,new_location),0))
+                
+        if (time_lapsed-1)%agent.speed==0: #If we just started OR it is time to move to the next location...
+            current_step=int((time_lapsed-1)/agent.speed)
+            new_location=self.trajectory[current_step]
+            
+            for (side,otherside,crossing) in self.type.crossings:
+                if new_location not in (side,otherside):continue
+                if new_location==otherside:otherside=side
+                
+                if otherside in self.trajectory and self.trajectory.index(otherside)>current_step:
+                    jumps_required=len(self.trajectory[self.trajectory.index(new_location):self.trajectory.index(otherside)])
+                    durat=agent.speed*jumps_required+1
+                    new_eventualities.append(((crossing,agent.name),durat))
+            
+            if current_step: #if step>0, we move
+                proposition_values.append((("place",agent.name,new_location),1))
+                new_locations[agent.name]=new_location
+                previous_location=self.trajectory[current_step-1]
+                proposition_values.append((("place",agent.name,previous_location),0))
+                
+        if not (new_eventualities or proposition_values):return None
+        return (new_eventualities,proposition_values,new_locations)
+    
+    def get_movement(self,time_lapsed):
+        if self.trajectory is None:return None
+        if time_lapsed not in self.movements:self.movements[time_lapsed]=self.compute_movement(time_lapsed)
+        return self.movements[time_lapsed]
+    
+    def get_interruptions(self,time_lapsed):
+        '''
+        Participants interrupted at this time lapsed, as a tuple shared by all the eventualities of the template
+        '''
+        return self.interruptions.get(time_lapsed,self.all_interruptions)
+
+
 class Eventuality:
     '''
-    Each object of this class is an instance of an Eventuality_Type.
+    Each object of this class is an instance of an Eventuality_Type. What depends on its grounding is in its template
+    (see Eventuality_Template), the eventuality itself only adds the initial time, the duration and the current phase.
     '''
-    def __init__(self,ev_type,initial_time,initial_location,random_generator, duration=False, roles={}, trajectory=None):
+    def __init__(self,ev_type,initial_time,initial_location,random_generator, duration=False, roles={}, template=None):
         self.type=ev_type
         self.initial_time=initial_time
         
@@ -156,27 +347,49 @@ class Eventuality:
         else: self.duration=duration
         
         self.initial_location=initial_location
-        self.roles=copy.copy(roles)
-        self.trajectory=trajectory
-        
+        if template is None:template=ev_type.get_template(roles,initial_location)
+        self.template=template
+        self.roles=template.roles
+        self.trajectory=template.trajectory
         
-        proposition=[self.type.name]
-        if "agent" in self.roles:       proposition.append(self.roles["agent"].name)
-        if "patient" in self.roles:     proposition.append(self.roles["patient"].name)
-        if "destination" in self.roles: proposition.append(self.roles["destination"].name)
-        
-        if ev_type.phases:
-            self.phase=0
-            proposition[0]=self.type.phases[self.phase]+proposition[0]
-            self.proposition=tuple(proposition)
-        else: 
-            self.phase=-1 #This means there are no phases
-            self.proposition=tuple(proposition)
+        if ev_type.phases:self.phase=0
+        else:self.phase=-1 #This means there are no phases
+        self.proposition=template.phase_propositions[0]
         
         #Activating an eventuality means the participant cannot engage in the same one again
-        if self.type.name in self.roles["agent"].current_abilities:
-            self.roles["agent"].current_abilities.remove(self.type.name)
+        self.roles["agent"].current_abilities.pop(self.type.name,None)
+        
         
+    def get_state(self):
+        '''
+        The eventuality as a tuple of plain values (participants, things and locations by name), see Microworld.get_state
+        '''
+        role_names=tuple((role,filler.name) for role,filler in self.roles.items())
+        trajectory=tuple(self.trajectory) if self.trajectory is not None else None
+        return (self.type.name,self.initial_time,self.duration,self.initial_location,role_names,trajectory,self.phase,self.proposition)
+    
+    @classmethod
+    def from_state(cls,state,microworld):
+        '''
+        Rebuilds an eventuality from get_state() without the side effects of __init__ (no random draws, abilities untouched)
+        '''
+        (type_name,initial_time,duration,initial_location,role_names,trajectory,phase,proposition)=state
+        eventuality=cls.__new__(cls)
+        eventuality.type=microworld.eventuality_types[type_name]
+        eventuality.initial_time=initial_time
+        eventuality.duration=duration
+        eventuality.initial_location=initial_location
+        eventuality.roles={}
+        for role,name in role_names:
+            if role=="destination":eventuality.roles[role]=microworld.location_map(name)
+            elif name in microworld.participants:eventuality.roles[role]=microworld.participants[name]
+            else:eventuality.roles[role]=microworld.things[name]
+        eventuality.template=eventuality.type.get_template(eventuality.roles,initial_location)
+        eventuality.roles=eventuality.template.roles
+        eventuality.trajectory=eventuality.template.trajectory
+        eventuality.phase=phase
+        eventuality.proposition=proposition
+        return eventuality
         
     def change_phase(self):
         '''
@@ -186,94 +399,41 @@ class Eventuality:
         elif self.phase+1>=len(self.type.phases):print("there are no more phases")
         else:
             self.phase+=1
-            new_prop=list(self.proposition)
-            new_prop[0]=self.type.phases[self.phase]+self.type.name
-            self.proposition=tuple(new_prop)
+            self.proposition=self.template.phase_propositions[self.phase]
             
-    #TODO: parameterize fall, hit, walk_to, drive_to, cross_street
     def get_effects(self,time_step):
         '''
         When an eventuality is created, or as time passes by, it can have effects on the state of affairs of the microworld,
         Here we monitor for those effects and return them in an Eventuality_Effects object.
         '''
         new_effects=Eventuality_Effects(self)
+        template=self.template
         time_lapsed = time_step - self.initial_time + 1 #current time inclusive (i.e. if this is the first step, it has been already 1 time step)
         
         #INTERRUPTIONS
-        #When falling or hitting happens, the agent/patient needs to cancel their activities
-        if self.type.name=="fall" and time_lapsed==2:new_effects.interruptions=[self.roles["agent"]]
-        if self.type.name=="hit": new_effects.interruptions=[self.roles["patient"]]
+        new_effects.interruptions=template.get_interruptions(time_lapsed)
             
         #MOVEMENT
-        #When someone is walking or the bus is driving, depending on how much time has passed by, the agents need to change location
-        if self.type.name in ["walk_to","drive_to"]:
-            agent=self.roles["agent"]
-            
-            if time_lapsed%agent.speed==0: #If the agent is about to arrive somewhere
-                next_step=int(time_lapsed/agent.speed)
-                new_location=self.trajectory[next_step]
-                new_ev=(("arrive",self.roles["agent"].name,new_location),0)
-                new_effects.new_eventualities.append(new_ev)
-                    
-            if (time_lapsed-1)%agent.speed==0: #If we just started OR it is time to move to the next location...
-            #if time_lapsed==1 or time_lapsed%agent.speed==0: #If we just started OR it is time to move to the next location...
-                current_step=int((time_lapsed-1)/agent.speed)
-                #print("lapsed:",time_lapsed,"speed:",agent.speed, "step:",current_step)
-                new_location=self.trajectory[current_step]
-                
-                if new_location in ["jm_front","h_front"]:
-                    if new_location=="jm_front":otherside="h_front"
-                    else:otherside="jm_front"
-                    
-                    if otherside in self.trajectory and self.trajectory.index(otherside)>current_step:
-                        jumps_required=len(self.trajectory[self.trajectory.index(new_location):self.trajectory.index(otherside)])
-                        durat=self.roles["agent"].speed*jumps_required+1
-                        new_ev=(("cross_street",self.roles["agent"].name),durat)
-                        new_effects.new_eventualities.append(new_ev)
-                
-                if current_step: #if step>0, we move
-                    new_place_prop=tuple(["place",self.roles["agent"].name,new_location])
-                    new_effects.proposition_values.append((new_place_prop,1))
-                    new_effects.new_locations[self.roles["agent"].name]=new_location
-                    
-                    previous_location=self.trajectory[current_step-1]
-                    prev_place_prop=tuple(["place",self.roles["agent"].name,previous_location])
-                    new_effects.proposition_values.append((prev_place_prop,0))
+        movement=template.get_movement(time_lapsed)
+        if movement is not None:
+            (new_eventualities,proposition_values,new_locations)=movement
+            new_effects.new_eventualities.extend(new_eventualities)
+            new_effects.proposition_values.extend(proposition_values)
+            new_effects.new_locations.update(new_locations)
         
         #OTHER EFFECTS
-        initial_effects=[]
-        end_effects=[]
-        #So far we handle consequences >during< the eventuality manuallly like in "walk_to" above
-        for (conseq, value) in self.type.consequences:
-            if conseq[0]=="b":relevant_effects=initial_effects#If the consequence concerns the beginning or end of this eventuality
-            else: relevant_effects=end_effects
-            
-            ind=1
-            prop=[conseq[ind]]
-            for i in range(ind+1,len(conseq)):
-                if conseq[i]=="me":         prop.append(self.roles["agent"].name)
-                elif conseq[i]=="patient":  prop.append(self.roles["patient"].name)#elif conseq[i] in ["food","refreshment"]:prop.append(self.roles["patient"].name)
-                elif conseq[i]=="location": prop.append(self.roles["destination"].name)
-                else: prop.append(conseq[i])
-            prop=tuple(prop)
-            relevant_effects.append((prop,value))
-            
         #Effects triggered at the beginning of eventuality
         if time_lapsed==1:
-            for (prop,value) in initial_effects:
-                if prop[0]!="place" and value==1:
-                    new_effects.new_eventualities.append((prop,0)) #The zero here refers to the duration of the eventuality, it is not the false value in initial_effects
-                else:new_effects.proposition_values.append((prop,value))
+            new_effects.new_eventualities.extend(template.begin_eventualities)
+            new_effects.proposition_values.extend(template.begin_values)
 
         #During the eventuality, we turn on the corresponding proposition
-        #if time_step  < self.initial_time+self.duration:new_effects.proposition_values.append((self.proposition,1))
         if time_lapsed <= self.duration:
             new_effects.proposition_values.append((self.proposition,1))
         #Effects triggered after the eventuality is finalized
         else:
-            for (prop,value) in end_effects:
-                if prop[0]!="place" and value==1:new_effects.new_eventualities.append((prop,0))
-                else:new_effects.proposition_values.append((prop,value))
+            new_effects.new_eventualities.extend(template.end_eventualities)
+            new_effects.proposition_values.extend(template.end_values)
         
         if time_lapsed==1 or time_lapsed+1==self.duration:#If we are at the beginning or one step before finishing the eventuality
             self.change_phase()
@@ -0,0 +1,209 @@
+'''
+%        Copyright 2022 Jesús Calvillo <jescalvillot@gmail.com>
+%
+%      Licensed under the Apache License, Version 2.0 (the "License");
+%      you may not use this file except in compliance with the License.
+%      You may obtain a copy of the License at
+%
+%           http://www.apache.org/licenses/LICENSE-2.0
+%
+%     Unless required by applicable law or agreed to in writing, software
+%     distributed under the License is distributed on an "AS IS" BASIS,
+%     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+%     See the License for the specific language governing permissions and
+%     limitations under the License.
+
+Fast writing of the observations generated by the microworld.
+
+The files are the same as the ones written with Formal_Model.print_basic_propositions/print_binary_vector (the
+.observations file read by prolog) and Formal_Model.print_me (the verbose traces, with all the propositions or only the
+true ones), but the rows are formatted in blocks with numpy and written by a background thread, so the simulation
+does not wait for the disk. The queue between both is bounded, so at most queue_size blocks are kept in memory.
+Files ending in .gz are compressed with gzip and files ending in .zst with zstd (needs the zstandard package).
+
+The exporter is an accumulator (see online_statistics.py), so the observations can be written while the world runs:
+
+    with Observation_Exporter(world.propositions,"../outputs/street_life100K.observations",
+                              verbose_path="../outputs/formal_models100K.txt.gz",only_true_path="../outputs/formal_models_onlytrue100K.txt.gz") as exporter:
+        world.run(100000,random,accumulators=[exporter],keep_models=False,verbose=False)
+
+or afterwards, with export_models(models,...).
+'''
+
+import gzip
+import queue
+import threading
+import numpy as np
+
+from online_statistics import Accumulator
+
+SEPARATOR_LINE="==================================================\n"
+
+
+def open_output(path,compression="auto"):
+    '''
+    Opens a text file for writing, compressed according to compression: None, "gzip", "zstd" or "auto" (from the extension)
+    '''
+    if compression=="auto":
+        if path.endswith(".gz"):compression="gzip"
+        elif path.endswith(".zst"):compression="zstd"
+        else:compression=None
+    if compression is None:return open(path,'w')
+    if compression=="gzip":return gzip.open(path,'wt',compresslevel=6)
+    if compression=="zstd":
+        import io
+        try:import zstandard
+        except ImportError:raise ImportError("zstd compression needs the zstandard package (pip install zstandard), or use a .gz file")
+        return io.TextIOWrapper(zstandard.ZstdCompressor(level=3).stream_writer(open(path,'wb')),encoding="utf-8")
+    raise ValueError("Unknown compression: "+str(compression))
+
+
+def get_prolog_label(proposition):
+    '''
+    Label used by Formal_Model.print_me: ("place","john","jm_house") -> "place(john,jm_house)" , ("rain",) -> "rain()"
+    '''
+    return proposition[0]+"("+",".join(proposition[1:])+")"
+
+
+def format_binary_block(matrix):
+    '''
+    Lines of the .observations file for a block of binary rows, as print_binary_vector. All the characters of the block
+    are put in a byte array at once: the digits in the even positions, spaces in the odd ones and a newline at the end of each row.
+    '''
+    matrix=np.asarray(matrix)
+    n_rows,n_columns=matrix.shape
+    if not n_rows:return ""
+    if not n_columns:return "\n"*n_rows
+    characters=np.full((n_rows,2*n_columns),ord(" "),dtype=np.uint8)
+    characters[:,0::2]=matrix.astype(np.uint8)+ord("0")
+    characters[:,-1]=ord("\n")
+    return characters.tobytes().decode("ascii")
+
+
+def format_verbose_block(times,matrix,labels,only_true=True):
+    '''
+    Text written by print_me(file=...) for each row of a block
+    '''
+    matrix=np.asarray(matrix)
+    parts=[]
+    if only_true:
+        for time,row in zip(times,matrix):
+            parts.append(SEPARATOR_LINE+"MODEL OBSERVATION AT TIME "+str(time)+"\nPROPOSITIONS THAT ARE TRUE:\n")
+            on=np.flatnonzero(row)
+            if len(on):parts.append("\n".join([labels[i] for i in on])+"\n")
+            parts.append("\n")
+    else:
+        #"0\t" and "1\t" prefixes are chosen per row with a single take
+        lines=np.array([["0\t"+label+"\n" for label in labels],["1\t"+label+"\n" for label in labels]],dtype=object)
+        columns=np.arange(len(labels))
+        for time,row in zip(times,matrix):
+            parts.append(SEPARATOR_LINE+"MODEL OBSERVATION AT TIME "+str(time)+"\n")
+            parts.append("".join(lines[row,columns]))
+            parts.append("\n")
+    return "".join(parts)
+
+
+class Observation_Exporter(Accumulator):
+    '''
+    Writes the observations it receives to an .observations file and optionally to verbose traces (with all propositions,
+    or only the true ones). Rows are collected in blocks of block_size; each block is formatted and written by a background thread.
+    close() (or leaving the with block) writes what is left and waits for the thread; errors of the thread are raised there
+    (or in the next update).
+    '''
+    def __init__(self,propositions,observations_path=None,verbose_path=None,only_true_path=None,block_size=4096,queue_size=8,compression="auto"):
+        super().__init__(propositions)
+        self.prolog_labels=[get_prolog_label(prop) for prop in self.propositions]
+        self.block_size=block_size
+        self.block=np.zeros((block_size,len(self.propositions)),dtype=np.uint8)
+        self.times=[]
+        self.error=None
+        self.closed=False
+
+        self.outputs=[]
+        if observations_path:
+            output_file=open_output(observations_path,compression)
+            output_file.write(" ".join(self.labels)+"\n")
+            self.outputs.append((output_file,lambda times,block:format_binary_block(block)))
+        if verbose_path:
+            self.outputs.append((open_output(verbose_path,compression),lambda times,block:format_verbose_block(times,block,self.prolog_labels,only_true=False)))
+        if only_true_path:
+            self.outputs.append((open_output(only_true_path,compression),lambda times,block:format_verbose_block(times,block,self.prolog_labels,only_true=True)))
+
+        self.queue=queue.Queue(maxsize=queue_size)
+        self.writer=threading.Thread(target=self._write_blocks,daemon=True)
+        self.writer.start()
+
+    def _write_blocks(self):
+        while True:
+            item=self.queue.get()
+            if item is None:break
+            if self.error is not None:continue #after an error the blocks are only consumed, so that the simulation is not blocked
+            try:
+                times,block=item
+                for output_file,formatter in self.outputs:output_file.write(formatter(times,block))
+            except Exception as error:
+                self.error=error
+
+    def _raise_error(self):
+        if self.error is not None:raise IOError("The observations could not be written") from self.error
+
+    def update(self,formal_model):
+        self.add_vector(self.get_vector(formal_model),formal_model.time)
+
+    def add_vector(self,vector,time=None):
+        if time is None:time=self.n_observations
+        self.block[len(self.times)]=vector
+        self.times.append(time)
+        self.n_observations+=1
+        if len(self.times)==self.block_size:self.flush()
+
+    def add_matrix(self,matrix,times=None):
+        '''
+        Adds several observations at once (rows of a binary matrix)
+        '''
+        matrix=np.asarray(matrix,dtype=np.uint8)
+        if times is None:times=range(self.n_observations,self.n_observations+len(matrix))
+        times=list(times)
+        self.flush()
+        for start in range(0,len(matrix),self.block_size):
+            self._raise_error()
+            self.queue.put((times[start:start+self.block_size],matrix[start:start+self.block_size].copy()))
+        self.n_observations+=len(matrix)
+
+    def flush(self):
+        '''
+        Sends the current (possibly incomplete) block to the writer thread
+        '''
+        self._raise_error()
+        if not self.times:return
+        self.queue.put((self.times,self.block[:len(self.times)].copy()))
+        self.times=[]
+
+    def close(self):
+        if self.closed:return
+        self.closed=True
+        try:self.flush()
+        finally:
+            self.queue.put(None)
+            self.writer.join()
+            for output_file,_ in self.outputs:output_file.close()
+        self._raise_error()
+
+    def get_results(self):
+        return self.n_observations
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+        return False
+
+
+def export_models(models,observations_path=None,verbose_path=None,only_true_path=None,block_size=4096,compression="auto"):
+    '''
+    Writes a list of Formal_Models (as returned by Microworld.run) with an Observation_Exporter
+    '''
+    if not models:return
+    with Observation_Exporter(models[0].basic_propositions,observations_path,verbose_path,only_true_path,block_size,compression=compression) as exporter:
+        for model in models:exporter.update(model)
@@ -0,0 +1,109 @@
+'''
+%        Copyright 2022 Jesús Calvillo <jescalvillot@gmail.com>
+%
+%      Licensed under the Apache License, Version 2.0 (the "License");
+%      you may not use this file except in compliance with the License.
+%      You may obtain a copy of the License at
+%
+%           http://www.apache.org/licenses/LICENSE-2.0
+%
+%     Unless required by applicable law or agreed to in writing, software
+%     distributed under the License is distributed on an "AS IS" BASIS,
+%     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+%     See the License for the specific language governing permissions and
+%     limitations under the License.
+
+Branched continuations: many possible futures from the same moment of a run.
+
+The state of the simulation is taken with world.get_state(), a tuple of plain values that costs microseconds (there is
+no need to deepcopy the world with all its back-references), and each continuation starts from it with set_state and its own
+random substream. The continuations can also run in a pool of processes, each of which builds its own world once.
+
+    random.seed(10)
+    world=build_street_life_world()
+    world.initialize(random)
+    while not (world.current_formal_model.proposition_values[("begin_fall","john")] and world.current_formal_model.proposition_values[("rain",)]):
+        world.step(random)
+    continuations=fork(world,n_continuations=1000,time_steps=10,seed=1,processes=4,world_factory=build_street_life_world)
+    probs=get_continuation_probs(continuations)     #probs[t,i]: P(proposition i is true t+1 steps after the fork)
+'''
+
+import random
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+
+def get_substream_seeds(seed,n_continuations):
+    '''
+    Independent seeds for each continuation, derived from seed (numpy SeedSequence)
+    '''
+    children=np.random.SeedSequence(seed).spawn(n_continuations)
+    return [int(child.generate_state(2,dtype=np.uint64)[0]) for child in children]
+
+
+def run_continuation(world,state,time_steps,seed):
+    '''
+    Restores the state and generates time_steps observations with a random generator seeded with seed.
+    Returns them as a binary matrix (time_steps x world.propositions)
+    '''
+    world.set_state(state)
+    random_generator=random.Random(seed)
+    matrix=np.zeros((time_steps,len(world.propositions)),dtype=np.uint8)
+    for time_step in range(time_steps):
+        values=world.step(random_generator).proposition_values
+        matrix[time_step]=[values[prop] for prop in world.propositions]
+    return matrix
+
+
+_worker_world=None
+
+def _initialize_worker(world_factory):
+    global _worker_world
+    _worker_world=world_factory()
+
+def _run_worker_continuations(state,time_steps,seeds):
+    '''
+    Runs in a worker process; the columns are those of the worker world, which are returned too
+    '''
+    return _worker_world.propositions,[run_continuation(_worker_world,state,time_steps,seed) for seed in seeds]
+
+
+def fork(world,n_continuations,time_steps,seed=None,state=None,processes=None,world_factory=None,chunk_size=None,mp_context=None):
+    '''
+    Generates n_continuations futures of time_steps observations from the same state (by default the current state of world).
+    Returns an array (n_continuations x time_steps x world.propositions); the world is left in the state of the fork.
+    processes: if given, the continuations are split among this number of processes, which need world_factory, a function
+        (that can be pickled, e.g. build_street_life_world) returning a world equal to world
+    mp_context: multiprocessing context of the pool (e.g. multiprocessing.get_context("spawn")), the platform's default if None.
+        Each worker builds its own world and the columns are matched by proposition, so it does not need to be "fork"
+    '''
+    if state is None:state=world.get_state()
+    seeds=get_substream_seeds(seed,n_continuations)
+    continuations=np.zeros((n_continuations,time_steps,len(world.propositions)),dtype=np.uint8)
+
+    if not processes:
+        for i,continuation_seed in enumerate(seeds):continuations[i]=run_continuation(world,state,time_steps,continuation_seed)
+    else:
+        if world_factory is None:raise ValueError("Forking into processes needs a world_factory")
+        if chunk_size is None:chunk_size=max(1,-(-n_continuations//(4*processes)))
+        column_index={prop:i for i,prop in enumerate(world.propositions)}
+        with ProcessPoolExecutor(max_workers=processes,mp_context=mp_context,
+                                 initializer=_initialize_worker,initargs=(world_factory,)) as executor:
+            chunks=[(start,seeds[start:start+chunk_size]) for start in range(0,n_continuations,chunk_size)]
+            futures=[(start,executor.submit(_run_worker_continuations,state,time_steps,chunk_seeds)) for (start,chunk_seeds) in chunks]
+            for start,future in futures:
+                worker_propositions,matrices=future.result()
+                #the columns are put in the order of world.propositions, in case the worker world has a different order
+                columns=[column_index[prop] for prop in worker_propositions]
+                for offset,matrix in enumerate(matrices):continuations[start+offset][:,columns]=matrix
+
+    world.set_state(state)
+    return continuations
+
+
+def get_continuation_probs(continuations):
+    '''
+    probs[t,i]: fraction of the continuations in which proposition i is true t+1 steps after the fork
+    '''
+    return continuations.mean(axis=0)
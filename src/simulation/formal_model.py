@@ -27,9 +27,8 @@ class Formal_Model:
     def __init__(self,time,basic_propositions):
         self.time=time                              #time step within the microworld
         self.basic_propositions=basic_propositions  #set of basic propositions
-        self.proposition_values={}                  #truth values of the basic propositions
-        for b_prop in self.basic_propositions:
-            self.proposition_values[b_prop]=0
+        self.proposition_values=dict.fromkeys(self.basic_propositions,0) #truth values of the basic propositions
+        self.log_likelihood_ratio=0.0               #log p/q of the values drawn from proposal distributions in this step (importance sampling)
             
     def print_basic_propositions(self,file=None):
         """
@@ -20,9 +20,13 @@ Created on Jan 25, 2022
 @author: jesus calvillo
 '''
 import copy
+from collections import namedtuple
 from formal_model import Formal_Model
 from eventualities import Eventuality
 
+#Everything that changes while the microworld runs, as plain values (see Microworld.get_state)
+World_State=namedtuple("World_State",["time","propositions","values","log_likelihood_ratio","agenda","participants","locations","random_state"])
+
 
 class Microworld(object):
     '''
@@ -36,7 +40,10 @@ class Microworld(object):
         self.eventuality_types={}
         self.propositions=[]
         self.probability_distros={}
+        self.proposal_distros={}
         self.eventuality_agenda=[]
+        self.current_formal_model=None #last observation generated, the next one depends on it
+        self.event_log=None #Event_Log_Writer (event_log.py) that records the eventualities while the world runs, if any
     
     def print_participants(self):
         for par in self.participants.values():par.print_me()    
@@ -55,6 +62,56 @@ class Microworld(object):
      
         for ev_type_name, prob_distro in probability_distros.items():
             self.eventuality_types[ev_type_name].add_probability_distribution(prob_distro)
+            
+    def set_proposal_distros(self, proposal_distros):
+        '''
+        Importance sampling: the eventualities in proposal_distros are drawn from these distributions (e.g. with rare events boosted)
+        instead of their probability distributions. Each Formal_Model produced then has the log likelihood ratio of the draws
+        made in its time step, from which the observation weights are obtained (see get_observation_weights in
+        input_output/dataset.py). The observations should be generated with run_importance_sampled, since along a single
+        long run the weights degenerate. Must be called after set_probability_distros.
+        '''
+        self.proposal_distros=proposal_distros
+        for ev_type_name, proposal_distro in proposal_distros.items():
+            self.eventuality_types[ev_type_name].add_proposal_distribution(proposal_distro)
+            
+    def collect_log_likelihood_ratio(self):
+        return sum(ev_type.pop_log_likelihood_ratio() for ev_type in self.eventuality_types.values())
+    
+    def compile_requirements(self):
+        '''
+        Grounds the requirements of the abilities of all the participants (see Participant.compile_requirements). It is done
+        when the microworld is initialized or its state is set; call it again if abilities or requirements are changed later.
+        '''
+        for participant in self.participants.values():participant.compile_requirements()
+    
+    def compile_templates(self):
+        '''
+        Builds the templates of all the eventualities the participants can be agents of (see Eventuality_Template)
+        '''
+        for ev_type in self.eventuality_types.values():
+            ev_type.compile_templates([participant for participant in self.participants.values() if ev_type.name in participant.abilities],self)
+    
+    def log_start(self,eventuality,parent=None):
+        '''
+        Records the beginning of an eventuality in the event log, if there is one. parent is the eventuality that triggered it
+        '''
+        if self.event_log is not None:self.event_log.log_start(eventuality,parent)
+    
+    def log_interruptions(self,participant,new_agenda,active=None,processed=0):
+        '''
+        Records in the event log the eventualities of participant that are stopped by an interruption, before they are
+        deactivated/cancelled: those in the new agenda and those of the old agenda that were not processed yet (from
+        processed on) and are still active. The ones that already finished and the interrupting eventuality itself (at
+        processed-1) are not included, so each eventuality is recorded once; the ones that began in this step are not recorded
+        at all by the writer (see Event_Log_Writer).
+        '''
+        if self.event_log is None:return
+        interrupted=[ev for ev in new_agenda if ev.roles["agent"].name==participant.name]
+        if active is not None:
+            interrupted+=[self.eventuality_agenda[j] for j in range(processed,len(self.eventuality_agenda)) 
+                          if active[j] and self.eventuality_agenda[j].roles["agent"].name==participant.name]
+        for eventuality in interrupted:self.event_log.log_interrupt(eventuality)
     
     def relocate_participant(self,participant,new_location):
         '''
@@ -109,6 +166,7 @@ class Microworld(object):
                 new_eventuality=Eventuality(ev_type,initial_time,initial_location,random_generator, roles=roles)
             
             new_eventualities.append(new_eventuality)
+            self.log_start(new_eventuality,eventuality)
             new_triggered_eventualities=self.apply_eventuality_effects(new_eventuality, formal_model,random_generator)
             new_eventualities.extend(new_triggered_eventualities)
             
@@ -126,8 +184,7 @@ class Microworld(object):
         for ev_index in range(len(agenda)):
             if agenda[ev_index].roles["agent"].name==participant.name:
                 indices[ev_index]=0
-                if agenda[ev_index].type.name not in participant.current_abilities:
-                    participant.current_abilities.append(agenda[ev_index].type.name)
+                participant.current_abilities[agenda[ev_index].type.name]=None
         return indices
     
     def cancel_new_participant_eventualities(self,participant,new_agenda):
@@ -138,93 +195,207 @@ class Microworld(object):
         new_new_agenda=[]   
         for ag_eventuality in new_agenda:
             if ag_eventuality.roles["agent"].name!= participant.name: new_new_agenda.append(ag_eventuality)
-            elif ag_eventuality.type.name not in participant.current_abilities:
-                participant.current_abilities.append(ag_eventuality.type.name)       
+            else:participant.current_abilities[ag_eventuality.type.name]=None
         return new_new_agenda
     
-    def run(self,time_steps,random_generator):
+    def get_state(self,random_generator=None):
         '''
-        Returns a list of observations with lenght==time_steps. 
-        It initializes the microworld and incrementally (one step at a time) generates the required observations.
-        Each observation depends on the previous ones.
+        Snapshot of the simulation after the last generated observation, made only of tuples, strings and numbers: the current
+        formal model, the agenda, the location, abilities and flags of each participant, who is at each location (the order
+        matters for the random choices) and, if random_generator is given, its state.
+        It takes microseconds and can be pickled, e.g. to continue the simulation in other processes (see forking.py).
+        '''
+        model=self.current_formal_model
+        return World_State(model.time,self.propositions,tuple([model.proposition_values[prop] for prop in self.propositions]),
+                           model.log_likelihood_ratio,
+                           tuple([eventuality.get_state() for eventuality in self.eventuality_agenda]),
+                           tuple([(part.name,part.current_location,tuple(part.current_abilities),part.interrupted) for part in self.participants.values()]),
+                           tuple([(name,tuple([part.name for part in location.participants])) for name,location in self.location_map.locations.items()]),
+                           random_generator.getstate() if random_generator is not None else None)
+    
+    def set_state(self,state,random_generator=None):
+        '''
+        Puts the microworld back in a state returned by get_state (of this world or of another world built in the same way),
+        the next step continues from there. If random_generator is given and the state has a random state, it is restored too.
         '''
+        model=Formal_Model(state.time,self.propositions)
+        model.proposition_values.update(zip(state.propositions,state.values))
+        model.log_likelihood_ratio=state.log_likelihood_ratio
+        self.current_formal_model=model
         
-        previous_formal_model=Formal_Model(0,self.propositions)
+        for (name,current_location,current_abilities,interrupted) in state.participants:
+            participant=self.participants[name]
+            participant.current_location=current_location
+            participant.current_abilities=dict.fromkeys(current_abilities)
+            participant.interrupted=interrupted
+        for (name,participant_names) in state.locations:
+            self.location_map(name).participants=[self.participants[part_name] for part_name in participant_names]
+        self.eventuality_agenda=[Eventuality.from_state(eventuality_state,self) for eventuality_state in state.agenda]
+        self.collect_log_likelihood_ratio()
+        if random_generator is not None and state.random_state is not None:random_generator.setstate(state.random_state)
+        self.compile_requirements()
+    
+    def initialize(self,random_generator):
+        '''
+        Puts the microworld in its initial state and returns the first observation (time 0)
+        '''
+        first_formal_model=Formal_Model(0,self.propositions)
+        self.collect_log_likelihood_ratio() #draws made before the run do not belong to any observation
         
-        previous_formal_model.proposition_values[("rain",)]=random_generator.choice([0,1])#initial weather
+        first_formal_model.proposition_values[("rain",)]=random_generator.choice([0,1])#initial weather
         #we put the participants in their initial location/home
-        for part in self.participants.values():part.initialize(previous_formal_model)
+        for location in self.location_map.locations.values():location.participants=[]
+        for part in self.participants.values():part.initialize(first_formal_model)
+        
+        self.eventuality_agenda=[]
+        self.current_formal_model=first_formal_model
+        self.compile_requirements()
+        self.compile_templates()
+        return first_formal_model
     
-        previous_formal_model.print_me()
-        all_formal_models=[previous_formal_model]
-        #Then we let the world "run" for n-1 time steps (step 0 was the initialization)  
-        self.eventuality_agenda=[]      
-        for time_step in range(1,time_steps):
-            new_formal_model=Formal_Model(time_step,self.propositions) 
-            
-            #We set the weather:
-            new_rain=self.eventuality_types["rain"].get_probability_value([previous_formal_model, new_formal_model],"none",random_generator)
-            new_formal_model.proposition_values[("rain",)]=new_rain
-            
-            #We put each participant in their current location:
-            for participant in self.participants.values():
-                new_formal_model.proposition_values[("place",participant.name,participant.current_location)]=1
-            
-            #then we process items in the agenda
-            new_agenda=[]
-            active=[1 for i in range(len(self.eventuality_agenda))] #This is a flag, an eventuality can become inactive due to another eventuality that causes an interruption
-            for i in range(len(self.eventuality_agenda)):
-                if active[i]:
-                    
-                    eventuality=self.eventuality_agenda[i]
-                    ev_effects=eventuality.get_effects(time_step)     
-                    for partic in ev_effects.interruptions:
-                        partic.reset_propositions(new_formal_model)
-                        #We deactivate all the evts in the previous agenda related to that participant (so that they are no longer processed)
-                        active=self.deactivate_participant_eventualities(partic, self.eventuality_agenda, active)
-                        #We remove from the new agenda, the evts related to that participant that might have been initiated 
-                        new_agenda=self.cancel_new_participant_eventualities(partic, new_agenda)
-                        partic.interrupted=True #We don't let the interrupted participant initiate evnts in this time step
-                    
-                    possibly_new_eventualities=self.apply_eventuality_effects(eventuality,new_formal_model,random_generator,ev_effects)
-                    new_agenda.extend(possibly_new_eventualities)
-                    
-                    if eventuality.initial_time + eventuality.duration > time_step: #If the eventuality hasn't finished yet
-                        new_agenda.append(eventuality)
-                    elif eventuality.type.name not in eventuality.roles["agent"].current_abilities: #If it finished, we give the ability to the participant back
-                        eventuality.roles["agent"].current_abilities.append(eventuality.type.name)
-                        
-            #Then we let each participant start eventualities
-            participants=list(self.participants.values())
-            random_generator.shuffle(participants)   
-            for i in range(len(participants)):
-                participant =participants[i]
-                #We ignore participants that fell or were hit in the current time step
-                if participant.interrupted:
-                    participant.interrupted=False
-                    continue
+    def step(self,random_generator):
+        '''
+        Generates the observation that follows self.current_formal_model, and makes it the current one
+        '''
+        time_step=self.current_formal_model.time+1
+        new_formal_model=Formal_Model(time_step,self.propositions) 
+        
+        #We set the weather:
+        new_rain=self.eventuality_types["rain"].get_probability_value([self.current_formal_model, new_formal_model],"none",random_generator)
+        new_formal_model.proposition_values[("rain",)]=new_rain
+        
+        #We put each participant in their current location:
+        for participant in self.participants.values():
+            new_formal_model.proposition_values[("place",participant.name,participant.current_location)]=1
+        
+        #then we process items in the agenda
+        new_agenda=[]
+        active=[1 for i in range(len(self.eventuality_agenda))] #This is a flag, an eventuality can become inactive due to another eventuality that causes an interruption
+        for i in range(len(self.eventuality_agenda)):
+            if active[i]:
+                
+                eventuality=self.eventuality_agenda[i]
+                ev_effects=eventuality.get_effects(time_step)     
+                for partic in ev_effects.interruptions:
+                    partic.reset_propositions(new_formal_model)
+                    self.log_interruptions(partic,new_agenda,active,i+1)
+                    #We deactivate all the evts in the previous agenda related to that participant (so that they are no longer processed)
+                    active=self.deactivate_participant_eventualities(partic, self.eventuality_agenda, active)
+                    #We remove from the new agenda, the evts related to that participant that might have been initiated 
+                    new_agenda=self.cancel_new_participant_eventualities(partic, new_agenda)
+                    partic.interrupted=True #We don't let the interrupted participant initiate evnts in this time step
                 
-                new_eventualities=participant.start_eventualities([previous_formal_model,new_formal_model],random_generator)
+                possibly_new_eventualities=self.apply_eventuality_effects(eventuality,new_formal_model,random_generator,ev_effects)
+                new_agenda.extend(possibly_new_eventualities)
                 
-                caused_interruptions=[ev for ev in new_eventualities if ev.type.interrupts_patient] #hitting occurs in a single time step, therefore the effects are immediate
-                for interr in caused_interruptions:
-                    patient=interr.roles["patient"]
-                    if patient.interrupted: continue
-                    new_agenda=self.cancel_new_participant_eventualities(patient, new_agenda)
-                    patient.reset_propositions(new_formal_model)
+                if eventuality.initial_time + eventuality.duration > time_step: #If the eventuality hasn't finished yet
+                    new_agenda.append(eventuality)
+                else: #If it finished, we give the ability to the participant back (at the end of the order, if it was not there)
+                    eventuality.roles["agent"].current_abilities[eventuality.type.name]=None
+                    if self.event_log is not None:self.event_log.log_end(eventuality)
                     
-                    part_index=participants.index(patient)
-                    if part_index>i: patient.interrupted=True
-
-                new_agenda.extend(new_eventualities)
-        
-            self.eventuality_agenda=new_agenda    
+        #Then we let each participant start eventualities
+        participants=list(self.participants.values())
+        random_generator.shuffle(participants)   
+        for i in range(len(participants)):
+            participant =participants[i]
+            #We ignore participants that fell or were hit in the current time step
+            if participant.interrupted:
+                participant.interrupted=False
+                continue
             
-            all_formal_models.append(new_formal_model)
-            previous_formal_model=new_formal_model
+            new_eventualities=participant.start_eventualities([self.current_formal_model,new_formal_model],random_generator)
             
-            new_formal_model.print_me()
+            caused_interruptions=[ev for ev in new_eventualities if ev.type.interrupts_patient] #hitting occurs in a single time step, therefore the effects are immediate
+            for interr in caused_interruptions:
+                patient=interr.roles["patient"]
+                if patient.interrupted: continue
+                self.log_interruptions(patient,new_agenda)
+                new_agenda=self.cancel_new_participant_eventualities(patient, new_agenda)
+                patient.reset_propositions(new_formal_model)
+                
+                part_index=participants.index(patient)
+                if part_index>i: patient.interrupted=True
+
+            new_agenda.extend(new_eventualities)
+    
+        self.eventuality_agenda=new_agenda    
+        new_formal_model.log_likelihood_ratio=self.collect_log_likelihood_ratio()
+        self.current_formal_model=new_formal_model
+        return new_formal_model
+    
+    def continue_run(self,time_steps,random_generator,accumulators=None,keep_models=True,verbose=True,stop_when=None,event_log=None):
+        '''
+        Generates time_steps more observations from the current state (after initialize, run or set_state), same arguments as run
+        '''
+        if accumulators is None:accumulators=[]
+        if stop_when is not None and stop_when not in accumulators:accumulators=accumulators+[stop_when]
+        if event_log is not None and event_log not in accumulators:accumulators=accumulators+[event_log]
         
+        all_formal_models=[]
+        self.event_log=event_log
+        try:
+            for _ in range(time_steps):
+                new_formal_model=self.step(random_generator)
+                
+                if keep_models:all_formal_models.append(new_formal_model)
+                for accumulator in accumulators:accumulator.update(new_formal_model)
+                
+                if verbose:new_formal_model.print_me()
+                if stop_when is not None and stop_when.is_converged():break
+        finally:self.event_log=None
+        
+        return all_formal_models
+    
+    def run_importance_sampled(self,n_runs,run_length,random_generator,interval=None,verbose=False):
+        '''
+        Importance sampling with many short runs, so that the weights do not degenerate as they do along a single long run.
+        The world runs with its probability distributions and, every interval steps (run_length by default), a short run of
+        run_length steps is generated from its current state with the proposal distributions (see set_proposal_distros); then
+        the world goes back to that state and continues. Since the short runs start from states of the unweighted run, their
+        weighted observations estimate the same probabilities as a long run.
+        Returns the n_runs*run_length observations of the short runs, one run after the other. Their weights are given by
+        get_observation_weights(log_likelihood_ratios,run_length) in input_output/dataset.py, which accumulates the likelihood
+        ratios within each run only.
+        '''
+        if interval is None:interval=run_length
+        proposals={name:ev_type.proposal_distro for name,ev_type in self.eventuality_types.items()}
+        all_formal_models=[]
+        self.initialize(random_generator)
+        try:
+            for _ in range(n_runs):
+                for ev_type in self.eventuality_types.values():ev_type.proposal_distro=None
+                self.continue_run(interval,random_generator,keep_models=False,verbose=False)
+                state=self.get_state()
+                for name,proposal in proposals.items():self.eventuality_types[name].proposal_distro=proposal
+                all_formal_models.extend(self.continue_run(run_length,random_generator,verbose=verbose))
+                self.set_state(state)
+        finally:
+            for name,proposal in proposals.items():self.eventuality_types[name].proposal_distro=proposal
+        return all_formal_models
+    
+    def run(self,time_steps,random_generator,accumulators=None,keep_models=True,verbose=True,stop_when=None,event_log=None):
+        '''
+        Returns a list of observations with lenght==time_steps. 
+        It initializes the microworld and incrementally (one step at a time) generates the required observations.
+        Each observation depends on the previous ones.
+        accumulators: objects from online_statistics.py, they are updated with each new observation
+        keep_models: if False, the observations are not kept (only the accumulators see them) and an empty list is returned
+        verbose: if False, the observations are not printed
+        stop_when: an accumulator with an is_converged method (e.g. Convergence_Accumulator), the run stops as soon as it is
+            converged and time_steps is only the maximum number of observations
+        event_log: an Event_Log_Writer (event_log.py), which records the eventualities and the observations of the run
+        '''
+        if accumulators is None:accumulators=[]
+        if stop_when is not None and stop_when not in accumulators:accumulators=accumulators+[stop_when]
+        if event_log is not None and event_log not in accumulators:accumulators=accumulators+[event_log]
+        
+        first_formal_model=self.initialize(random_generator)
+        if verbose:first_formal_model.print_me()
+        for accumulator in accumulators:accumulator.update(first_formal_model)
+        all_formal_models=[first_formal_model] if keep_models else []
+        #Then we let the world "run" for n-1 time steps (step 0 was the initialization)  
+        all_formal_models.extend(self.continue_run(time_steps-1,random_generator,accumulators,keep_models,verbose,stop_when,event_log))
         return all_formal_models
 
             
@@ -0,0 +1,321 @@
+'''
+%        Copyright 2022 Jesús Calvillo <jescalvillot@gmail.com>
+%
+%      Licensed under the Apache License, Version 2.0 (the "License");
+%      you may not use this file except in compliance with the License.
+%      You may obtain a copy of the License at
+%
+%           http://www.apache.org/licenses/LICENSE-2.0
+%
+%     Unless required by applicable law or agreed to in writing, software
+%     distributed under the License is distributed on an "AS IS" BASIS,
+%     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+%     See the License for the specific language governing permissions and
+%     limitations under the License.
+
+Accumulators of statistics that are updated while the microworld runs, one observation at a time.
+They are given to Microworld.run(..., accumulators=[...]) and their results can be read at any point during or after the run,
+so there is no need to write and reload the whole situation space matrix:
+
+    prior=Prior_Accumulator(world.propositions)
+    lagged=Lag_Cooccurrence_Accumulator(world.propositions,max_lag=7)
+    world.run(1000000,random,accumulators=[prior,lagged],keep_models=False,verbose=False)
+    prior.print_results()
+
+The results correspond to print_prior_probs, get_conditional_joint_probs and get_condps_through_time in input_output/dataset.py.
+
+A Convergence_Accumulator can also decide the length of the run: the run stops as soon as the confidence intervals of
+the tracked statistics are narrow enough, and time_steps is only the budget:
+
+    convergence=Convergence_Accumulator(world.propositions,target_width=0.02)
+    models=world.run(1000000,random,stop_when=convergence,verbose=False)
+    convergence.print_results()
+'''
+
+import numpy as np
+
+from abc import ABC, abstractmethod
+
+
+def proposition_label(proposition):
+    '''
+    ("place","john","jm_house") -> "place(john,jm_house)" , ("rain",) -> "rain"
+    '''
+    if len(proposition)==1:return proposition[0]
+    return proposition[0]+"("+",".join(proposition[1:])+")"
+
+
+class Accumulator(ABC):
+    '''
+    Base class, each accumulator receives every Formal_Model produced by the microworld through update().
+    Subclasses implement add_vector and get_results.
+    '''
+    def __init__(self,propositions):
+        self.propositions=list(propositions)
+        self.labels=[proposition_label(prop) for prop in self.propositions]
+        self.n_observations=0
+
+    def get_vector(self,formal_model):
+        return np.fromiter((formal_model.proposition_values[prop] for prop in self.propositions),dtype=np.int64,count=len(self.propositions))
+
+    def update(self,formal_model):
+        self.add_vector(self.get_vector(formal_model))
+
+    @abstractmethod
+    def add_vector(self,vector):
+        pass
+
+    @abstractmethod
+    def get_results(self):
+        pass
+
+
+class Prior_Accumulator(Accumulator):
+    '''
+    Number of observations in which each proposition is true
+    '''
+    def __init__(self,propositions):
+        super().__init__(propositions)
+        self.counts=np.zeros(len(self.propositions),dtype=np.int64)
+
+    def add_vector(self,vector):
+        self.counts+=vector
+        self.n_observations+=1
+
+    def get_results(self):
+        '''
+        Returns the prior probability of each proposition
+        '''
+        if not self.n_observations:return np.zeros(len(self.propositions))
+        return self.counts/self.n_observations
+
+    def print_results(self):
+        for i,prior in enumerate(self.get_results()):print(i,self.labels[i],prior)
+
+
+class Cooccurrence_Accumulator(Accumulator):
+    '''
+    Number of observations in which each pair of propositions is true at the same time
+    '''
+    def __init__(self,propositions):
+        super().__init__(propositions)
+        self.counts=np.zeros((len(self.propositions),len(self.propositions)),dtype=np.int64)
+
+    def add_vector(self,vector):
+        on=np.nonzero(vector)[0]
+        self.counts[np.ix_(on,on)]+=1
+        self.n_observations+=1
+
+    def get_results(self):
+        '''
+        Returns jointps[i,j]=P(i,j) and condps[i,j]=P(j|i), as get_conditional_joint_probs
+        '''
+        if not self.n_observations:return self.counts.astype(float),self.counts.astype(float)
+        jointps=self.counts/self.n_observations
+        priors=np.diagonal(self.counts).astype(float)
+        condps=np.zeros(self.counts.shape,dtype=float)
+        nonzero=priors>0
+        condps[nonzero]=self.counts[nonzero]/priors[nonzero,None]
+        return jointps,condps
+
+
+class Lag_Cooccurrence_Accumulator(Accumulator):
+    '''
+    For each lag k=1..max_lag, the number of times proposition i is true at time t and proposition j at time t+k.
+    The last max_lag observations are kept in a ring buffer.
+    '''
+    def __init__(self,propositions,max_lag=7):
+        super().__init__(propositions)
+        self.max_lag=max_lag
+        n_props=len(self.propositions)
+        self.buffer=np.zeros((max_lag,n_props),dtype=np.int64)
+        self.position=0 #position of the buffer where the next observation goes
+        self.counts=np.zeros((max_lag+1,n_props,n_props),dtype=np.int64) #counts[0] are the plain co-occurrences
+        self.base_counts=np.zeros((max_lag+1,n_props),dtype=np.int64)   #base_counts[k][i]: times i was true at t and t+k was observed
+        self.early_counts=np.zeros((max_lag,n_props),dtype=np.int64)    #early_counts[k][i]: times i was true within the first k+1 observations
+
+    def add_vector(self,vector):
+        on=np.nonzero(vector)[0]
+        self.counts[0][np.ix_(on,on)]+=1
+        self.base_counts[0]+=vector
+        for lag in range(1,min(self.max_lag,self.n_observations)+1):
+            previous=self.buffer[(self.position-lag)%self.max_lag]
+            previous_on=np.nonzero(previous)[0]
+            self.counts[lag][np.ix_(previous_on,on)]+=1
+            self.base_counts[lag]+=previous
+        if self.n_observations<self.max_lag:self.early_counts[self.n_observations:]+=vector
+        self.buffer[self.position]=vector
+        self.position=(self.position+1)%self.max_lag
+        self.n_observations+=1
+
+    def get_results(self):
+        '''
+        Returns condps[k,i,j]=P(j at t+k | i at t) for k=0..max_lag
+        '''
+        condps=np.zeros(self.counts.shape,dtype=float)
+        nonzero=self.base_counts>0
+        for lag in range(self.max_lag+1):
+            condps[lag][nonzero[lag]]=self.counts[lag][nonzero[lag]]/self.base_counts[lag][nonzero[lag],None]
+        return condps
+
+    def get_condps_through_time(self,target_index,side_size=None,interest_indices=[]):
+        '''
+        Same layout as get_condps_through_time in dataset.py (rows: interest propositions, columns: times -side_size..side_size)
+        with a basic proposition as target. The past side uses the reversed pairs: P(j at t-k | i at t)
+        '''
+        if side_size is None:side_size=self.max_lag
+        if side_size>self.max_lag:
+            raise ValueError("side_size (%d) cannot be larger than the max_lag of the accumulator (%d)"%(side_size,self.max_lag))
+        if not len(interest_indices):interest_indices=range(len(self.propositions))
+        interest_indices=list(interest_indices)
+        condps=np.zeros((len(interest_indices),2*side_size+1),dtype=float)
+        for lag in range(side_size+1):
+            with_future=self.base_counts[lag][target_index]
+            if with_future:condps[:,side_size+lag]=self.counts[lag][target_index,interest_indices]/with_future
+            if lag==0:continue
+            #occurrences of the target that have an observation lag steps before them
+            with_past=self.base_counts[0][target_index]-self.early_counts[lag-1][target_index]
+            if with_past:condps[:,side_size-lag]=self.counts[lag][interest_indices,target_index]/with_past
+        return condps
+
+
+class Convergence_Accumulator(Accumulator):
+    '''
+    Priors of the tracked propositions and, if pairs is True, the joint probabilities of each pair of them, with confidence
+    intervals. Consecutive observations are correlated, so the variance of each statistic is estimated with batch means:
+    the observations are split into consecutive batches (between n_batches and 2*n_batches of them, their size doubles when
+    needed) and the variance of the batch means gives the variance of the overall mean. The effective sample size (ESS) is
+    the number of independent observations that would give the same precision.
+    The estimated variance is never lower than the one of independent observations (with the Agresti-Coull correction),
+    so statistics that have not been observed yet still have an interval of width ~5/n.
+
+    target_width: the accumulator is converged when every interval is at most this wide. If relative_width is True, the width
+        is divided by the estimate (statistics that have not been observed at all are then ignored, e.g. impossible pairs).
+    min_observations: observations needed before checking convergence
+    check_every: the convergence is only checked every check_every observations (it is cheap, but not free)
+    '''
+    def __init__(self,propositions,tracked=None,pairs=True,target_width=0.01,relative_width=False,z=1.96,n_batches=64,
+                 min_observations=1000,check_every=1000):
+        super().__init__(propositions)
+        if tracked is None:tracked=self.propositions
+        self.tracked=list(tracked)
+        self.tracked_labels=[proposition_label(prop) for prop in self.tracked]
+        self.tracked_indices=np.array([self.propositions.index(prop) for prop in self.tracked],dtype=np.int64)
+        self.pairs=pairs
+        self.target_width=target_width
+        self.relative_width=relative_width
+        self.z=z
+        self.n_batches=n_batches
+        self.min_observations=max(min_observations,1)
+        self.check_every=max(check_every,1)
+
+        n_tracked=len(self.tracked)
+        shape=(n_tracked,n_tracked) if pairs else (n_tracked,)
+        self.counts=np.zeros(shape,dtype=np.int64)
+        self.batch_counts=np.zeros((2*n_batches,)+shape,dtype=np.int32)
+        self.current_batch=np.zeros(shape,dtype=np.int32)
+        self.batch_size=1
+        self.in_current_batch=0
+        self.complete_batches=0
+        self.converged=False
+        self.checked_at=0
+
+    def add_vector(self,vector):
+        on=np.nonzero(vector[self.tracked_indices])[0]
+        if self.pairs:self.current_batch[np.ix_(on,on)]+=1
+        else:self.current_batch[on]+=1
+        self.n_observations+=1
+        self.in_current_batch+=1
+        if self.in_current_batch==self.batch_size:self._close_batch()
+
+    def _close_batch(self):
+        self.counts+=self.current_batch
+        self.batch_counts[self.complete_batches]=self.current_batch
+        self.current_batch[...]=0
+        self.in_current_batch=0
+        self.complete_batches+=1
+        if self.complete_batches==2*self.n_batches:#the batches are merged in pairs and the batch size doubles
+            merged=self.batch_counts[0::2]+self.batch_counts[1::2]
+            self.batch_counts[:self.n_batches]=merged
+            self.batch_counts[self.n_batches:]=0
+            self.complete_batches=self.n_batches
+            self.batch_size*=2
+
+    def get_results(self):
+        '''
+        Returns estimates, half widths of the confidence intervals and effective sample sizes, with the shape of the
+        statistics: (tracked,) or (tracked,tracked), where the diagonal holds the priors
+        '''
+        n=self.n_observations
+        shape=self.counts.shape
+        if not n:return np.zeros(shape),np.ones(shape),np.zeros(shape)
+        counts=self.counts+self.current_batch
+        estimates=counts/n
+        adjusted=(counts+self.z**2/2)/(n+self.z**2)
+        iid_variance=adjusted*(1-adjusted)
+        variance=iid_variance
+        if self.complete_batches>1:
+            batch_means=self.batch_counts[:self.complete_batches]/self.batch_size
+            variance=np.maximum(variance,self.batch_size*batch_means.var(axis=0,ddof=1))
+        half_widths=self.z*np.sqrt(variance/n)
+        ess=n*iid_variance/variance
+        return estimates,half_widths,ess
+
+    def get_widths(self):
+        '''
+        Width of each interval as used by the stopping rule (relative to the estimate if relative_width)
+        '''
+        estimates,half_widths,_=self.get_results()
+        widths=2*half_widths
+        if self.relative_width:
+            widths=np.where(estimates>0,widths/np.maximum(estimates,1e-300),0.0)
+        return widths
+
+    def is_converged(self):
+        if self.n_observations<self.min_observations:return False
+        if self.n_observations-self.checked_at>=self.check_every or not self.checked_at:
+            self.checked_at=self.n_observations
+            self.converged=bool(self.get_widths().max(initial=0.0)<=self.target_width)
+        return self.converged
+
+    def get_statistic_label(self,index):
+        if not self.pairs:return self.tracked_labels[index[0]]
+        i,j=index
+        if i==j:return self.tracked_labels[i]
+        return self.tracked_labels[i]+" & "+self.tracked_labels[j]
+
+    def get_report(self,n_worst=10):
+        '''
+        Achieved precision: the widest intervals, and the smallest effective sample size of the priors
+        '''
+        estimates,half_widths,ess=self.get_results()
+        widths=self.get_widths()
+        if self.pairs:#each pair once
+            valid=np.triu(np.ones(widths.shape,dtype=bool))
+            prior_ess=np.diagonal(ess)
+        else:
+            valid=np.ones(widths.shape,dtype=bool)
+            prior_ess=ess
+        order=np.argsort(-np.where(valid,widths,-1),axis=None)[:n_worst]
+        worst=[]
+        for flat_index in order:
+            index=np.unravel_index(flat_index,widths.shape)
+            if not valid[index]:break
+            worst.append({"statistic":self.get_statistic_label(index),"estimate":float(estimates[index]),
+                          "half_width":float(half_widths[index]),"width":float(widths[index]),"ess":float(ess[index])})
+        return {"n_observations":self.n_observations,
+                "batch_size":self.batch_size,
+                "target_width":self.target_width,
+                "relative_width":self.relative_width,
+                "max_width":float(widths.max(initial=0.0)),
+                "converged":bool(widths.max(initial=0.0)<=self.target_width) and self.n_observations>=self.min_observations,
+                "min_prior_ess":float(prior_ess.min(initial=float(self.n_observations))),
+                "worst":worst}
+
+    def print_results(self,n_worst=10):
+        report=self.get_report(n_worst)
+        print("observations:",report["n_observations"],"converged:",report["converged"],
+              "max width:",round(report["max_width"],5),"target:",report["target_width"],"(relative)" if report["relative_width"] else "")
+        print("smallest effective sample size of a prior:",round(report["min_prior_ess"],1))
+        for item in report["worst"]:
+            print(item["statistic"],round(item["estimate"],5),"+-",round(item["half_width"],5),"ESS:",round(item["ess"],1))
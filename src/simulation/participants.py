@@ -18,6 +18,7 @@ Here we defined mostly the behavior of the participants. We also have a Thing cl
 '''
 
 
+from operator import itemgetter
 from eventualities import Eventuality
 
 class Thing:
@@ -43,7 +44,11 @@ class Participant:
         self.propositions=[] # propositions where they are the agent
         self.locations = locations  # where they can be
         self.current_location=None
-        self.current_abilities=[] #eventualities the participant can initiate at the current time
+        self.current_abilities={} #eventualities the participant can initiate at the current time (ordered like a list, values unused)
+        
+        #Incremental checking of the requirements (see compile_requirements)
+        self.compiled_requirements={} #ability -> list of (previous, propositions, value, mode)
+        self.possible_now=set()       #abilities whose location and requirements hold in the current state of affairs
         
         self.initial_location=None #The location where the participant always appears initially
         self.interrupted=False #If the participant falls or is hit by the bus, this flag becomes true
@@ -110,26 +115,94 @@ class Participant:
         Once an eventuality is finished, the participant can initiate the same activity again 
         '''
         for eventuality in current_new_eventualities:
-            if eventuality.type.name not in self.current_abilities:
-                self.current_abilities.append(eventuality.type.name)
+            self.current_abilities[eventuality.type.name]=None
         
-            
+    
+    def compile_requirements(self):
+        '''
+        Grounds the requirements of each ability for this participant, so that they are resolved only once:
+        (previous, propositions, value, mode), where previous says if they are checked in the previous formal model, and mode
+        is "all" (all the propositions must have the value) or "any" (for any_location, one of them).
+        It also indexes the abilities by the propositions they read, so that get_possible_now only checks again the abilities
+        whose propositions changed.
+        '''
+        self.compiled_requirements={}
+        dependents={} #(previous, proposition) -> abilities whose requirements read it
+        for predicate,eventuality_type in self.abilities.items():
+            compiled=[]
+            for (req,val) in eventuality_type.requirements:
+                previous=req[0]=="p"  #If the requirement concerns the previous time step
+                if previous:req=req[1:]
+                
+                prop=[req[0]]
+                mode="all"
+                if len(req)>1:prop.append(self.name if req[1]=="me" else req[1])
+                if len(req)>2:
+                    second_arg=req[2]
+                    if second_arg.startswith("all_"):
+                        sec_type=second_arg[4:]
+                        if sec_type=="locations":possibles=list(self.locations)
+                        else:possibles=[f.name for f in self.microworld.things.values() if f.category==sec_type]
+                        propositions=tuple([tuple(prop+[possib]) for possib in possibles])
+                    elif second_arg=="any_location":
+                        propositions=tuple([tuple(prop+[loc]) for loc in self.locations])
+                        mode="any"
+                    else:propositions=(tuple(prop+[second_arg]),)
+                else:propositions=(tuple(prop),)
+                compiled.append((previous,propositions,val,mode))
+                for proposition in propositions:dependents.setdefault((previous,proposition),set()).add(predicate)
+            self.compiled_requirements[predicate]=compiled
+        
+        watched=list(dependents.keys())
+        self.watched_dependents=[dependents[key] for key in watched]
+        #the values of the watched propositions are read at once with itemgetters (one per formal model)
+        self.watched_positions=[[i for i,(previous,_) in enumerate(watched) if previous==previous_model] for previous_model in (True,False)]
+        self.watched_getters=[self.get_values_getter([watched[i][1] for i in positions]) for positions in self.watched_positions]
+        self.watched_values=None  #values when the abilities were last checked, None means all of them must be checked
+        self.checked_location=None
+        self.possible_now=set()
+    
+    @staticmethod
+    def get_values_getter(propositions):
+        '''
+        Function from proposition_values to the tuple of the values of the propositions
+        '''
+        if not propositions:return lambda values:()
+        if len(propositions)==1:return lambda values:(values[propositions[0]],)
+        return itemgetter(*propositions)
+        
+    def get_possible_now(self,formal_models):
+        '''
+        Set of abilities that are possible in the current state of affairs (whether the participant is doing them or not).
+        Only the abilities that read a proposition whose value changed since they were last checked are checked again
+        (all of them if the participant moved).
+        '''
+        if not self.compiled_requirements:self.compile_requirements()
+        previous_getter,current_getter=self.watched_getters
+        values=(previous_getter(formal_models[0].proposition_values),current_getter(formal_models[1].proposition_values))
+        if values==self.watched_values and self.current_location==self.checked_location:return self.possible_now
+        
+        if self.watched_values is None or self.current_location!=self.checked_location:dirty=self.abilities
+        else:
+            dirty=set()
+            for positions,old_values,new_values in zip(self.watched_positions,self.watched_values,values):
+                for i,old,new in zip(positions,old_values,new_values):
+                    if old!=new:dirty|=self.watched_dependents[i]
+                    
+        for predicate in dirty:
+            if self.possible_predicate(formal_models,predicate):self.possible_now.add(predicate)
+            else:self.possible_now.discard(predicate)
+        self.watched_values=values
+        self.checked_location=self.current_location
+        return self.possible_now
     
     def get_current_possible_abilities(self,formal_models):
         '''
         Returns the abilities that are allowed by the current state of affairs
         '''
         #current_abilities is the set of self.abilities minus those that are currently ongoing
-        potential_allowed=list(self.current_abilities)
-       
-        not_allowed=[]
-        for potential in potential_allowed:
-            if not self.possible_predicate(formal_models, potential):
-                not_allowed.append(potential)
-                    
-        for bad in not_allowed:potential_allowed.remove(bad)
-        
-        return potential_allowed
+        possible_now=self.get_possible_now(formal_models)
+        return [potential for potential in self.current_abilities if potential in possible_now]
     
     def possible_predicate(self,formal_models, predicate):
         '''
@@ -139,43 +212,14 @@ class Participant:
         if self.current_location not in self.abilities[predicate].initial_locations:
             return False
         
-        for (req,val) in self.abilities[predicate].requirements:
-            if req[0]=="p": #If the requirement concerns the previous time step
-                req=req[1:]
-                relevant_model=formal_models[0] #the model at the previous time
-            else: relevant_model=formal_models[1]#the current time step model
-                  
-            prop=[req[0]]          
-            if len(req)>1:
-                if req[1]=="me":prop.append(self.name)
-                else: prop.append(req[1])
-                
-                if len(req)>2:
-                    second_arg=req[2]
-                    
-                    if second_arg.startswith("all_"):
-                        sec_type=second_arg[4:]
-                        if sec_type=="locations":possibles=self.locations
-                        else:possibles=[f.name for f in self.microworld.things.values() if f.category==sec_type]
-                        
-                        for possib in possibles:
-                            new_prop=tuple(prop+[possib])
-                            if relevant_model.proposition_values[new_prop]!=val:return False
-                            second_arg=possib
-                    
-                    if second_arg=="any_location":
-                        checked=[]
-                        for loc in self.locations:
-                            propl=tuple(prop+loc)
-                            if relevant_model.proposition_values[propl]==val:
-                                second_arg=loc
-                                break
-                            else: checked.append(loc)
-                        if len(checked)==len(self.locations): return False
-                    prop.append(second_arg)
-                        
-            prop=tuple(prop)       
-            if relevant_model.proposition_values[prop]!=val:return False
+        if predicate not in self.compiled_requirements:self.compile_requirements()
+        for (previous,propositions,val,mode) in self.compiled_requirements[predicate]:
+            values=formal_models[0].proposition_values if previous else formal_models[1].proposition_values
+            if mode=="any":
+                if not any(values[prop]==val for prop in propositions):return False
+            else:
+                for prop in propositions:
+                    if values[prop]!=val:return False
             
         return True
    
@@ -195,13 +239,14 @@ class Participant:
         for predicate in potential_abilities:
             if self.abilities[predicate].probability_distro is not None: #If the predicate does not have a probability distro attached to it, 
                 #it means it cannot be initiated by the participant and it is more like a side effect of some other predicate
-                if not self.possible_predicate(formal_models, predicate):continue 
+                if predicate not in self.get_possible_now(formal_models):continue 
                 #If the predicate has become impossible given the developing state of affairs, we ignore it
                 
                 #If its a hit, a person needs to be at the intersection
                 if predicate=="hit":
                     people_intersection=[part.name for part in self.microworld.location_map("intersection").participants if part.category=="people"]
-                    hitting=self.abilities[predicate].get_probability_value(formal_models,self.name,random_generator)
+                    #the proposal (importance sampling) is only used when someone can actually be hit
+                    hitting=self.abilities[predicate].get_probability_value(formal_models,self.name,random_generator,use_proposal=bool(people_intersection))
                     
                     if people_intersection and hitting: #If there are people at the intersection and the bus is actually hitting
                         new_argument_string=random_generator.choice(people_intersection) #we choose someone to get hit
@@ -223,14 +268,15 @@ class Participant:
                         new_argument_string=self.abilities[predicate].get_probability_value(formal_models,self.name,random_generator)
                     
                     new_argument=self.microworld.location_map(new_argument_string)
-                    trajectory=self.locations[self.current_location].paths[new_argument_string]  
-                    durat=(len(trajectory)-1)*self.speed+1# we only take 1 step for the reaching of the final destination
+                    #the template has the trajectory and its duration
+                    template=self.abilities[predicate].get_template({"agent":self,"destination":new_argument},self.current_location)
                     new_eventuality=Eventuality(self.abilities[predicate],current_model.time,self.current_location,random_generator,
-                                    duration=durat, roles={"agent":self,"destination":new_argument}, trajectory=trajectory)
+                                    duration=template.duration, roles=template.roles, template=template)
                 
                 #If it's a single place predicate (e.g. glad, sad, fall)  
                 else:new_eventuality=Eventuality(self.abilities[predicate], current_model.time, self.current_location,random_generator, roles={"agent":self})
                 
+                self.microworld.log_start(new_eventuality)
                 new_effect_eventualities=self.microworld.apply_eventuality_effects(new_eventuality, current_model,random_generator)
                 new_eventualities.extend(new_effect_eventualities)
                 new_eventualities.append(new_eventuality)
@@ -242,6 +288,7 @@ class Participant:
            current_model.proposition_values[("stand",self.name)]==0:
             
             new_eventuality=Eventuality(self.abilities["stand"], current_model.time, self.current_location,random_generator, roles={"agent":self})   
+            self.microworld.log_start(new_eventuality)
             new_effect_eventualities=self.microworld.apply_eventuality_effects(new_eventuality, current_model,random_generator)
             new_eventualities.extend(new_effect_eventualities)
             new_eventualities.append(new_eventuality)
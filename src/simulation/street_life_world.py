@@ -23,20 +23,100 @@ Here is the definition of the Microworld "Street Life". It consists of the follo
 When all of these are defined, we can initiate the microworld and sample observations.
 '''
 
+import copy
 
+from microworld import Microworld
+from location_layout import Location_Map
+from eventualities import Eventuality_Type, boost_probability_distro
+from participants import Participant, Thing
+from exporter import export_models
 
-if __name__ == '__main__':
 
-    import copy
+def get_probability_distros():
+    '''
+    Returns the probability distributions of the eventualities, which are given to world.set_probability_distros
+    '''
+    ###PROBABILITIES###
+    #These probabilities are used ONLY when the given eventuality is possible, which depends on the current and previous 
+    #states of affairs of the microworld. Therefore, these do not reflect the true probability of the given eventualities,  
+    #they reflect P( e | e is possible at this point) 
     
-    from microworld import Microworld
-    from location_layout import Location_Map
-    from eventualities import Eventuality_Type
-    from participants import Participant, Thing
+    prob_distros={} #All of these are first stored in a dictionary
     
-    import random  
-    random.seed(10)
+    #Rain only depends on whether it was raining at the previous time step
+    prob_distros["rain"]={}
+    prob_distros["rain"][(("p","rain"),1)]  ={0:0.3, 1:0.7}
+    prob_distros["rain"][(("p","rain"),0)]  ={0:0.7, 1:0.3}
+    
+    prob_distros["smile"]={0:0.6,1:0.4}
     
+    #Eating depends on whether you were eating something in the last time step, slighly avoiding repetitions. If someone was eating something before,
+    #they are less likely to eat again
+    prob_distros["eat"]={}
+    prob_distros["eat"][(("p","result_eat","me","fries"),0,("p","result_eat","me","sandwich"),0)]  ={"fries":0.2, "sandwich":0.2, "none":0.6}
+    prob_distros["eat"][(("p","result_eat","me","fries"),1,("p","result_eat","me","sandwich"),0)]  ={"fries":0.1, "sandwich":0.1, "none":0.8}
+    prob_distros["eat"][(("p","result_eat","me","fries"),0,("p","result_eat","me","sandwich"),1)]  ={"fries":0.1, "sandwich":0.1, "none":0.8}
+    
+    #Similar as eating
+    prob_distros["drink"]={}
+    prob_distros["drink"][(("p","result_drink","me","cola"),0,("p","result_drink","me","tea"),0)]  ={"cola":0.15,"tea":0.15,"none":0.7}
+    prob_distros["drink"][(("p","result_drink","me","cola"),1,("p","result_drink","me","tea"),0)]  ={"cola":0.1, "tea":0.2, "none":0.7}
+    prob_distros["drink"][(("p","result_drink","me","cola"),0,("p","result_drink","me","tea"),1)]  ={"cola":0.2, "tea":0.1, "none":0.7}
+    
+    #People's mood only depends on the current weather and the person's mood at the previous time step
+    prob_distros["glad"]={}
+    prob_distros["sad"]={}
+    
+    prob_distros["glad"][(("rain",),1,("p","glad","me"),1,("p","sad", "me"),0)]     ={0:0.6, 1:0.4}
+    prob_distros["sad"] [(("rain",),1,("p","glad","me"),1,("p","sad", "me"),0)]     ={0:0.6, 1:0.4}
+    
+    prob_distros["glad"][(("rain",),1,("p","glad","me"),0,("p","sad", "me"),1)]     ={0:0.8, 1:0.2}
+    prob_distros["sad"] [(("rain",),1,("p","glad","me"),0,("p","sad", "me"),1)]     ={0:0.4, 1:0.6}
+    
+    prob_distros["glad"][(("rain",),1,("p","glad","me"),0,("p","sad", "me"),0)]     ={0:0.7, 1:0.3}
+    prob_distros["sad"] [(("rain",),1,("p","glad","me"),0,("p","sad", "me"),0)]     ={0:0.5, 1:0.5}
+    
+    prob_distros["glad"][(("rain",),0,("p","glad","me"),1,("p","sad", "me"),0)]     ={0:0.4, 1:0.6}
+    prob_distros["sad"] [(("rain",),0,("p","glad","me"),1,("p","sad", "me"),0)]     ={0:0.8, 1:0.2}
+        
+    prob_distros["glad"][(("rain",),0,("p","glad","me"),0,("p","sad", "me"),1)]     ={0:0.6, 1:0.4}
+    prob_distros["sad"] [(("rain",),0,("p","glad","me"),0,("p","sad", "me"),1)]     ={0:0.6, 1:0.4}
+            
+    prob_distros["glad"][(("rain",),0,("p","glad","me"),0,("p","sad", "me"),0)]     ={0:0.4,1:0.6}
+    prob_distros["sad"] [(("rain",),0,("p","glad","me"),0,("p","sad", "me"),0)]     ={0:0.8,1:0.2}
+    
+    #Falling depends on the current weather
+    prob_distros["fall"]={}
+    prob_distros["fall"][(("rain",),1)]  ={0:0.8, 1:0.2}
+    prob_distros["fall"][(("rain",),0)]  ={0:0.9, 1:0.1}
+    
+    prob_distros["stand"]       ={0:0.6,1:0.4}
+    prob_distros["walk_to"]={"jm_house":0.18, "jm_front":0.18, "h_house":0.18, "h_front":0.18, "none":0.28}
+    prob_distros["drive_to"]    ={"street_north":0.2,"street_south":0.2, "intersection":0.2, "none":0.4}
+     
+    #As with falling, the bus is more likely to hit people if it's raining
+    prob_distros["hit"]={}
+    prob_distros["hit"][(("rain",),1)]  ={0:0.5, 1:0.5}
+    prob_distros["hit"][(("rain",),0)]  ={0:0.7, 1:0.3}
+    
+    return prob_distros
+
+
+def get_rare_event_proposal_distros(prob_distros,factor=3):
+    '''
+    Proposal distributions for importance sampling, where the bus is more likely to hit the people at the intersection
+    (Participant.start_eventualities only draws from the proposal when there is someone there).
+    Falling is not boosted: a fall sends the person home, so fewer people cross the street and there are fewer hits.
+    They are given to world.set_proposal_distros, and the observations are then weighted with their likelihood ratios
+    (see Microworld.run_importance_sampled).
+    '''
+    return {"hit":boost_probability_distro(prob_distros["hit"],[1],factor)}
+
+
+def build_street_life_world():
+    '''
+    Defines the whole microworld (locations, participants, eventualities and probabilities) and returns it, ready to run
+    '''
     world = Microworld()
     
     ###LOCATIONS###
@@ -128,6 +208,13 @@ if __name__ == '__main__':
     world.eventuality_types["hit"].interrupts_patient=True
     world.eventuality_types["fall"].interrupts_agent=True
     
+    #Walking or driving to a destination MOVES the agent along the trajectory, arriving at each location in it,
+    #and people cross the street when the trajectory goes from one front to the other
+    for predicate in ["walk_to","drive_to"]:
+        world.eventuality_types[predicate].moves_agent=True
+        world.eventuality_types[predicate].arrival="arrive"
+    world.eventuality_types["walk_to"].crossings=[("jm_front","h_front","cross_street")]
+    
     #RESTRICTIONS ON WHAT EVENTUALITIES CAN CO-OCCUR
     #"me" stands for the agent's name
     #"any_location" means the requirement is fulfilled if at least for one location the proposition has the required value
@@ -161,7 +248,7 @@ if __name__ == '__main__':
             
             for agent_string in ontology[agent_type]: #We also make a link from each participant to their eventualities
                 world.participants[agent_string].abilities[predicate]=world.eventuality_types[predicate]
-                world.participants[agent_string].current_abilities.append(predicate)
+                world.participants[agent_string].current_abilities[predicate]=None
         
     world.eventuality_types["eat"].add_role_fillers("patient",ontology["food"])
     world.eventuality_types["drink"].add_role_fillers("patient",ontology["refreshments"])
@@ -183,71 +270,17 @@ if __name__ == '__main__':
     #world.print_eventualities()
     #world.print_propositions()
     
-    ###PROBABILITIES###
-    #These probabilities are used ONLY when the given eventuality is possible, which depends on the current and previous 
-    #states of affairs of the microworld. Therefore, these do not reflect the true probability of the given eventualities,  
-    #they reflect P( e | e is possible at this point) 
-    
-    prob_distros={} #All of these are first stored in a dictionary
-    
-    #Rain only depends on whether it was raining at the previous time step
-    prob_distros["rain"]={}
-    prob_distros["rain"][(("p","rain"),1)]  ={0:0.3, 1:0.7}
-    prob_distros["rain"][(("p","rain"),0)]  ={0:0.7, 1:0.3}
-    
-    prob_distros["smile"]={0:0.6,1:0.4}
-    
-    #Eating depends on whether you were eating something in the last time step, slighly avoiding repetitions. If someone was eating something before,
-    #they are less likely to eat again
-    prob_distros["eat"]={}
-    prob_distros["eat"][(("p","result_eat","me","fries"),0,("p","result_eat","me","sandwich"),0)]  ={"fries":0.2, "sandwich":0.2, "none":0.6}
-    prob_distros["eat"][(("p","result_eat","me","fries"),1,("p","result_eat","me","sandwich"),0)]  ={"fries":0.1, "sandwich":0.1, "none":0.8}
-    prob_distros["eat"][(("p","result_eat","me","fries"),0,("p","result_eat","me","sandwich"),1)]  ={"fries":0.1, "sandwich":0.1, "none":0.8}
-    
-    #Similar as eating
-    prob_distros["drink"]={}
-    prob_distros["drink"][(("p","result_drink","me","cola"),0,("p","result_drink","me","tea"),0)]  ={"cola":0.15,"tea":0.15,"none":0.7}
-    prob_distros["drink"][(("p","result_drink","me","cola"),1,("p","result_drink","me","tea"),0)]  ={"cola":0.1, "tea":0.2, "none":0.7}
-    prob_distros["drink"][(("p","result_drink","me","cola"),0,("p","result_drink","me","tea"),1)]  ={"cola":0.2, "tea":0.1, "none":0.7}
-    
-    #People's mood only depends on the current weather and the person's mood at the previous time step
-    prob_distros["glad"]={}
-    prob_distros["sad"]={}
-    
-    prob_distros["glad"][(("rain",),1,("p","glad","me"),1,("p","sad", "me"),0)]     ={0:0.6, 1:0.4}
-    prob_distros["sad"] [(("rain",),1,("p","glad","me"),1,("p","sad", "me"),0)]     ={0:0.6, 1:0.4}
-    
-    prob_distros["glad"][(("rain",),1,("p","glad","me"),0,("p","sad", "me"),1)]     ={0:0.8, 1:0.2}
-    prob_distros["sad"] [(("rain",),1,("p","glad","me"),0,("p","sad", "me"),1)]     ={0:0.4, 1:0.6}
-    
-    prob_distros["glad"][(("rain",),1,("p","glad","me"),0,("p","sad", "me"),0)]     ={0:0.7, 1:0.3}
-    prob_distros["sad"] [(("rain",),1,("p","glad","me"),0,("p","sad", "me"),0)]     ={0:0.5, 1:0.5}
-    
-    prob_distros["glad"][(("rain",),0,("p","glad","me"),1,("p","sad", "me"),0)]     ={0:0.4, 1:0.6}
-    prob_distros["sad"] [(("rain",),0,("p","glad","me"),1,("p","sad", "me"),0)]     ={0:0.8, 1:0.2}
-        
-    prob_distros["glad"][(("rain",),0,("p","glad","me"),0,("p","sad", "me"),1)]     ={0:0.6, 1:0.4}
-    prob_distros["sad"] [(("rain",),0,("p","glad","me"),0,("p","sad", "me"),1)]     ={0:0.6, 1:0.4}
-            
-    prob_distros["glad"][(("rain",),0,("p","glad","me"),0,("p","sad", "me"),0)]     ={0:0.4,1:0.6}
-    prob_distros["sad"] [(("rain",),0,("p","glad","me"),0,("p","sad", "me"),0)]     ={0:0.8,1:0.2}
-    
-    #Falling depends on the current weather
-    prob_distros["fall"]={}
-    prob_distros["fall"][(("rain",),1)]  ={0:0.8, 1:0.2}
-    prob_distros["fall"][(("rain",),0)]  ={0:0.9, 1:0.1}
-    
-    prob_distros["stand"]       ={0:0.6,1:0.4}
-    prob_distros["walk_to"]={"jm_house":0.18, "jm_front":0.18, "h_house":0.18, "h_front":0.18, "none":0.28}
-    prob_distros["drive_to"]    ={"street_north":0.2,"street_south":0.2, "intersection":0.2, "none":0.4}
-     
-    #As with falling, the bus is more likely to hit people if it's raining
-    prob_distros["hit"]={}
-    prob_distros["hit"][(("rain",),1)]  ={0:0.5, 1:0.5}
-    prob_distros["hit"][(("rain",),0)]  ={0:0.7, 1:0.3}
+    #We integreate the probabilities into the microworld
+    world.set_probability_distros(get_probability_distros())
+    return world
+
+
+if __name__ == '__main__':
+
+    import random  
+    random.seed(10)
     
-    #We integreate this probabilities into the microworld
-    world.set_probability_distros(prob_distros)
+    world = build_street_life_world()
   
   
   
@@ -255,20 +288,9 @@ if __name__ == '__main__':
     #Let the world run for n=30,000 time steps
     models=world.run(1000,random)
     
-    #Then we save the generated observations into file
-    with open("../outputs/street_life1K.observations",'w') as output_file:
-        models[0].print_basic_propositions(file=output_file) 
-        for model in models: model.print_binary_vector(file=output_file)
-    
-    exit()
-    #The files that are generated below are quite verbosed, so they are mostly used for debugging because they can become huge if we sample say 10,000 observations
-    with open("../outputs/street_life_model/formal_models1000.txt",'w') as output_file: 
-        for model in models:
-            model.print_me(only_true=False,file=output_file)
-            output_file.write("\n")
-            
-    with open("../outputs/street_life_model/formal_models_onlytrue1000.txt",'w') as output_file: 
-        for model in models:
-            model.print_me(file=output_file)
-            output_file.write("\n")
-            
\ No newline at end of file
+    #Then we save the generated observations into file (see exporter.py)
+    #The verbose traces are mostly used for debugging, they are compressed because they become huge if we sample say 100,000 observations
+    write_traces=False
+    export_models(models,"../outputs/street_life1K.observations",
+                  verbose_path="../outputs/formal_models1000.txt.gz" if write_traces else None,
+                  only_true_path="../outputs/formal_models_onlytrue1000.txt.gz" if write_traces else None)
@@ -0,0 +1,360 @@
+'''
+%        Copyright 2022 Jesús Calvillo <jescalvillot@gmail.com>
+%
+%      Licensed under the Apache License, Version 2.0 (the "License");
+%      you may not use this file except in compliance with the License.
+%      You may obtain a copy of the License at
+%
+%           http://www.apache.org/licenses/LICENSE-2.0
+%
+%     Unless required by applicable law or agreed to in writing, software
+%     distributed under the License is distributed on an "AS IS" BASIS,
+%     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+%     See the License for the specific language governing permissions and
+%     limitations under the License.
+
+Checks that a matrix of observations (e.g. a long run after changing the engine) obeys the rules of its microworld,
+and compares the empirical frequencies of the eventualities with the probabilities given to set_probability_distros.
+
+The rules are compiled once from the world definition into column masks, and each of them is checked over the whole
+matrix in a vectorized pass:
+- each participant is in exactly one place at each time step
+- an eventuality with several possible arguments (e.g. eat fries/sandwich) begins with at most one of them at a time
+- the requirements of an eventuality hold whenever its first phase is true (e.g. never glad and sad, smile only when glad,
+  begin_fall only while walking)
+- an eventuality begins only at one of its initial_locations
+
+    world=build_street_life_world()
+    checker=World_Checker(world)
+    checker.print_report(checker.check(matrix,basic_props))
+    print_cpt_report(get_cpt_report(world,matrix,basic_props))
+
+The CPT report estimates P(value | eventuality possible, conditioning factors), which is what prob_distros specifies,
+with Wilson confidence intervals. Whether an eventuality was possible is reconstructed from the observations, so the
+estimates are approximate for eventualities whose requirements refer to the current time step (the simulator checks them
+while the time step is being built) and for eventualities that can be started by other mechanisms (see FORCED_PREDICATES).
+'''
+
+import numpy as np
+
+from online_statistics import proposition_label
+
+#Predicates that are also started without drawing from their probability distribution
+#(people that are not walking, falling or standing are made to stand, see Participant.start_eventualities)
+FORCED_PREDICATES=["stand"]
+
+
+def wilson_interval(successes,trials,z=1.96):
+    '''
+    Wilson score interval of a binomial proportion
+    '''
+    if trials==0:return (0.0,1.0)
+    proportion=successes/trials
+    denominator=1+z**2/trials
+    center=(proportion+z**2/(2*trials))/denominator
+    half_width=z*np.sqrt(proportion*(1-proportion)/trials+z**2/(4*trials**2))/denominator
+    return (max(0.0,center-half_width),min(1.0,center+half_width))
+
+
+def get_first_phase_propositions(eventuality_type,participant):
+    '''
+    Propositions that are true when the participant begins the eventuality (the begin_ phase, or the predicate itself if it has no phases)
+    '''
+    if eventuality_type.phases:phase_predicate=eventuality_type.phases[0]+eventuality_type.name
+    else:phase_predicate=eventuality_type.name
+    return eventuality_type.get_agent_phase_propositions(phase_predicate,participant)
+
+
+def get_checkable_requirements(eventuality_type):
+    '''
+    Requirements of an eventuality, except those on propositions that the eventuality itself turns on when it begins
+    (walk_to requires not walking, and makes the agent walk)
+    '''
+    own_consequences=[consequence[1] for (consequence,value) in eventuality_type.consequences if consequence[0]=="b"]
+    return [(requirement,value) for (requirement,value) in eventuality_type.requirements
+            if requirement[0] not in own_consequences]
+
+
+class Column_Index:
+    '''
+    Maps propositions (tuples) to the columns of a matrix given its basic propositions (labels)
+    '''
+    def __init__(self,basic_props):
+        self.index={label:i for i,label in enumerate(basic_props)}
+
+    def __call__(self,propositions):
+        return [self.index[proposition_label(prop)] for prop in propositions if proposition_label(prop) in self.index]
+
+
+class World_Checker:
+    def __init__(self,world):
+        self.world=world
+
+    def compile_rules(self,basic_props):
+        '''
+        Returns a list of rules (name, kind, data) whose data are columns of the matrix
+        '''
+        columns=Column_Index(basic_props)
+        rules=[]
+        for participant in self.world.participants.values():
+            name=participant.name
+            place_columns=columns([("place",name,location) for location in participant.locations])
+            rules.append(("one place for "+name,"exactly_one",place_columns))
+
+            for eventuality_type in participant.abilities.values():
+                first_phase=columns(get_first_phase_propositions(eventuality_type,participant))
+                if not first_phase:continue
+                if len(first_phase)>1:rules.append(("one argument for "+eventuality_type.name+" of "+name,"at_most_one",first_phase))
+
+                for (requirement,value) in get_checkable_requirements(eventuality_type):
+                    lag=0
+                    if requirement[0]=="p":(requirement,lag)=(requirement[1:],1)
+                    required_columns,mode=self.get_requirement_columns(requirement,participant,columns)
+                    rules.append(("%s of %s requires %s=%d%s"%(eventuality_type.name,name,str(requirement),value," (previous step)" if lag else ""),
+                                  "requirement",(first_phase,required_columns,mode,value,lag)))
+
+                #Eventualities that are effects of others (e.g. arrive) do not check their initial locations
+                if eventuality_type.probability_distro is None:continue
+                initial_locations=[location for location in eventuality_type.initial_locations if location in participant.locations]
+                if initial_locations and len(initial_locations)<len(participant.locations):
+                    rules.append(("%s of %s begins at %s"%(eventuality_type.name,name,"/".join(initial_locations)),"initial_location",
+                                  (first_phase,columns([("place",name,location) for location in initial_locations]),bool(eventuality_type.phases))))
+        return rules
+
+    def get_requirement_columns(self,requirement,participant,columns):
+        '''
+        Columns of a requirement, with "me", "any_location" and "all_..." resolved as in Participant.possible_predicate
+        '''
+        proposition=[requirement[0]]
+        if len(requirement)>1:proposition.append(participant.name if requirement[1]=="me" else requirement[1])
+        if len(requirement)>2:
+            second_argument=requirement[2]
+            if second_argument=="any_location":
+                return columns([tuple(proposition+[location]) for location in participant.locations]),"any"
+            if second_argument.startswith("all_"):
+                category=second_argument[4:]
+                if category=="locations":possibles=list(participant.locations)
+                else:possibles=[thing.name for thing in self.world.things.values() if thing.category==category]
+                return columns([tuple(proposition+[possible]) for possible in possibles]),"all"
+            proposition.append(second_argument)
+        return columns([tuple(proposition)]),"all"
+
+    def check(self,matrix,basic_props):
+        '''
+        Returns one result per rule: {"rule","kind","violations","first_violation"} (first_violation is a time step or None)
+        '''
+        matrix=np.asarray(matrix)!=0
+        results=[]
+        for (name,kind,data) in self.compile_rules(basic_props):
+            if kind=="exactly_one":violated=matrix[:,data].sum(axis=1)!=1
+            elif kind=="at_most_one":violated=matrix[:,data].sum(axis=1)>1
+            elif kind=="requirement":
+                (first_phase,required_columns,mode,value,lag)=data
+                active=matrix[:,first_phase].any(axis=1)
+                required=matrix[:,required_columns]
+                holds=required.any(axis=1) if mode=="any" and value==1 else (required==bool(value)).all(axis=1)
+                if lag:holds=np.r_[True,holds[:-1]]
+                violated=active&~holds
+            else:
+                (first_phase,location_columns,phased)=data
+                active=matrix[:,first_phase].any(axis=1)
+                #Eventualities without phases can go on after moving, so only their onset is checked
+                if not phased:active=active&~np.r_[False,active[:-1]]
+                violated=active&~matrix[:,location_columns].any(axis=1)
+            violations=np.flatnonzero(violated)
+            results.append({"rule":name,"kind":kind,"violations":len(violations),
+                            "first_violation":int(violations[0]) if len(violations) else None})
+        return results
+
+    def print_report(self,results):
+        for result in results:
+            status="OK" if not result["violations"] else "VIOLATED %d times (first at t=%d)"%(result["violations"],result["first_violation"])
+            print(result["rule"],status)
+        print(sum(1 for result in results if not result["violations"]),"/",len(results),"rules hold")
+
+
+#############################################################################################################
+#### CPT RECOVERY
+#############################################################################################################
+def get_effective_distribution(distribution,current_location):
+    '''
+    Destination eventualities draw again while they get the current location (excluding "none" in the new draws),
+    see Participant.start_eventualities
+    '''
+    if current_location not in distribution:return dict(distribution)
+    redraw_mass=sum(probability for value,probability in distribution.items() if value not in [current_location,"none"])
+    effective={}
+    for value,probability in distribution.items():
+        if value==current_location:effective[value]=0.0
+        elif value=="none":effective[value]=probability
+        else:effective[value]=probability+distribution[current_location]*probability/redraw_mass
+    return effective
+
+
+def _get_factor_values(matrix,factors,agent_name,columns):
+    '''
+    Value of each conditioning factor at each time step>=1, as get_probability_value computes them
+    '''
+    values=[]
+    for factor in factors:
+        proposition=[agent_name if value=="me" else value for value in factor]
+        if proposition[0]=="p":
+            column=matrix[:-1,columns([tuple(proposition[1:])])[0]]
+        else:column=matrix[1:,columns([tuple(proposition)])[0]]
+        values.append(column.astype(np.int64))
+    return values
+
+
+def get_eligible_steps(world,matrix,eventuality_type,participant,columns,checker):
+    '''
+    Time steps t>=1 at which the participant could have begun the eventuality, reconstructed from the observations:
+    at an initial location, not doing it already, not interrupted and with its requirements fulfilled.
+    Also returns whether the reconstruction is approximate (requirements on the current time step).
+    '''
+    name=participant.name
+    current,previous=matrix[1:],matrix[:-1]
+    location_names=list(participant.locations)
+    places=current[:,columns([("place",name,location) for location in location_names])]
+    eligible=places[:,[i for i,location in enumerate(location_names) if location in eventuality_type.initial_locations]].any(axis=1)
+
+    #Ongoing: the later phases at t, or the predicate at t-1 if it has no phases (it can end at t-1 and begin again at t,
+    #but both cases look the same)
+    if eventuality_type.phases:
+        later_phases=[prop for phase in eventuality_type.phases[1:] for prop in eventuality_type.get_agent_phase_propositions(phase+eventuality_type.name,participant)]
+        eligible&=~current[:,columns(later_phases)].any(axis=1)
+    else:eligible&=~previous[:,columns(eventuality_type.get_agent_propositions(participant))].any(axis=1)
+
+    #Interrupted participants do not begin eventualities (see Microworld.run)
+    for other_type in world.eventuality_types.values():
+        if other_type.interrupts_agent and other_type.phases and other_type.name in participant.abilities:
+            eligible&=~current[:,columns(other_type.get_agent_phase_propositions(other_type.phases[1]+other_type.name,participant))].any(axis=1)
+        if other_type.interrupts_patient and name in other_type.roles.get("patient",[]):
+            patient_columns=columns([(other_type.name,agent,name) for agent in other_type.roles.get("agent",[])])
+            eligible&=~(current[:,patient_columns].any(axis=1)|previous[:,patient_columns].any(axis=1))
+
+    approximate=False
+    for (requirement,value) in get_checkable_requirements(eventuality_type):
+        lag=0
+        if requirement[0]=="p":(requirement,lag)=(requirement[1:],1)
+        else:approximate=True
+        required_columns,mode=checker.get_requirement_columns(requirement,participant,columns)
+        holds=_requirement_holds(matrix[1-lag:len(matrix)-lag][:,required_columns],mode,value)
+        #Requirements on the current step are checked while it is being built: a true requirement has to be true already
+        #at t-1 (and still at t); a false one can be false at t, or false at t-1 and turned on later in the step
+        if not lag:
+            holds_before=_requirement_holds(previous[:,required_columns],mode,value)
+            holds=holds&holds_before if value else holds|holds_before
+        eligible&=holds
+    return eligible,approximate
+
+
+def _requirement_holds(required,mode,value):
+    if mode=="any" and value==1:return required.any(axis=1)
+    return (required==bool(value)).all(axis=1)
+
+
+def get_cpt_report(world,matrix,basic_props,z=1.96,prob_distros=None):
+    '''
+    Returns one row per (eventuality, conditioning factors, value):
+    {"eventuality","condition","value","eligible","occurrences","estimate","ci_low","ci_high","specified","within_ci","approximate"}
+    '''
+    if prob_distros is None:prob_distros=world.probability_distros
+    matrix=np.asarray(matrix)!=0
+    columns=Column_Index(basic_props)
+    checker=World_Checker(world)
+    rows=[]
+
+    for ev_name,distribution in prob_distros.items():
+        if ev_name in FORCED_PREDICATES:continue
+        eventuality_type=world.eventuality_types[ev_name]
+        one_key=list(distribution.keys())[0]
+        conditional=isinstance(one_key,tuple)
+        factors=list(one_key[0::2]) if conditional else []
+        keys=list(distribution.keys()) if conditional else [()]
+
+        #totals[key][value]=(occurrences, eligible, sum of specified probabilities)
+        totals={key:{} for key in keys}
+        approximate=False
+        agents=[participant for participant in world.participants.values() if ev_name in participant.abilities]
+
+        if not agents: #World level eventualities (rain) are drawn at every time step
+            outcome=matrix[1:,columns([(ev_name,)])[0]]
+            factor_values=_get_factor_values(matrix,factors,"none",columns)
+            eligible=np.ones(len(outcome),dtype=bool)
+            _add_counts(totals,keys,distribution,conditional,factor_values,eligible,{0:~outcome,1:outcome},None)
+        for participant in agents:
+            eligible,approximate_requirements=get_eligible_steps(world,matrix,eventuality_type,participant,columns,checker)
+            approximate|=approximate_requirements
+            first_phase=get_first_phase_propositions(eventuality_type,participant)
+            started=matrix[1:][:,columns(first_phase)]
+            if "patient" in eventuality_type.roles and eventuality_type.interrupts_patient:
+                #Someone has to be there to be hit; the patient is sent back to their initial location in the same time step
+                patients=[world.participants[patient] for patient in eventuality_type.roles["patient"]]
+                present=matrix[1:][:,columns([("place",patient.name,location) for patient in patients for location in eventuality_type.initial_locations])]
+                eligible&=present.any(axis=1)|started.any(axis=1)
+                outcomes={1:started.any(axis=1),0:~started.any(axis=1)}
+            elif len(first_phase)==1:outcomes={1:started.any(axis=1),0:~started.any(axis=1)}
+            else:
+                outcomes={proposition[-1]:started[:,i] for i,proposition in enumerate(first_phase)}
+                outcomes["none"]=~started.any(axis=1)
+            current_locations=None
+            if "destination" in eventuality_type.roles:
+                location_names=list(participant.locations)
+                places=matrix[1:][:,columns([("place",participant.name,location) for location in location_names])]
+                current_locations=np.array(location_names)[places.argmax(axis=1)]
+            factor_values=_get_factor_values(matrix,factors,participant.name,columns)
+            _add_counts(totals,keys,distribution,conditional,factor_values,eligible,outcomes,current_locations)
+
+        for key in keys:
+            for value,(occurrences,eligible_count,specified_sum) in totals[key].items():
+                estimate=occurrences/eligible_count if eligible_count else float("nan")
+                specified=specified_sum/eligible_count if eligible_count else float("nan")
+                ci_low,ci_high=wilson_interval(occurrences,eligible_count,z)
+                rows.append({"eventuality":ev_name,"condition":key,"value":value,"eligible":eligible_count,"occurrences":occurrences,
+                             "estimate":estimate,"ci_low":ci_low,"ci_high":ci_high,"specified":specified,
+                             "within_ci":bool(eligible_count and ci_low<=specified<=ci_high),"approximate":approximate})
+    return rows
+
+
+def _add_counts(totals,keys,distribution,conditional,factor_values,eligible,outcomes,current_locations):
+    for key in keys:
+        selected=eligible.copy()
+        if conditional:
+            for factor_value,required in zip(factor_values,key[1::2]):selected&=factor_value==required
+        n_selected=int(selected.sum())
+        specification=distribution[key] if conditional else distribution
+        for value in specification:
+            occurred=outcomes.get(value,np.zeros(len(selected),dtype=bool))
+            if current_locations is None:specified_sum=specification[value]*n_selected
+            else:
+                specified_sum=sum(get_effective_distribution(specification,location)[value]*count
+                                  for location,count in zip(*np.unique(current_locations[selected].astype(str),return_counts=True)))
+            previous=totals[key].get(value,(0,0,0.0))
+            totals[key][value]=(previous[0]+int((occurred&selected).sum()),previous[1]+n_selected,previous[2]+specified_sum)
+
+
+def print_cpt_report(rows):
+    print("eventuality  condition  value  eligible  estimate  [95% CI]  specified")
+    for row in rows:
+        condition=" ".join(str(part) for part in row["condition"])
+        if not row["eligible"]:
+            print("%s  %s  %s  not observable"%(row["eventuality"],condition,row["value"]))
+            continue
+        flag="" if row["within_ci"] else ("  (approximate)" if row["approximate"] else "  <--")
+        print("%s  %s  %s  %d  %.3f  [%.3f, %.3f]  %.3f%s"%(row["eventuality"],condition,row["value"],row["eligible"],row["estimate"],
+                                                         row["ci_low"],row["ci_high"],row["specified"],flag))
+
+
+if __name__ == '__main__':
+    import random
+    from street_life_world import build_street_life_world
+
+    random.seed(10)
+    world=build_street_life_world()
+    models=world.run(10000,random,verbose=False)
+    basic_props=[proposition_label(prop) for prop in world.propositions]
+    matrix=np.array([[model.proposition_values[prop] for prop in world.propositions] for model in models])
+
+    checker=World_Checker(world)
+    checker.print_report(checker.check(matrix,basic_props))
+    print_cpt_report(get_cpt_report(world,matrix,basic_props))